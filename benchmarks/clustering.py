@@ -0,0 +1,115 @@
+"""
+Row groups read and time of date bounded queries with and without clustering.
+
+Loads a DataSynthetic jp_data file, then rewrites jptradedata and its hts rollup
+in a random order (the order of the rows in the raw file) and in the cluster
+order of recluster, and reports for each layout the row groups DuckDB reads
+and the time of queries that filter by date. DuckDB skips the row groups whose min/max
+date are outside the filter, so the clustered layout reads fewer row groups.
+
+    python -m benchmarks.clustering --rows 5000000
+"""
+
+from src.data.data_synthetic import DataSynthetic
+from src.data.data_process import DataTrade
+import argparse
+import tempfile
+import shutil
+import re
+import time
+
+queries = {
+    "fact year": (
+        "jptradedata",
+        "2020-01-01",
+        "2020-12-01",
+        """
+        SELECT SUM(data) FROM jptradedata
+        WHERE date BETWEEN '2020-01-01' AND '2020-12-01'
+        """,
+    ),
+    "fact month": (
+        "jptradedata",
+        "2020-06-01",
+        "2020-06-01",
+        """
+        SELECT SUM(data) FROM jptradedata
+        WHERE date = '2020-06-01' AND hts_id BETWEEN 100 AND 200
+        """,
+    ),
+    "rollup year": (
+        "jptradedata_hts",
+        "2020-01-01",
+        "2020-12-01",
+        """
+        SELECT hts_id, SUM(data) FROM jptradedata_hts
+        WHERE date BETWEEN '2020-01-01' AND '2020-12-01'
+        GROUP BY hts_id
+        """,
+    ),
+}
+
+
+def row_groups(d: DataTrade, table: str, start: str, end: str) -> tuple:
+    # Row groups whose min/max date overlap the range, the ones DuckDB reads
+    bounds = {}
+    for group, stats in d.conn.raw_sql(
+        f"""
+        SELECT row_group_id, stats FROM pragma_storage_info('{table}')
+        WHERE column_name = 'date' AND segment_type != 'VALIDITY'
+        """
+    ).fetchall():
+        low, high = re.search(r"Min: ([\d-]{10}).*Max: ([\d-]{10})", stats).groups()
+        low = min(low, bounds.get(group, (low, high))[0])
+        high = max(high, bounds.get(group, (low, high))[1])
+        bounds[group] = (low, high)
+    read = sum(low <= end and high >= start for low, high in bounds.values())
+    return read, len(bounds)
+
+
+def measure(d: DataTrade) -> dict:
+    result = {}
+    for name, (table, start, end, sql) in queries.items():
+        times = []
+        for i in range(5):
+            begin = time.perf_counter()
+            d.conn.raw_sql(sql).fetchall()
+            times.append(time.perf_counter() - begin)
+        result[name] = (*row_groups(d, table, start, end), min(times))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saving_dir = tmp + "/"
+        d = DataTrade(saving_dir, saving_dir + "bench.ddb", saving_dir + "bench.log")
+        DataSynthetic().write_jp(d.jp_data, args.rows)
+        shutil.copy("data/external/code_units.json", saving_dir + "external/")
+        d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+
+        d.recluster("jptradedata", ["hash(id)"])
+        d.recluster("jptradedata_hts", ["hash(date, hts_id, trade_id, agri_prod)"])
+        random = measure(d)
+        start = time.perf_counter()
+        d.recluster()
+        seconds = time.perf_counter() - start
+        clustered = measure(d)
+
+    print(f"{args.rows} rows, recluster {seconds:.2f}s")
+    print(f"{'':<12} {'random':>24} {'clustered':>24}")
+    for name in queries:
+        print(
+            f"{name:<12}"
+            + "".join(
+                f" {read:>5}/{total:<5} groups {t:>6.3f}s"
+                for read, total, t in [random[name], clustered[name]]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Peak memory of the raw CSV to parquet conversion done by pull_int_jp.
+
+Writes a synthetic CSV with the columns of ftrade_all_iepr.csv and converts it
+once with the old eager path (read_csv + write_parquet) and once with
+DataPull.csv_to_parquet. Each conversion runs in its own process so the peak
+memory reported is only from that conversion. Linux only, it reads /proc.
+
+    python -m benchmarks.csv_to_parquet --rows 5000000
+"""
+
+from benchmarks.memory import memory, track_anon
+from src.data.data_pull import DataPull
+import numpy as np
+import polars as pl
+import subprocess
+import argparse
+import tempfile
+import time
+import sys
+import os
+
+
+def write_csv(path: str, rows: int, chunk: int = 1_000_000) -> None:
+    rng = np.random.default_rng(0)
+    with open(path, "wb") as file:
+        for start in range(0, rows, chunk):
+            n = min(chunk, rows - start)
+            df = pl.DataFrame(
+                {
+                    column: (
+                        rng.integers(0, 10_000_000, n)
+                        if dtype == pl.Int64
+                        else rng.integers(0, 5_000, n).astype(str)
+                    )
+                    for column, dtype in DataPull.jp_schema.items()
+                }
+            ).with_columns(
+                Trade=pl.lit("i"),
+                Year=pl.lit(2020),
+                Month=pl.lit(1),
+                Commodity_description=pl.lit("synthetic commodity description"),
+            )
+            df.write_csv(file, include_header=start == 0)
+
+
+def convert(mode: str, csv_file: str, parquet_file: str) -> None:
+    if mode == "eager":
+        pl.read_csv(csv_file, ignore_errors=True).write_parquet(parquet_file)
+    else:
+        saving_dir = os.path.dirname(csv_file) + "/"
+        d = DataPull(saving_dir, saving_dir + "bench.ddb", saving_dir + "bench.log")
+        d.csv_to_parquet([csv_file], parquet_file, d.jp_schema)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--mode", choices=["eager", "streaming"])
+    parser.add_argument("--csv")
+    args = parser.parse_args()
+
+    if args.mode:
+        peak = track_anon()
+        start = time.perf_counter()
+        convert(args.mode, args.csv, args.csv + f".{args.mode}.parquet")
+        elapsed = time.perf_counter() - start
+        time.sleep(0.05)
+        print(
+            f"{args.mode:<10} {elapsed:>8.1f}s {peak['anon']:>10.0f} MB"
+            f" {memory()['VmHWM']:>10.0f} MB"
+        )
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "jp_data.csv")
+        write_csv(csv_file, args.rows)
+        size = os.path.getsize(csv_file) / 1024**2
+        print(f"{args.rows} rows, {size:.0f} MB csv")
+        print(f"{'mode':<10} {'time':>9} {'peak anon':>13} {'peak rss':>13}")
+        for mode in ["eager", "streaming"]:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.csv_to_parquet",
+                    "--mode",
+                    mode,
+                    "--csv",
+                    csv_file,
+                ],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
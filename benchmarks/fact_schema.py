@@ -0,0 +1,89 @@
+"""
+Database size and scan times of the default and the compact fact schema.
+
+Loads the same DataSynthetic jp_data file into a database with the default
+schema and into one with compact=True, then reports the insert time, the size
+of the database file and the time of queries that scan jptradedata directly
+(the process_* methods read the rollups, which are built from these scans).
+
+    python -m benchmarks.fact_schema --rows 5000000
+"""
+
+from src.data.data_synthetic import DataSynthetic
+from src.data.data_process import DataTrade
+import argparse
+import tempfile
+import shutil
+import time
+import os
+
+queries = {
+    "date range": """
+        SELECT SUM(data) FROM jptradedata
+        WHERE date BETWEEN '2020-01-01' AND '2020-12-01'
+        """,
+    "hts filter": """
+        SELECT date, SUM(data) FROM jptradedata
+        WHERE hts_id IN (SELECT id FROM htstable WHERE hts_code LIKE '01%')
+        GROUP BY date
+        """,
+    "full scan": """
+        SELECT country_id, trade_id, SUM(data), SUM(qty_kg) FROM jptradedata
+        GROUP BY country_id, trade_id
+        """,
+}
+
+
+def load(saving_dir: str, raw: str, compact: bool) -> dict:
+    os.makedirs(saving_dir)
+    d = DataTrade(
+        saving_dir, saving_dir + "bench.ddb", saving_dir + "bench.log", compact=compact
+    )
+    shutil.copy(raw, d.jp_data)
+    shutil.copy("data/external/code_units.json", saving_dir + "external/")
+    start = time.perf_counter()
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    result = {"insert": time.perf_counter() - start}
+    d.conn.raw_sql("CHECKPOINT")
+    # Blocks used by the fact table, of 256 KB
+    blocks = d.conn.raw_sql(
+        "SELECT COUNT(DISTINCT block_id) FROM pragma_storage_info('jptradedata')"
+    ).fetchone()[0]
+    result["fact MB"] = blocks / 4
+    result["file MB"] = os.path.getsize(d.data_file) / 1024**2
+    for name, sql in queries.items():
+        times = []
+        for i in range(5):
+            start = time.perf_counter()
+            d.conn.raw_sql(sql).fetchall()
+            times.append(time.perf_counter() - start)
+        result[name] = min(times)
+    start = time.perf_counter()
+    d.build_rollup("jptradedata")
+    result["rollups"] = time.perf_counter() - start
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "jp_data.parquet")
+        DataSynthetic().write_jp(raw, args.rows)
+        default = load(tmp + "/default/", raw, False)
+        compact = load(tmp + "/compact/", raw, True)
+
+    print(f"{args.rows} rows")
+    print(f"{'':<12} {'default':>10} {'compact':>10}")
+    for name in default:
+        unit = "" if name.endswith("MB") else "s"
+        print(
+            f"{name:<12} {default[name]:>9.2f}{unit or ' '}"
+            f" {compact[name]:>9.2f}{unit or ' '}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Memory measurements shared by the benchmarks. Linux only, they read /proc.
+"""
+
+import threading
+import time
+
+
+def memory() -> dict:
+    with open("/proc/self/status") as file:
+        return {
+            line.split(":")[0]: int(line.split()[1]) / 1024
+            for line in file
+            if line.startswith(("VmHWM", "RssAnon"))
+        }
+
+
+def sample_anon(peak: dict, interval: float = 0.01) -> None:
+    # Memory mapped files are counted by VmHWM as well. The heap used by the
+    # process is the anonymous part, which has no high water mark.
+    while True:
+        peak["anon"] = max(peak["anon"], memory()["RssAnon"])
+        time.sleep(interval)
+
+
+def track_anon() -> dict:
+    peak = {"anon": 0}
+    threading.Thread(target=sample_anon, args=(peak,), daemon=True).start()
+    return peak
@@ -0,0 +1,99 @@
+"""
+Latency of process_int_jp and process_int_org with and without the compiled plans.
+
+Loads the test samples and answers the same request shapes with a different
+datetime and level_filter on every call, so the result cache never hits. The
+"build" column is the ibis expression building and compilation that the plans
+skip and "execute" is the time DuckDB spends running the query.
+
+    python -m benchmarks.plan_cache --calls 50
+"""
+
+from src.data.data_process import DataTrade
+from src.data.data_cache import PlanCache
+import argparse
+import tempfile
+import shutil
+import time
+
+shapes = [
+    ("jp", dict(level="total", time_frame="yearly")),
+    ("jp", dict(level="hts", time_frame="monthly")),
+    ("jp", dict(level="naics", time_frame="qrt")),
+    ("jp", dict(level="hts4", time_frame="yearly")),
+    ("jp", dict(level="total", time_frame="fiscal", group=True)),
+    ("org", dict(level="country", time_frame="monthly")),
+]
+prefixes = {"total": [""], "hts": ["0", "1", "2", "3"], "hts4": ["0", "1", "2", "3"]}
+prefixes.update(naics=["1", "2", "3"], country=["1", "2", "3", "4", "5"])
+
+
+def requests(calls: int) -> list:
+    result = []
+    for i in range(calls):
+        start = f"{2018 + i % 3}-{1 + i % 12:02d}-01"
+        end = f"{2020 + i % 2}-{1 + (i * 5) % 12:02d}-01"
+        for source, shape in shapes:
+            options = prefixes[shape["level"]]
+            datetime = start if i % 4 == 0 else f"{start}+{end}"
+            result.append(
+                (
+                    source,
+                    dict(
+                        shape, datetime=datetime, level_filter=options[i % len(options)]
+                    ),
+                )
+            )
+    return result
+
+
+def run(d: DataTrade, calls: list) -> tuple:
+    build = execute = 0.0
+    for source, kwargs in calls:
+        method = (
+            DataTrade.process_int_jp if source == "jp" else DataTrade.process_int_org
+        )
+        method = method.__wrapped__
+        if d.plans is None:
+            start = time.perf_counter()
+            expr = method(d, **kwargs)
+            sql = d.conn.compile(expr)
+            middle = time.perf_counter()
+            d.conn.con.sql(sql).arrow()
+            execute += time.perf_counter() - middle
+            build += middle - start
+        else:
+            start = time.perf_counter()
+            d.run_query(method, kwargs, {"phases": {}})
+            execute += time.perf_counter() - start
+    return build, execute
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saving_dir = tmp + "/"
+        d = DataTrade(saving_dir, saving_dir + "bench.ddb", saving_dir + "bench.log")
+        shutil.copy("test/test_inserts/jp_data_sample.parquet", d.jp_data)
+        shutil.copy("test/test_inserts/org_data_sample.parquet", d.org_data)
+        shutil.copy("data/external/code_units.json", saving_dir + "external/")
+        shutil.copy("data/external/code_classification.json", saving_dir + "external/")
+        d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+        d.insert_int_org(d.org_data)
+
+        calls = requests(args.calls)
+        print(f"{len(calls)} calls, {len(shapes)} shapes")
+        print(f"{'mode':<8} {'build':>10} {'execute':>10} {'per call':>10}")
+        for mode in ["ibis", "plans"]:
+            d.plans = None if mode == "ibis" else PlanCache()
+            run(d, calls[: len(shapes)])
+            build, execute = run(d, calls)
+            total = (build + execute) / len(calls) * 1000
+            print(f"{mode:<8} {build:>9.2f}s {execute:>9.2f}s {total:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
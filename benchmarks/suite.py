@@ -0,0 +1,151 @@
+"""
+Wall time and peak memory of the ingest and the queries of DataTrade.
+
+Generates raw jp_data and org_data files with the given number of rows with
+DataSynthetic (~20k HTS codes, 240 countries, 30 years), loads them with
+insert_int_jp and insert_int_org and runs every (time_frame, level) shape of
+process_data, the agriculture filter and process_price against the loaded
+database. Every case runs in its own process so the peak memory reported is
+only from that case. Linux only, it reads /proc.
+
+    python -m benchmarks.suite --rows 1000000 --output results.json
+    python -m benchmarks.suite --rows 1000000 --compare results.json
+
+With --compare the cases more than --threshold slower than the saved results
+are reported and the exit code is 1.
+"""
+
+from benchmarks.memory import memory, track_anon
+from src.data.data_synthetic import DataSynthetic
+from src.data.data_process import DataTrade
+import numpy as np
+import subprocess
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+time_frames = ["yearly", "fiscal", "qrt", "monthly"]
+levels = ["total", "naics", "hts", "country"]
+
+
+def cases() -> list:
+    result = ["insert_int_jp", "insert_int_org"]
+    result += [f"jp/{tf}/{level}" for tf in time_frames for level in levels]
+    result += [f"jp/monthly/{level}/agri" for level in levels]
+    result += ["price", "price/agri"]
+    return result
+
+
+def run_case(case: str, saving_dir: str, repeat: int) -> dict:
+    database = saving_dir + "bench.ddb"
+    read_only = not case.startswith("insert")
+    peak = track_anon()
+    d = DataTrade(saving_dir, database, saving_dir + "bench.log", read_only=read_only)
+    times = []
+    for i in range(1 if not read_only else repeat):
+        start = time.perf_counter()
+        match case.split("/"):
+            case ["insert_int_jp"]:
+                d.insert_int_jp(d.jp_data, d.agr_file)
+            case ["insert_int_org"]:
+                d.insert_int_org(d.org_data)
+            case ["jp", time_frame, level, *agri]:
+                df = d.process_int_jp(
+                    level=level, time_frame=time_frame, agriculture_filter=bool(agri)
+                )
+                rows = df.to_pyarrow().num_rows
+            case ["price", *agri]:
+                rows = d.process_price(agriculture_filter=bool(agri)).to_pyarrow()
+                rows = rows.num_rows
+        times.append(time.perf_counter() - start)
+    time.sleep(0.05)
+    return {
+        "case": case,
+        "seconds": min(times),
+        "median": float(np.median(times)),
+        "peak_anon_mb": peak["anon"],
+        "peak_rss_mb": memory()["VmHWM"],
+        "rows": rows if read_only else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--case")
+    parser.add_argument("--dir")
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.dir, args.repeat)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        saving_dir = tmp + "/"
+        for folder in ["raw", "external", "processed"]:
+            os.makedirs(saving_dir + folder)
+        for file in ["code_agr.json", "code_units.json"]:
+            shutil.copy(f"data/external/{file}", saving_dir + "external/")
+        start = time.perf_counter()
+        data = DataSynthetic()
+        data.write_jp(saving_dir + "raw/jp_data.parquet", args.rows)
+        data.write_org(saving_dir + "raw/org_data.parquet", args.rows)
+        print(f"{args.rows} rows generated in {time.perf_counter() - start:.1f}s")
+        print(
+            f"{'case':<24} {'time':>9} {'median':>9} {'peak anon':>11} {'peak rss':>10}"
+        )
+
+        for case in cases():
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.suite",
+                    "--case",
+                    case,
+                    "--dir",
+                    saving_dir,
+                    "--repeat",
+                    str(args.repeat),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            result = json.loads(process.stdout.splitlines()[-1])
+            results.append(result)
+            print(
+                f"{case:<24} {result['seconds']:>8.3f}s {result['median']:>8.3f}s"
+                f" {result['peak_anon_mb']:>8.0f} MB {result['peak_rss_mb']:>7.0f} MB"
+            )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"rows": args.rows, "results": results}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = {r["case"]: r for r in json.load(file)["results"]}
+        slower = [
+            r
+            for r in results
+            if r["case"] in baseline
+            and r["seconds"] > baseline[r["case"]]["seconds"] * (1 + args.threshold)
+        ]
+        for r in slower:
+            before = baseline[r["case"]]["seconds"]
+            print(f"slower: {r['case']} {before:.3f}s -> {r['seconds']:.3f}s")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+from collections import OrderedDict
+import pyarrow.parquet as pq
+import pyarrow as pa
+import sqlglot.expressions as sge
+import functools
+import threading
+import hashlib
+import inspect
+import logging
+import time
+import json
+import os
+
+
+class ResultCache:
+    """
+    Two tier cache for query results. Recent results are kept in memory (LRU) and
+        every result is also saved as a parquet file in the cache directory, which
+        is bounded in size by removing the least recently used files.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_items: int = 128,
+        max_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        Initialize the ResultCache class.
+
+        Parameters
+        ----------
+        cache_dir: str
+            Directory to save the cached results.
+        max_items: int
+            Number of results kept in memory.
+        max_bytes: int
+            Maximum size in bytes of the cache directory.
+
+        Returns
+        -------
+        None
+        """
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, method: str, version: str, params: dict) -> str:
+        """
+        Returns the cache key of a call.
+
+        Parameters
+        ----------
+        method: str
+            Name of the method called.
+        version: str
+            Version stamp of the data in the database.
+        params: dict
+            Arguments of the call.
+
+        Returns
+        -------
+        str
+            Hash identifying the call and the data it was computed from.
+        """
+        return call_key(method, version, params)
+
+    def get(self, key: str) -> pa.Table | None:
+        """
+        Returns the cached result of a key, looking in memory first and then on disk.
+
+        Parameters
+        ----------
+        key: str
+            Key returned by the key method.
+
+        Returns
+        -------
+        pa.Table | None
+            The cached result or None if the key is not cached.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            path = os.path.join(self.cache_dir, f"{key}.parquet")
+            if not os.path.exists(path):
+                return None
+            table = pq.read_table(path)
+            os.utime(path)
+            self.put_memory(key, table)
+            return table
+
+    def put(self, key: str, table: pa.Table) -> None:
+        """
+        Saves a result in memory and on disk, evicting the least recently used
+            results that do not fit.
+
+        Parameters
+        ----------
+        key: str
+            Key returned by the key method.
+        table: pa.Table
+            The result to cache.
+
+        Returns
+        -------
+        None
+        """
+        with self.lock:
+            self.put_memory(key, table)
+            pq.write_table(table, os.path.join(self.cache_dir, f"{key}.parquet"))
+            self.evict_disk()
+
+    def put_memory(self, key: str, table: pa.Table) -> None:
+        self.memory[key] = table
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def evict_disk(self) -> None:
+        files = [
+            os.path.join(self.cache_dir, file)
+            for file in os.listdir(self.cache_dir)
+            if file.endswith(".parquet")
+        ]
+        files.sort(key=os.path.getmtime)
+        size = sum(os.path.getsize(file) for file in files)
+        while files and size > self.max_bytes:
+            file = files.pop(0)
+            size -= os.path.getsize(file)
+            os.remove(file)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            for file in os.listdir(self.cache_dir):
+                if file.endswith(".parquet"):
+                    os.remove(os.path.join(self.cache_dir, file))
+
+
+class PlanCache:
+    """
+    Compiled SQL of the query methods. A plan is compiled once for each shape of
+        call, with placeholders in place of the dates and the code prefix, and is
+        then executed with the values of each call bound as parameters.
+    """
+
+    # Placeholders compiled into the plans and the parameters that replace them
+    placeholders = {
+        "start": "1000-01-01",
+        "end": "1000-01-02",
+        "date": "1000-01-03",
+        "prefix": "plan_prefix",
+    }
+
+    def __init__(self, max_items: int = 256):
+        """
+        Initialize the PlanCache class.
+
+        Parameters
+        ----------
+        max_items: int
+            Number of plans kept.
+
+        Returns
+        -------
+        None
+        """
+        self.max_items = max_items
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, method: str, shape: dict) -> str:
+        return json.dumps([method, shape], sort_keys=True, default=str)
+
+    def get(self, key: str) -> tuple | None:
+        with self.lock:
+            if key in self.plans:
+                self.plans.move_to_end(key)
+            return self.plans.get(key)
+
+    def put(self, key: str, query: sge.Expression, params: list, schema) -> tuple:
+        """
+        Saves a compiled plan after replacing its placeholders with parameters. The
+            placeholders are replaced in the syntax tree, so only string literals
+            equal to a placeholder are changed, however they are quoted or cast.
+
+        Parameters
+        ----------
+        key: str
+            Key returned by the key method.
+        query: sqlglot.Expression
+            The query compiled with the placeholders.
+        params: list
+            The parameters whose placeholders were used to compile the plan.
+        schema: ibis.Schema
+            Schema of the result.
+
+        Returns
+        -------
+        tuple
+            The SQL with $parameters, the parameters it uses and the schema.
+
+        Raises
+        ------
+        ValueError
+            If a placeholder is left in the SQL (e.g. inside a longer literal), the
+            plan is not saved.
+        """
+        names = {self.placeholders[param]: param for param in params}
+        used = []
+
+        def replace(node: sge.Expression) -> sge.Expression:
+            if isinstance(node, sge.Literal) and node.is_string and node.this in names:
+                used.append(names[node.this])
+                return sge.Placeholder(this=names[node.this])
+            return node
+
+        sql = query.transform(replace).sql(dialect="duckdb")
+        for placeholder in self.placeholders.values():
+            if placeholder in sql:
+                raise ValueError(f"The placeholder {placeholder} is left in the plan")
+        used = [param for param in params if param in used]
+        with self.lock:
+            self.plans[key] = (sql, used, schema)
+            self.plans.move_to_end(key)
+            while len(self.plans) > self.max_items:
+                self.plans.popitem(last=False)
+        return (sql, used, schema)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.plans.clear()
+
+
+def call_key(method: str, version: str, params: dict) -> str:
+    payload = json.dumps([method, version, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached(method):
+    """
+    Caches the result of a DataTrade query method. The key is the method name, its
+        arguments and the data version, so inserting new data invalidates it. The
+        result is returned as an ibis table of the connection of the calling thread.
+        On a miss the result is computed from the compiled plan of the call. With
+        a profiler the calls are also executed without the cache, and recorded.
+    """
+
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.cache is None and self.profiler is None:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        params = signature.bind(self, *args, **kwargs)
+        params.apply_defaults()
+        params = dict(list(params.arguments.items())[1:])
+        key = call_key(method.__name__, self.data_version, params)
+        record = {
+            "method": method.__name__,
+            "params": params,
+            "shape": json.dumps(self.plan_shape(params)[0], sort_keys=True),
+            "phases": {},
+            "cache": None,
+        }
+
+        table = None if self.cache is None else self.cache.get(key)
+        if table is None:
+            if self.cache is not None:
+                logging.debug(f"Cache miss for {method.__name__} {params}")
+                record["cache"] = "miss"
+            table = self.run_query(method, params, record)
+            if self.cache is not None:
+                self.cache.put(key, table)
+        else:
+            record["cache"] = "hit"
+        result = self.result_table(key, table)
+        if self.profiler is not None:
+            record.update(seconds=time.perf_counter() - start, rows_returned=len(table))
+            self.log_event("query", **record)
+        return result
+
+    return wrapper
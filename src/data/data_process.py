@@ -1,6 +1,22 @@
+from ..models import init_version_table
+from .data_cache import PlanCache, ResultCache, cached
+from .data_profile import QueryProfiler, timed
 from .data_pull import DataPull
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from dateutil.relativedelta import relativedelta
+from ibis.backends.duckdb.converter import DuckDBPyArrowData
+import ibis.expr.operations as ops
+import sqlglot.expressions as sge
 import polars as pl
+import pyarrow as pa
+import threading
+import asyncio
+import hashlib
+import uuid
+import bisect
+import json
+import logging
 import ibis
 import os
 
@@ -10,11 +26,44 @@ class DataTrade(DataPull):
     Data processing class for the various data sources in DataPull.
     """
 
+    # Grouping columns of the monthly rollups materialized for each fact table
+    rollup_levels = {
+        "jptradedata": {
+            "total": [],
+            "naics": ["naics_id"],
+            "hts": ["hts_id"],
+            "country": ["country_id"],
+        },
+        "inttradedata": {
+            "total": [],
+            "hts": ["hts_id"],
+            "country": ["country_id"],
+        },
+    }
+
+    # Threads of the pool that runs the async query methods
+    async_workers = 4
+    # Results of the cached or profiled calls kept registered in each connection
+    registered_results = 128
+
+    # Columns that identify a period of each time frame
+    time_columns = {
+        "yearly": ["year"],
+        "fiscal": ["fiscal_year"],
+        "qrt": ["year", "qrt"],
+        "monthly": ["year", "month"],
+    }
+
     def __init__(
         self,
         saving_dir: str = "data/",
         database_file: str = "data.ddb",
         log_file: str = "data_process.log",
+        storage: str = "duckdb",
+        read_only: bool = False,
+        cache: bool = False,
+        profiler: QueryProfiler | None = None,
+        compact: bool = False,
     ):
         """
         Initialize the DataProcess class.
@@ -25,16 +74,650 @@ class DataTrade(DataPull):
             Directory to save the data.
         debug: bool
             Will print debug information in the console if True.
+        storage: str
+            Where the fact tables are stored. The options are "duckdb" (inside the
+            database file) and "parquet" (hive partitioned files in the processed
+            directory).
+        read_only: bool
+            Open the database file in read only mode so several query processes
+            can share it.
+        cache: bool
+            Cache the results of process_int_jp, process_int_org and process_price
+            in memory and in the processed/cache directory, and the compiled SQL
+            of their calls. The cache is invalidated when new data is inserted.
+        profiler: QueryProfiler
+            Records the phases, SQL and rows of every query and the inserts. The
+            queries are executed when called instead of returning lazy tables.
+        compact: bool
+            Create the fact tables with the compact schema: DATE dates, narrow
+            integer ids, no surrogate key and no foreign keys (the ids are checked
+            at load), and rows sorted by date and hts_id. Only for the "duckdb"
+            storage, and only when the fact tables are created.
 
         Returns
         -------
         None
         """
-        super().__init__(saving_dir, database_file, log_file)
+        super().__init__(
+            saving_dir, database_file, log_file, storage, read_only, compact
+        )
         self.jp_data = os.path.join(self.saving_dir, "raw/jp_data.parquet")
         self.org_data = os.path.join(self.saving_dir, "raw/org_data.parquet")
         self.agr_file = os.path.join(self.saving_dir, "external/code_agr.json")
+        self.cache = (
+            ResultCache(os.path.join(self.saving_dir, "processed/cache"))
+            if cache
+            else None
+        )
+        self.plans = PlanCache() if cache else None
+        self.profiler = profiler
+        self.executor = None
+        self.inflight = {}
+        self.data_version, self.database_id = self.get_version()
+        self.bootstrap()
+
+    def insert_int_jp(self, file: str, agr_file: str) -> list:
+        months = super().insert_int_jp(file, agr_file)
+        self.build_rollup("jptradedata", months)
+        if months and "categorytable" in self.tables:
+            self.build_categories()
+        self.bump_version("jptradedata", months)
+        self.bootstrap()
+        return months
+
+    def insert_int_org(self, file: str, update: bool = False) -> list:
+        months = super().insert_int_org(file, update)
+        self.build_rollup("inttradedata", months)
+        self.build_price(months)
+        self.bump_version("inttradedata", months)
+        self.bootstrap()
+        return months
+
+    def bootstrap(self) -> None:
+        """
+        Loads the state used to answer queries without probing the database: the
+            existing tables, their ibis expressions, sorted indexes of the HTS,
+            NAICS and country codes used to validate the level_filter and the last
+            month of the price panel. Called on initialization and after every
+            insert.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.tables = set(self.conn.list_tables())
+        self.table_exprs = {}
+        if self.plans is not None:
+            self.plans.clear()
+        # The prepared plans keep the statistics of the data they were planned on,
+        # a new token makes every thread prepare them again
+        self.plan_token = object()
+        self.code_index = {}
+        for level, table, column in [
+            ("hts", "htstable", "hts_code"),
+            ("naics", "naicstable", "naics_code"),
+            ("country", "countrytable", "cty_code"),
+        ]:
+            if table not in self.tables:
+                continue
+            codes = (
+                self.table(table)
+                .select(code=self.table(table)[column].cast("string"), id="id")
+                .to_polars()
+                .drop_nulls()
+                .sort("code")
+            )
+            self.code_index[level] = (codes["code"].to_list(), codes["id"].to_list())
+        # Last month of the price panel, where the window of process_price ends
+        name = self.rollup_name("inttradedata", "price")
+        self.price_date = None
+        if name in self.tables:
+            self.price_date = self.table(name).date.max().execute()
+
+    def table(self, name: str) -> ibis.expr.types.relations.Table:
+        # The expressions are bound to the connection of the thread that made them
+        key = (threading.get_ident(), name)
+        if key not in self.table_exprs:
+            self.table_exprs[key] = self.conn.table(name)
+        return self.table_exprs[key]
+
+    def base_level(self, level: str) -> str:
+        """
+        Returns the level a code prefix level is computed from (e.g. "hts" for
+            "hts4"). Other levels are returned unchanged.
+
+        Parameters
+        ----------
+        level: str
+            The level to process.
 
+        Returns
+        -------
+        str
+        """
+        base = level.rstrip("0123456789")
+        if base != level and int(level[len(base) :]) in self.code_prefixes.get(
+            base, []
+        ):
+            return base
+        return level
+
+    def join_prefix(
+        self, df: ibis.expr.types.relations.Table, level: str
+    ) -> ibis.expr.types.relations.Table:
+        """
+        Adds the integer code prefix of a prefix level (e.g. hts4) to the rollup of
+            its base level, so the data can be aggregated by the prefix.
+
+        Parameters
+        ----------
+        df: ibis.expr.types.relations.Table
+            The rollup of the base level.
+        level: str
+            The prefix level (e.g. "hts4").
+
+        Returns
+        -------
+        ibis.expr.types.relations.Table
+        """
+        base = self.base_level(level)
+        codes = self.table(f"{base}table")
+        codes = codes.select(**{f"{base}_id": codes.id, level: codes[level]})
+        return df.join(codes, f"{base}_id")
+
+    def build_categories(self) -> None:
+        """
+        Materializes the categorytable that maps every NAICS id to its category in
+            code_classification.json. A code takes the category of its longest
+            prefix in the file (e.g. 3254 before 325), and is null if none match.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        file = os.path.join(self.saving_dir, "external/code_classification.json")
+        if not os.path.exists(file):
+            self.pull_file(
+                url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_classification.json",
+                filename=file,
+            )
+        with open(file) as f:
+            classification = json.load(f)
+        categories = pl.DataFrame(
+            {
+                "prefix": list(classification.keys()),
+                "category": list(classification.values()),
+            }
+        )
+        naics = self.conn.table("naicstable").select("id", "naics_code").to_polars()
+        matches = (
+            naics.join(categories, how="cross")
+            .filter(pl.col("naics_code").str.starts_with(pl.col("prefix")))
+            .sort(pl.col("prefix").str.len_chars(), descending=True)
+            .unique("id", keep="first")
+        )
+        df = naics.join(matches.select("id", "category"), on="id", how="left")
+        df = df.select(naics_id=pl.col("id"), category=pl.col("category"))
+        self.conn.create_table("categorytable", df, overwrite=True)
+        self.tables.add("categorytable")
+        self.table_exprs = {
+            key: expr
+            for key, expr in self.table_exprs.items()
+            if key[1] != "categorytable"
+        }
+        self.log_event("build", table="categorytable", rows=len(df))
+
+    def join_category(
+        self, df: ibis.expr.types.relations.Table
+    ) -> ibis.expr.types.relations.Table:
+        if "categorytable" not in self.tables:
+            self.build_categories()
+        # Rows without a NAICS code are kept with a null category
+        df = df.left_join(self.table("categorytable"), "naics_id")
+        return df.drop("naics_id_right")
+
+    def lookup_codes(self, level: str, prefix: str) -> list:
+        """
+        Returns the ids of the codes of a level that start with the prefix, using the
+            in-memory code index.
+
+        Parameters
+        ----------
+        level: str
+            The level of the codes. The options are "hts", "naics" and "country".
+        prefix: str
+            The beginning of the codes to find.
+
+        Returns
+        -------
+        list
+            The ids of the matching codes. Empty if no code matches.
+        """
+        codes, ids = self.code_index.get(level, ([], []))
+        start = bisect.bisect_left(codes, prefix)
+        end = bisect.bisect_left(codes, prefix + "\uffff")
+        return ids[start:end]
+
+    def check_level_filter(self, level: str, level_filter: str) -> None:
+        """
+        Raises a ValueError if no code of the level starts with the level_filter.
+            The placeholder of the compiled plans is accepted, the real value is
+            checked by run_query when the plan is executed.
+
+        Parameters
+        ----------
+        level: str
+            The level of the codes. The options are "hts", "naics" and "country".
+        level_filter: str
+            The beginning of the codes to find.
+
+        Returns
+        -------
+        None
+        """
+        if level_filter == PlanCache.placeholders["prefix"]:
+            return
+        if not self.lookup_codes(level, level_filter):
+            names = {"hts": "HTS", "naics": "NAICS", "country": "Country"}
+            raise ValueError(f"Invalid {names[level]} code: {level_filter}")
+
+    def plan_shape(self, params: dict) -> tuple:
+        """
+        Splits the arguments of a query call into its shape (the arguments with
+            placeholders in place of the dates and the level_filter) and the values
+            bound to the placeholders.
+
+        Parameters
+        ----------
+        params: dict
+            Arguments of the call.
+
+        Returns
+        -------
+        tuple
+            The shape (dict) and the values of the parameters (dict).
+        """
+        placeholders = PlanCache.placeholders
+        shape = dict(params)
+        values = {}
+        if "datetime" in params:
+            times = params["datetime"].split("+")
+            if params["datetime"] == "":
+                pass
+            elif len(times) == 2:
+                shape["datetime"] = f"{placeholders['start']}+{placeholders['end']}"
+                values.update(start=times[0], end=times[1])
+            elif len(times) == 1:
+                shape["datetime"] = placeholders["date"]
+                values.update(date=times[0])
+        if "level_filter" in params:
+            shape["level_filter"] = placeholders["prefix"]
+            values.update(prefix=params["level_filter"])
+        return shape, values
+
+    def run_query(self, method, params: dict, record: dict) -> pa.Table:
+        """
+        Executes a query method and returns its result. With the plan cache the
+            query is executed from the compiled plan of its shape, which is
+            compiled on the first call of the shape with placeholders in place of
+            the dates and level_filter. The plan is prepared once per connection
+            and the values of each call are bound to it, skipping the ibis
+            expression building, the compilation and the DuckDB planning.
+
+        Parameters
+        ----------
+        method: function
+            The undecorated query method.
+        params: dict
+            Arguments of the call.
+        record: dict
+            Receives the time of each phase, the SQL, the rows returned and, if
+            the profiler explains the queries, the plan and the table rows.
+
+        Returns
+        -------
+        pa.Table
+            The result of the call.
+        """
+        phases = record["phases"]
+        shape, values = self.plan_shape(params)
+        plan = None
+        if self.plans is not None:
+            key = self.plans.key(method.__name__, shape)
+            plan = self.plans.get(key)
+            record["plan_cache"] = "miss" if plan is None else "hit"
+        else:
+            shape, values = params, {}
+
+        if plan is None:
+            with timed(phases, "build"):
+                expr = method(self, **shape)
+            if expr.op().find(ops.InMemoryTable):
+                # Literal tables (process_batch) are registered by ibis, and their
+                # plans are not reused. The expression is only built again if it was
+                # built with placeholders
+                if shape != params:
+                    with timed(phases, "build"):
+                        expr = method(self, **params)
+                with timed(phases, "execute"):
+                    return expr.to_pyarrow()
+            with timed(phases, "compile"):
+                query = self.conn.compiler.to_sqlglot(expr)
+            plan = (query.sql(dialect="duckdb"), [], expr.schema())
+            if self.plans is not None:
+                try:
+                    plan = self.plans.put(key, query, list(values), expr.schema())
+                except ValueError:
+                    # The plan can not be reused, the query is built with the
+                    # values of the call instead
+                    logging.debug(f"Plan not cached for {method.__name__} {shape}")
+                    with timed(phases, "build"):
+                        expr = method(self, **params)
+                    with timed(phases, "execute"):
+                        return expr.to_pyarrow()
+        sql, used, schema = plan
+
+        if "prefix" in used:
+            self.check_level_filter(self.base_level(params["level"]), values["prefix"])
+        values = {k: values[k] for k in used}
+        with timed(phases, "execute"):
+            if self.plans is None:
+                table = self.conn.con.execute(sql).arrow()
+            else:
+                table = self.execute_plan(sql, values)
+        with timed(phases, "convert"):
+            table = DuckDBPyArrowData.convert_table(table, schema)
+        record.update(sql=sql, rows_returned=table.num_rows)
+        if self.profiler is not None and self.profiler.explain:
+            explain = self.conn.con.execute(
+                f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", values
+            ).fetchall()[0][1]
+            explain = json.loads(explain)
+            record.update(plan=explain, table_rows=self.table_rows(explain))
+        return table
+
+    def execute_plan(self, sql: str, values: dict) -> pa.Table:
+        """
+        Executes a plan as a prepared statement of the connection of the current
+            thread. The statement is prepared on the first call of the plan, the
+            later calls only bind the values. The statements are prepared again
+            after bootstrap, as DuckDB plans them with the statistics of the data.
+
+        Parameters
+        ----------
+        sql: str
+            The SQL of the plan with $parameters.
+        values: dict
+            The values of the parameters.
+
+        Returns
+        -------
+        pa.Table
+            The result of the plan.
+        """
+        con = self.conn.con
+        # Statements prepared on the connection of this thread since the bootstrap
+        prepared = getattr(self.local, "prepared", {})
+        if (
+            prepared.get("con") is not con
+            or prepared["token"] is not self.plan_token
+            or len(prepared["names"]) >= self.plans.max_items
+        ):
+            if prepared.get("con") is con:
+                for old in prepared["names"]:
+                    con.execute(f"DEALLOCATE {old}")
+            prepared = {"con": con, "token": self.plan_token, "names": set()}
+            self.local.prepared = prepared
+        name = "plan_" + hashlib.sha256(sql.encode()).hexdigest()[:16]
+        if name not in prepared["names"]:
+            con.execute(f"PREPARE {name} AS {sql}")
+            prepared["names"].add(name)
+        # EXECUTE takes no $parameters, the values are bound as quoted literals
+        args = ", ".join(
+            f'"{param}" := {sge.convert(str(value)).sql(dialect="duckdb")}'
+            for param, value in values.items()
+        )
+        return con.execute(
+            f"EXECUTE {name}({args})" if args else f"EXECUTE {name}"
+        ).arrow()
+
+    def table_rows(self, plan: dict) -> int:
+        # Sum of the rows of the tables scanned in an EXPLAIN ANALYZE plan. DuckDB
+        # reports the cardinality of the table as operator_rows_scanned even when
+        # the zonemaps skip row groups, so it is not the number of rows read
+        return plan.get("operator_rows_scanned", 0) + sum(
+            self.table_rows(child) for child in plan.get("children", [])
+        )
+
+    def result_table(
+        self, key: str, table: pa.Table
+    ) -> ibis.expr.types.relations.Table:
+        """
+        Returns a cached result as a table of the connection of the current thread,
+            so results can be queried from several threads at the same time. The
+            most recent results of each thread (registered_results) stay
+            registered in its connection.
+
+        Parameters
+        ----------
+        key: str
+            Cache key of the result.
+        table: pa.Table
+            The result.
+
+        Returns
+        -------
+        ibis.expr.types.relations.Table
+        """
+        if getattr(self.local, "results", None) is None:
+            self.local.results = OrderedDict()
+        results = self.local.results
+        name = f"result_{key[:16]}"
+        self.conn.con.register(name, table)
+        results[name] = None
+        results.move_to_end(name)
+        while len(results) > self.registered_results:
+            self.conn.con.unregister(results.popitem(last=False)[0])
+        return self.conn.table(name)
+
+    def get_version(self) -> tuple:
+        """
+        Returns the data version stamp and the id of the database. A database
+            without them (new, or made before the stamps) gets a random id and a
+            stamp of the month totals of its fact tables, so two databases never
+            share cached results.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tuple
+            The version stamp and the database id.
+        """
+        tables = self.conn.list_tables()
+        if (
+            "versiontable" in tables
+            and "database_id" in self.conn.table("versiontable").columns
+        ):
+            version = self.conn.table("versiontable").to_polars()
+            if not version.is_empty() and version["database_id"][0]:
+                return version["version"][0] or "", version["database_id"][0]
+        database_id = uuid.uuid4().hex
+        payload = database_id
+        for table in ["jptradedata", "inttradedata"]:
+            if table in tables:
+                totals = self.table_totals(table).sort("date")
+                payload += f"|{table}|{totals.write_csv()}"
+        version = hashlib.sha256(payload.encode()).hexdigest()
+        if not self.read_only:
+            self.save_version(version, database_id)
+        return version, database_id
+
+    def save_version(self, version: str, database_id: str) -> None:
+        if "versiontable" not in self.conn.list_tables():
+            init_version_table(self.data_file)
+        if "database_id" not in self.conn.table("versiontable").columns:
+            self.conn.raw_sql('ALTER TABLE "versiontable" ADD COLUMN database_id TEXT')
+        self.conn.insert(
+            "versiontable",
+            pl.DataFrame(
+                {"id": [1], "version": [version], "database_id": [database_id]}
+            ),
+            overwrite=True,
+        )
+
+    def bump_version(self, table: str, months: list) -> None:
+        """
+        Changes the data version stamp after an insert. The new stamp is a hash of
+            the previous one, the database id and the month totals (rows, value
+            and quantity) of the months that were loaded, so cached results
+            computed before the insert, or from another database, are not used.
+
+        Parameters
+        ----------
+        table: str
+            The fact table that was updated.
+        months: list
+            The months (as dates) that were loaded.
+
+        Returns
+        -------
+        None
+        """
+        if not months:
+            return
+        totals = self.table_totals(table).filter(pl.col("date").is_in(months))
+        payload = (
+            f"{self.database_id}|{self.data_version}|{table}|"
+            f"{totals.sort('date').write_csv()}"
+        )
+        self.data_version = hashlib.sha256(payload.encode()).hexdigest()
+        self.save_version(self.data_version, self.database_id)
+
+    def rollup_name(self, table: str, level: str) -> str:
+        return f"{table}_{level}"
+
+    def build_rollup(self, table: str, months: list | None = None) -> None:
+        """
+        Materialize the monthly rollups of a fact table, one table per level. The
+            rollups keep the trade_id, calendar and agriculture columns so that
+            process_data can aggregate them to any time frame without reading the
+            fact table. The rows are sorted by date and the level column, so date
+            bounded queries only read the row groups of their months.
+
+        Parameters
+        ----------
+        table: str
+            The fact table to rollup. The options are "jptradedata" and "inttradedata".
+        months: list
+            Only refresh these months (as dates) of the existing rollups. Rebuilds
+            the rollups completely if None or if they do not exist yet.
+
+        Returns
+        -------
+        None
+        """
+        if months is not None and not months:
+            return
+        self.add_fact_columns(table)
+        hts = self.conn.table("htstable").select("id", "agri_prod").rename(agr_id="id")
+        df = self.conn.table(table)
+        df = df.left_join(hts, df.hts_id == hts.agr_id)
+        df = df.mutate(agri_prod=df.agri_prod.fill_null(False))
+        df = self.conversion(df)
+
+        for level, columns in self.rollup_levels[table].items():
+            name = self.rollup_name(table, level)
+            keys = ["date", "year", "month", "qrt", "fiscal_year", "trade_id"]
+            refresh = months is not None and name in self.conn.list_tables()
+            rollup = (
+                df.filter(
+                    df.year.isin(sorted({month.year for month in months}))
+                    & df.month.isin(sorted({month.month for month in months}))
+                    & df.date.cast("date").isin(months)
+                )
+                if refresh
+                else df
+            )
+            rollup = (
+                rollup.group_by(keys + columns + ["agri_prod"])
+                .aggregate(
+                    [rollup.data.sum().name("data"), rollup.qty.sum().name("qty")]
+                )
+                .order_by(["date"] + columns)
+            )
+            if refresh:
+                self.delete_months(name, months)
+                self.conn.insert(name, rollup)
+            else:
+                self.conn.create_table(name, rollup, overwrite=True)
+            self.log_event("build", table=name, months=len(months) if refresh else None)
+
+    def recluster(self, table: str | None = None, columns: list | None = None) -> None:
+        """
+        Rewrites a table in the order of its cluster columns, see DataPull.recluster.
+            If table is None the fact tables and all their rollups are rewritten,
+            the rollups sorted by date and their level column. Run it after
+            incremental inserts to restore the date order of the row groups.
+
+        Parameters
+        ----------
+        table: str
+            The table to rewrite. The fact tables and their rollups if None.
+        columns: list
+            The columns to sort by. Defaults to cluster_columns.
+
+        Returns
+        -------
+        None
+        """
+        if table is not None:
+            super().recluster(table, columns)
+            return
+        super().recluster()
+        for fact, levels in self.rollup_levels.items():
+            for level, level_columns in levels.items():
+                super().recluster(
+                    self.rollup_name(fact, level), ["date"] + level_columns
+                )
+
+    def load_rollup(self, table: str, level: str) -> ibis.expr.types.relations.Table:
+        """
+        Returns the rollup of a fact table for a level, building it from the fact
+            table or inserting the raw data first if it does not exist yet.
+
+        Parameters
+        ----------
+        table: str
+            The fact table. The options are "jptradedata" and "inttradedata".
+        level: str
+            The level of the rollup (e.g. "hts").
+
+        Returns
+        -------
+        ibis.expr.types.relations.Table
+        """
+        rollup = self.rollup_name(table, level)
+        if rollup not in self.tables and table in self.tables:
+            self.build_rollup(table)
+            self.bootstrap()
+        elif rollup not in self.tables and table == "jptradedata":
+            self.insert_int_jp(self.jp_data, self.agr_file)
+        elif rollup not in self.tables:
+            self.insert_int_org(self.org_data)
+        return self.table(rollup)
+
+    @cached
     def process_int_jp(
         self,
         level: str,
@@ -54,7 +737,8 @@ class DataTrade(DataPull):
         level: str
             Type of data to process. The options are "total", "naics", "hs", and "country".
         group: bool
-            Group the data by the classification. (Not implemented yet)
+            Group the data by the categories of code_classification.json instead of
+            the level. Only for the "total" and "naics" levels.
         level_filter:
             search and filter for the data for the given level
 
@@ -66,72 +750,61 @@ class DataTrade(DataPull):
         """
 
         switch = [time_frame, level]
+        base = self.base_level(level)
 
-        if "jptradedata" not in self.conn.list_tables():
-            self.insert_int_jp(self.jp_data, self.agr_file)
-        if int(self.conn.table("jptradedata").count().execute()) == 0:
-            self.insert_int_jp(self.jp_data, self.agr_file)
+        if base not in self.rollup_levels["jptradedata"]:
+            raise ValueError(f"Invalid switch: {switch}")
+        if group and base not in ["total", "naics"]:
+            raise ValueError(
+                "Grouping is only available for the total and naics levels"
+            )
+        df = self.load_rollup("jptradedata", "naics" if group else base)
         if datetime == "":
-            df = self.conn.table("jptradedata")
+            pass
         elif len(datetime.split("+")) == 2:
             times = datetime.split("+")
             start = times[0]
             end = times[1]
-            df = self.conn.table("jptradedata")
             df = df.filter((df.date >= start) & (df.date <= end))
         elif len(datetime.split("+")) == 1:
-            df = self.conn.table("jptradedata")
             df = df.filter(df.date == datetime)
         else:
             raise ValueError('Invalid time format. Use "date" or "start_date+end_date"')
 
         if agriculture_filter:
-            hts = (
-                self.conn.table("htstable")
-                .select("id", "agri_prod")
-                .rename(agr_id="id")
-            )
-            df = df.join(hts, df.hts_id == hts.agr_id)
             df = df.filter(df.agri_prod)
 
-        if level == "hts":
-            hts_table = self.conn.table("htstable")
-            df_hts = hts_table.filter(hts_table.hts_code.startswith(level_filter))
-            if df_hts.execute().empty:
-                raise ValueError(f"Invalid HTS code: {level_filter}")
-            hts_ids = df_hts["id"]
+        if base == "hts":
+            self.check_level_filter("hts", level_filter)
+            hts_table = self.table("htstable")
+            hts_ids = hts_table.filter(hts_table.hts_code.startswith(level_filter)).id
 
             df = df.filter(df["hts_id"].isin(hts_ids))
-        elif level == "naics":
-            naics_table = self.conn.table("naicstable")
-            df_naics = naics_table.filter(
+        elif base == "naics":
+            self.check_level_filter("naics", level_filter)
+            naics_table = self.table("naicstable")
+            naics_ids = naics_table.filter(
                 naics_table.naics_code.startswith(level_filter)
-            )
-            if df_naics.execute().empty:
-                raise ValueError(f"Invalid NAICS code: {level_filter}")
-            naics_ids = df_naics["id"]
+            ).id
 
             df = df.filter(df["naics_id"].isin(naics_ids))
-        elif level == "country":
-            country_table = self.conn.table("countrytable")
-            df_country = country_table.filter(
+        elif base == "country":
+            self.check_level_filter("country", level_filter)
+            country_table = self.table("countrytable")
+            country_ids = country_table.filter(
                 country_table.cty_code.startswith(level_filter)
-            )
-            if df_country.execute().empty:
-                raise ValueError(f"Invalid Country code: {level_filter}")
-            country_ids = df_country["id"]
+            ).id
 
             df = df.filter(df["country_id"].isin(country_ids))
 
-        units = self.conn.table("unittable")
-        df = self.conversion(df, units)
-
         if group:
-            # return self.process_cat(switch=switch)
-            raise NotImplementedError("Grouping not implemented yet")
-        else:
-            return self.process_data(switch=switch, df=df)
+            df = self.join_category(df)
+            return self.process_data(switch=[time_frame, "category"], df=df)
+        if level != base:
+            df = self.join_prefix(df, level)
+        return self.process_data(switch=switch, df=df)
 
+    @cached
     def process_int_org(
         self,
         level: str,
@@ -156,7 +829,8 @@ class DataTrade(DataPull):
         agg: str
             Aggregation of the data. The options are "monthly", "yearly", "fiscal", "total" and "qtr".
         group: bool
-            Group the data by the classification. (Not implemented yet)
+            Group the data by the classification. Not available, the categories
+            are assigned from the NAICS codes.
         update: bool
             Update the data from the source.
         filter: str
@@ -168,66 +842,145 @@ class DataTrade(DataPull):
             Processed data. Requires df.collect() to view the data.
         """
         switch = [time_frame, level]
+        base = self.base_level(level)
 
-        if time_frame == "naics":
+        if base == "naics" or group:
             raise ValueError(
                 "NAICS data is not available for Puerto Rico Statistics Institute."
             )
-        if "inttradedata" not in self.conn.list_tables():
-            self.insert_int_org(self.org_data)
-        if int(self.conn.table("inttradedata").count().execute()) == 0:
-            self.insert_int_org(self.org_data)
+        if base not in self.rollup_levels["inttradedata"]:
+            raise ValueError(f"Invalid switch: {switch}")
+        df = self.load_rollup("inttradedata", base)
         if datetime == "":
-            df = self.conn.table("inttradedata")
+            pass
         elif len(datetime.split("+")) == 2:
             times = datetime.split("+")
             start = times[0]
             end = times[1]
-            df = self.conn.table("inttradedata")
             df = df.filter((df.date >= start) & (df.date <= end))
         elif len(datetime.split("+")) == 1:
-            df = self.conn.table("inttradedata")
             df = df.filter(df.date == datetime)
         else:
             raise ValueError('Invalid time format. Use "date" or "start_date+end_date"')
 
         if agriculture_filter:
-            hts = (
-                self.conn.table("htstable")
-                .select("id", "agri_prod")
-                .rename(agr_id="id")
-            )
-            df = df.join(hts, df.hts_id == hts.agr_id)
             df = df.filter(df.agri_prod)
 
-        if level == "hts":
-            hts_table = self.conn.table("htstable")
-            df_hts = hts_table.filter(hts_table.hts_code.startswith(filter))
-            if df_hts.execute().empty:
-                raise ValueError(f"Invalid HTS code: {filter}")
-            hts_ids = df_hts["id"]
+        if base == "hts":
+            self.check_level_filter("hts", level_filter)
+            hts_table = self.table("htstable")
+            hts_ids = hts_table.filter(hts_table.hts_code.startswith(level_filter)).id
 
             df = df.filter(df["hts_id"].isin(hts_ids))
-        elif level == "country":
-            country_table = self.conn.table("countrytable")
-            df_country = country_table.filter(country_table.cty_code.startswith(filter))
-            if df_country.execute().empty:
-                raise ValueError(f"Invalid Country code: {filter}")
-            country_ids = df_country["id"]
+        elif base == "country":
+            self.check_level_filter("country", level_filter)
+            country_table = self.table("countrytable")
+            country_ids = country_table.filter(
+                country_table.cty_code.startswith(level_filter)
+            ).id
 
-            df = df[df["country_id"].isin(country_ids)]
+            df = df.filter(df["country_id"].isin(country_ids))
 
-        units = self.conn.table("unittable")
-        df = self.conversion(df, units)
+        if level != base:
+            df = self.join_prefix(df, level)
+        return self.process_data(switch=switch, df=df)
 
-        if group:
-            # return self.process_cat(switch=switch)
-            raise NotImplementedError("Grouping not implemented yet")
-        else:
-            return self.process_data(switch=switch, df=df)
+    @cached
+    def process_batch(
+        self,
+        table: str,
+        level: str,
+        time_frame: str,
+        level_filters: list | None = None,
+        datetimes: list | None = None,
+        agriculture_filter: bool = False,
+    ) -> ibis.expr.types.relations.Table:
+        """
+        Answers several level_filter and datetime requests with a single query. The
+            prefixes are resolved to ids with the code index and joined to the
+            rollup as a mapping table, and the time windows are joined as ranges,
+            so the rollup is scanned once for all the requests.
+
+        Parameters
+        ----------
+        table: str
+            The data to process. The options are "jptradedata" and "inttradedata".
+        level: str
+            Type of data to process. The options are "total", "naics", "hts", and "country".
+        time_frame: str
+            Time period to process the data. The options are "yearly", "fiscal", "qrt", and "monthly".
+        level_filters: list
+            Code prefixes to filter the level by. Each prefix is a request. Ignored
+            for the "total" level.
+        datetimes: list
+            Time windows with the same format as the datetime of process_int_jp
+            ("date" or "start_date+end_date"). Each window is a request.
+        agriculture_filter: bool
+            Only keep agricultural products.
+
+        Returns
+        -------
+        ibis.expr.types.relations.Table
+            The result of every combination of level_filter and datetime, tagged
+            with level_filter and datetime columns.
+        """
+        if table not in self.rollup_levels:
+            raise ValueError(f"Invalid table: {table}")
+        base = self.base_level(level)
+        if base not in self.rollup_levels[table]:
+            raise ValueError(f"Invalid switch: {[time_frame, level]}")
+        df = self.load_rollup(table, base)
+        keys = []
+
+        if agriculture_filter:
+            df = df.filter(df.agri_prod)
+
+        if datetimes:
+            windows = []
+            for datetime in datetimes:
+                times = datetime.split("+")
+                if len(times) > 2:
+                    raise ValueError(
+                        'Invalid time format. Use "date" or "start_date+end_date"'
+                    )
+                windows.append((datetime, times[0], times[-1]))
+            windows = ibis.memtable(
+                windows, columns=["datetime", "window_start", "window_end"]
+            )
+            windows = windows.mutate(
+                window_start=windows.window_start.cast("timestamp"),
+                window_end=windows.window_end.cast("timestamp"),
+            )
+            df = df.join(
+                windows,
+                [df.date >= windows.window_start, df.date <= windows.window_end],
+            ).drop("window_start", "window_end")
+            keys.append("datetime")
+
+        if base != "total" and level_filters:
+            column = self.rollup_levels[table][base][0]
+            mapping = []
+            for prefix in level_filters:
+                ids = self.lookup_codes(base, prefix)
+                if not ids:
+                    name = {"hts": "HTS", "naics": "NAICS", "country": "Country"}
+                    raise ValueError(f"Invalid {name[base]} code: {prefix}")
+                mapping += [(prefix, code_id) for code_id in ids]
+            mapping = ibis.memtable(mapping, columns=["level_filter", column])
+            mapping = mapping.mutate(mapping[column].cast(df[column].type()))
+            df = df.join(mapping, column)
+            keys.append("level_filter")
+
+        if level != base:
+            df = self.join_prefix(df, level)
+
+        return self.process_data(switch=[time_frame, level], df=df, keys=keys)
 
     def process_data(
-        self, switch: list, df: ibis.expr.types.relations.Table
+        self,
+        switch: list,
+        df: ibis.expr.types.relations.Table,
+        keys: list | None = None,
     ) -> ibis.expr.types.relations.Table:
         """
         Process the data based on the switch. Used for the process_int_jp and process_int_org methods
@@ -240,31 +993,30 @@ class DataTrade(DataPull):
             the process_int_jp and process_int_org methods.
         base: pl.lazyframe
             The pre-procesed and staderized data to process. This data comes from the process_int_jp and process_int_org methods.
+        keys: list
+            Extra columns to group by, used by process_batch to keep the requests apart.
 
         Returns
         -------
         pl.LazyFrame
             Processed data. Requires df.collect() to view the data.
         """
+        keys = keys or []
 
         match switch:
             case ["yearly", "total"]:
-                df = self.filter_data(df, ["year"])
-                df = df.mutate(year=df.year.fill_null(df.year_right))
+                df = self.filter_data(df, keys + ["year"])
                 return df.select(
-                    ["year", "imports", "exports", "qty_imports", "qty_exports"]
+                    keys + ["year", "imports", "exports", "qty_imports", "qty_exports"]
                 )
 
             case ["yearly", "naics"]:
-                df = self.filter_data(df, ["year", "naics_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    naics_id=df.naics_id.fill_null(df.naics_id_right),
-                )
-                naics = self.conn.table("naicstable")
+                df = self.filter_data(df, keys + ["year", "naics_id"])
+                naics = self.table("naicstable")
                 df = df.join(naics, df.naics_id == naics.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "naics_id",
                         "naics_code",
@@ -276,15 +1028,12 @@ class DataTrade(DataPull):
                 )
 
             case ["yearly", "hts"]:
-                df = self.filter_data(df, ["year", "hts_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    hts_id=df.hts_id.fill_null(df.hts_id_right),
-                )
-                hts = self.conn.table("htstable")
+                df = self.filter_data(df, keys + ["year", "hts_id"])
+                hts = self.table("htstable")
                 df = df.join(hts, df.hts_id == hts.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "hts_id",
                         "hts_code",
@@ -296,15 +1045,12 @@ class DataTrade(DataPull):
                 )
 
             case ["yearly", "country"]:
-                df = self.filter_data(df, ["year", "country_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    country_id=df.country_id.fill_null(df.country_id_right),
-                )
-                countries = self.conn.table("countrytable")
+                df = self.filter_data(df, keys + ["year", "country_id"])
+                countries = self.table("countrytable")
                 df = df.join(countries, df.country_id == countries.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "country_id",
                         "cty_code",
@@ -317,24 +1063,25 @@ class DataTrade(DataPull):
                 )
 
             case ["fiscal", "total"]:
-                df = self.filter_data(df, ["fiscal_year"])
-                df = df.mutate(
-                    fiscal_year=df.fiscal_year.fill_null(df.fiscal_year_right)
-                )
+                df = self.filter_data(df, keys + ["fiscal_year"])
                 return df.select(
-                    ["fiscal_year", "imports", "exports", "qty_imports", "qty_exports"]
+                    keys
+                    + [
+                        "fiscal_year",
+                        "imports",
+                        "exports",
+                        "qty_imports",
+                        "qty_exports",
+                    ]
                 )
 
             case ["fiscal", "naics"]:
-                df = self.filter_data(df, ["fiscal_year", "naics_id"])
-                df = df.mutate(
-                    fiscal_year=df.fiscal_year.fill_null(df.fiscal_year_right),
-                    naics_id=df.naics_id.fill_null(df.naics_id_right),
-                )
-                naics = self.conn.table("naicstable")
+                df = self.filter_data(df, keys + ["fiscal_year", "naics_id"])
+                naics = self.table("naicstable")
                 df = df.join(naics, df.naics_id == naics.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "fiscal_year",
                         "naics_id",
                         "naics_code",
@@ -346,15 +1093,12 @@ class DataTrade(DataPull):
                 )
 
             case ["fiscal", "hts"]:
-                df = self.filter_data(df, ["fiscal_year", "hts_id"])
-                df = df.mutate(
-                    fiscal_year=df.fiscal_year.fill_null(df.fiscal_year_right),
-                    hts_id=df.hts_id.fill_null(df.hts_id_right),
-                )
-                hts = self.conn.table("htstable")
+                df = self.filter_data(df, keys + ["fiscal_year", "hts_id"])
+                hts = self.table("htstable")
                 df = df.join(hts, df.hts_id == hts.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "fiscal_year",
                         "hts_id",
                         "hts_code",
@@ -366,15 +1110,12 @@ class DataTrade(DataPull):
                 )
 
             case ["fiscal", "country"]:
-                df = self.filter_data(df, ["fiscal_year", "country_id"])
-                df = df.mutate(
-                    fiscal_year=df.fiscal_year.fill_null(df.fiscal_year_right),
-                    country_id=df.country_id.fill_null(df.country_id_right),
-                )
-                countries = self.conn.table("countrytable")
+                df = self.filter_data(df, keys + ["fiscal_year", "country_id"])
+                countries = self.table("countrytable")
                 df = df.join(countries, df.country_id == countries.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "fiscal_year",
                         "country_id",
                         "cty_code",
@@ -387,26 +1128,26 @@ class DataTrade(DataPull):
                 )
 
             case ["qrt", "total"]:
-                df = self.filter_data(df, ["year", "qrt"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    qrt=df.qrt.fill_null(df.qrt_right),
-                )
+                df = self.filter_data(df, keys + ["year", "qrt"])
                 return df.select(
-                    ["year", "qrt", "imports", "exports", "qty_imports", "qty_exports"]
+                    keys
+                    + [
+                        "year",
+                        "qrt",
+                        "imports",
+                        "exports",
+                        "qty_imports",
+                        "qty_exports",
+                    ]
                 )
 
             case ["qrt", "naics"]:
-                df = self.filter_data(df, ["year", "qrt", "naics_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    qrt=df.qrt.fill_null(df.qrt_right),
-                    naics_id=df.naics_id.fill_null(df.naics_id_right),
-                )
-                naics = self.conn.table("naicstable")
+                df = self.filter_data(df, keys + ["year", "qrt", "naics_id"])
+                naics = self.table("naicstable")
                 df = df.join(naics, df.naics_id == naics.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "qrt",
                         "naics_id",
@@ -419,16 +1160,12 @@ class DataTrade(DataPull):
                 )
 
             case ["qrt", "hts"]:
-                df = self.filter_data(df, ["year", "qrt", "hts_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    qrt=df.qrt.fill_null(df.qrt_right),
-                    hts_id=df.hts_id.fill_null(df.hts_id_right),
-                )
-                hts = self.conn.table("htstable")
+                df = self.filter_data(df, keys + ["year", "qrt", "hts_id"])
+                hts = self.table("htstable")
                 df = df.join(hts, df.hts_id == hts.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "qrt",
                         "hts_id",
@@ -441,16 +1178,12 @@ class DataTrade(DataPull):
                 )
 
             case ["qrt", "country"]:
-                df = self.filter_data(df, ["year", "qrt", "country_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    qrt=df.qrt.fill_null(df.qrt_right),
-                    country_id=df.country_id.fill_null(df.country_id_right),
-                )
-                countries = self.conn.table("countrytable")
+                df = self.filter_data(df, keys + ["year", "qrt", "country_id"])
+                countries = self.table("countrytable")
                 df = df.join(countries, df.country_id == countries.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "qrt",
                         "country_id",
@@ -464,13 +1197,10 @@ class DataTrade(DataPull):
                 )
 
             case ["monthly", "total"]:
-                df = self.filter_data(df, ["year", "month"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    month=df.month.fill_null(df.month_right),
-                )
+                df = self.filter_data(df, keys + ["year", "month"])
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "month",
                         "imports",
@@ -481,16 +1211,12 @@ class DataTrade(DataPull):
                 )
 
             case ["monthly", "naics"]:
-                df = self.filter_data(df, ["year", "month", "naics_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    month=df.month.fill_null(df.month_right),
-                    naics_id=df.naics_id.fill_null(df.naics_id_right),
-                )
-                naics = self.conn.table("naicstable")
+                df = self.filter_data(df, keys + ["year", "month", "naics_id"])
+                naics = self.table("naicstable")
                 df = df.join(naics, df.naics_id == naics.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "month",
                         "naics_id",
@@ -503,16 +1229,12 @@ class DataTrade(DataPull):
                 )
 
             case ["monthly", "hts"]:
-                df = self.filter_data(df, ["year", "month", "hts_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    month=df.month.fill_null(df.month_right),
-                    hts_id=df.hts_id.fill_null(df.hts_id_right),
-                )
-                hts = self.conn.table("htstable")
+                df = self.filter_data(df, keys + ["year", "month", "hts_id"])
+                hts = self.table("htstable")
                 df = df.join(hts, df.hts_id == hts.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "month",
                         "hts_id",
@@ -525,16 +1247,12 @@ class DataTrade(DataPull):
                 )
 
             case ["monthly", "country"]:
-                df = self.filter_data(df, ["year", "month", "country_id"])
-                df = df.mutate(
-                    year=df.year.fill_null(df.year_right),
-                    month=df.month.fill_null(df.month_right),
-                    country_id=df.country_id.fill_null(df.country_id_right),
-                )
-                countries = self.conn.table("countrytable")
+                df = self.filter_data(df, keys + ["year", "month", "country_id"])
+                countries = self.table("countrytable")
                 df = df.join(countries, df.country_id == countries.id)
                 return df.select(
-                    [
+                    keys
+                    + [
                         "year",
                         "month",
                         "country_id",
@@ -547,26 +1265,82 @@ class DataTrade(DataPull):
                     ]
                 )
 
+            case [time_frame, "category"] if time_frame in self.time_columns:
+                df = self.filter_data(
+                    df, keys + self.time_columns[time_frame] + ["category"]
+                )
+                return df.select(
+                    keys
+                    + self.time_columns[time_frame]
+                    + [
+                        "category",
+                        "imports",
+                        "exports",
+                        "qty_imports",
+                        "qty_exports",
+                    ]
+                )
+
+            case [time_frame, level] if (
+                time_frame in self.time_columns and self.base_level(level) != level
+            ):
+                base = self.base_level(level)
+                digits = int(level[len(base) :])
+                df = self.filter_data(
+                    df, keys + self.time_columns[time_frame] + [level]
+                )
+                df = df.mutate(
+                    **{f"{base}_code": df[level].cast("string").lpad(digits, "0")}
+                )
+                return df.select(
+                    keys
+                    + self.time_columns[time_frame]
+                    + [
+                        level,
+                        f"{base}_code",
+                        "imports",
+                        "exports",
+                        "qty_imports",
+                        "qty_exports",
+                    ]
+                )
+
             case _:
                 raise ValueError(f"Invalid switch: {switch}")
 
-    def process_price(
-        self, agriculture_filter: bool = False
-    ) -> ibis.expr.types.relations.Table:
-        max_date = self.conn.table("inttradedata").date.max().execute()
-        start_date = max_date - relativedelta(years=1, months=1)
-        df = self.process_int_org(
-            time_frame="monthly",
-            level="hts",
-            agriculture_filter=agriculture_filter,
-            datetime=f"{start_date}+{max_date}",
-        )
+    def build_price(self, months: list | None = None) -> None:
+        """
+        Materialize the monthly HS4 price panel of inttradedata with the 3 month
+            moving prices and their change from the same month of the previous
+            year. When months are given only the rows whose windows include one
+            of those months are recomputed (the months themselves, the two
+            following months and the same three months a year later).
+
+        Parameters
+        ----------
+        months: list
+            The months (as dates) that were loaded. Rebuilds the panel completely
+            if None or if it does not exist yet.
+
+        Returns
+        -------
+        None
+        """
+        if months is not None and not months:
+            return
+        name = self.rollup_name("inttradedata", "price")
+        refresh = months is not None and name in self.conn.list_tables()
+
+        df = self.conn.table(self.rollup_name("inttradedata", "hts"))
+        if refresh:
+            # The lag of the first changed month reads the moving price 12 months
+            # back, which averages the 2 months before that
+            df = df.filter(df.date >= min(months) - relativedelta(months=14))
+        df = self.filter_data(df, ["date", "hts_id", "agri_prod"])
         hts = self.conn.table("htstable").select("id", "hts_code").rename(hts_id="id")
-        df = df.join(hts, "hts_id", how="left")
+        df = df.join(hts, "hts_id")
         df = df.mutate(
-            date=ibis.date(
-                df.year.cast("string") + "-" + df.month.cast("string") + "-01"
-            ),
+            date=df.date.cast("date"),
             qty_imports=df.qty_imports.substitute(0, 1),
             qty_exports=df.qty_exports.substitute(0, 1),
             hs4=df.hts_code[0:4],
@@ -577,6 +1351,7 @@ class DataTrade(DataPull):
                 df.exports.sum().name("exports"),
                 df.qty_imports.sum().name("qty_imports"),
                 df.qty_exports.sum().name("qty_exports"),
+                df.agri_prod.any().name("agri_prod"),
             ]
         )
         df = df.mutate(
@@ -595,10 +1370,13 @@ class DataTrade(DataPull):
                 order_by=df.date,
             ),
         )
-        df = df.group_by("hs4").mutate(
-            prev_year_imports=df.moving_price_imports.lag(12),
-            prev_year_exports=df.moving_price_exports.lag(12),
+        prev = df.select(
+            hs4=df.hs4,
+            date=(df.date + ibis.interval(months=12)).cast("date"),
+            prev_year_imports=df.moving_price_imports,
+            prev_year_exports=df.moving_price_exports,
         )
+        df = df.left_join(prev, ["hs4", "date"]).drop("hs4_right", "date_right")
         df = df.mutate(
             pct_change_imports=ibis.cases(
                 (
@@ -617,6 +1395,53 @@ class DataTrade(DataPull):
                 else_=(ibis.null()),
             ),
         )
+
+        if refresh:
+            changed = sorted(
+                {
+                    month + relativedelta(months=lag)
+                    for month in months
+                    for lag in [0, 1, 2, 12, 13, 14]
+                }
+            )
+            df = df.filter(df.date.isin(changed))
+            self.delete_months(name, changed)
+            self.conn.insert(name, df)
+        else:
+            self.conn.create_table(name, df, overwrite=True)
+        self.log_event("build", table=name, months=len(months) if refresh else None)
+
+    @cached
+    def process_price(
+        self, agriculture_filter: bool = False, lookback: int = 13
+    ) -> ibis.expr.types.relations.Table:
+        """
+        Returns the HS4 prices of the last months of inttradedata, ranked within
+            each month. The prices are read from the panel materialized by
+            build_price, only the ranks are computed per call.
+
+        Parameters
+        ----------
+        agriculture_filter: bool
+            Only keep agricultural products.
+        lookback: int
+            Number of months before the last month to return.
+
+        Returns
+        -------
+        ibis.expr.types.relations.Table
+        """
+        name = self.rollup_name("inttradedata", "price")
+        if name not in self.tables:
+            self.load_rollup("inttradedata", "hts")
+            self.build_price()
+            self.bootstrap()
+        df = self.table(name)
+        start_date = self.price_date - relativedelta(months=lookback)
+        df = df.filter(df.date >= start_date)
+        if agriculture_filter:
+            df = df.filter(df.agri_prod)
+        df = df.drop("agri_prod")
         df = df.mutate(
             moving_import_rank=ibis.cases(
                 (
@@ -657,31 +1482,167 @@ class DataTrade(DataPull):
         )
         return df
 
-    def process_cat(self, df: pl.DataFrame, switch: list):
-        match switch:
-            case ["yearly", "total"]:
-                df = self.filter_data(df, ["year", "naics"])
-                df = df.with_columns(
-                    year=pl.when(pl.col("year").is_null())
-                    .then(pl.col("year_right"))
-                    .otherwise(pl.col("year")),
-                    naics=pl.when(pl.col("naics").is_null())
-                    .then(pl.col("naics_right"))
-                    .otherwise(pl.col("naics")),
-                )
-                df = df.select(pl.col("*").exclude("year_right", "naics_right"))
-                df = df.with_columns(
-                    pl.col(
-                        "imports", "exports", "qty_imports", "qty_exports"
-                    ).fill_null(strategy="zero")
-                ).sort("year", "naics")
-                df = df.with_columns(net_exports=pl.col("exports") - pl.col("imports"))
+    async def aprocess_int_jp(
+        self,
+        level: str,
+        time_frame: str,
+        datetime: str = "",
+        agriculture_filter: bool = False,
+        group: bool = False,
+        level_filter: str = "",
+        timeout: float | None = None,
+    ) -> pl.DataFrame:
+        """
+        Async version of process_int_jp that returns the executed result. See
+            run_async for the execution, timeout and coalescing of the calls.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait for the result before raising TimeoutError.
+            The other parameters are the same as process_int_jp.
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        return await self.run_async(
+            "process_int_jp",
+            timeout,
+            level=level,
+            time_frame=time_frame,
+            datetime=datetime,
+            agriculture_filter=agriculture_filter,
+            group=group,
+            level_filter=level_filter,
+        )
+
+    async def aprocess_int_org(
+        self,
+        level: str,
+        time_frame: str,
+        datetime: str = "",
+        agriculture_filter: bool = False,
+        group: bool = False,
+        level_filter: str = "",
+        timeout: float | None = None,
+    ) -> pl.DataFrame:
+        """
+        Async version of process_int_org that returns the executed result.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait for the result before raising TimeoutError.
+            The other parameters are the same as process_int_org.
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        return await self.run_async(
+            "process_int_org",
+            timeout,
+            level=level,
+            time_frame=time_frame,
+            datetime=datetime,
+            agriculture_filter=agriculture_filter,
+            group=group,
+            level_filter=level_filter,
+        )
+
+    async def aprocess_price(
+        self,
+        agriculture_filter: bool = False,
+        lookback: int = 13,
+        timeout: float | None = None,
+    ) -> pl.DataFrame:
+        """
+        Async version of process_price that returns the executed result.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait for the result before raising TimeoutError.
+            The other parameters are the same as process_price.
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        return await self.run_async(
+            "process_price",
+            timeout,
+            agriculture_filter=agriculture_filter,
+            lookback=lookback,
+        )
+
+    async def run_async(
+        self, method: str, timeout: float | None, **params
+    ) -> pl.DataFrame:
+        """
+        Runs a query method in the worker pool of the instance (async_workers
+            threads) and returns its result. Identical calls made while one is
+            running wait for the same result instead of running again. A call that
+            times out or is cancelled stops waiting, and the query is interrupted
+            once no call is waiting for it.
+
+        Parameters
+        ----------
+        method: str
+            Name of the query method.
+        timeout: float
+            Seconds to wait for the result before raising TimeoutError. Waits
+            until the query finishes if None.
+        params: dict
+            Arguments of the query method.
+
+        Returns
+        -------
+        pl.DataFrame
+        """
+        loop = asyncio.get_running_loop()
+        key = json.dumps([id(loop), method, params], sort_keys=True, default=str)
+        entry = self.inflight.get(key)
+        if entry is None:
+            task = loop.create_task(self.execute_async(method, params))
+            entry = self.inflight[key] = [task, 0]
+            task.add_done_callback(lambda task: self.inflight.pop(key, None))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+
+    async def execute_async(self, method: str, params: dict) -> pl.DataFrame:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.async_workers, thread_name_prefix="datatrade"
+            )
+        running = {}
+
+        def execute():
+            running["conn"] = self.conn.con
+            return getattr(self, method)(**params).to_polars()
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, execute)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Stop the query so the worker is free for the next call
+            if "conn" in running:
+                running["conn"].interrupt()
+            raise
 
     def filter_data(
         self, df: ibis.expr.types.relations.Table, filters: list
     ) -> ibis.expr.types.relations.Table:
         """
-        Filter the data based on the filter list.
+        Filter the data based on the filter list. Imports and exports are summed in a
+            single grouped pass using conditional sums on the trade_id.
 
         Parameters
         ----------
@@ -696,21 +1657,14 @@ class DataTrade(DataPull):
             data to be filtered.
         """
 
-        imports = (
-            df.filter(df.trade_id == 1)
-            .group_by(filters)
-            .aggregate(
-                [df.data.sum().name("imports"), df.qty.sum().name("qty_imports")]
-            )
-        )
-        exports = (
-            df.filter(df.trade_id == 2)
-            .group_by(filters)
-            .aggregate(
-                [df.data.sum().name("exports"), df.qty.sum().name("qty_exports")]
-            )
+        df = df.group_by(filters).aggregate(
+            [
+                df.data.sum(where=df.trade_id == 1).name("imports"),
+                df.data.sum(where=df.trade_id == 2).name("exports"),
+                df.qty.sum(where=df.trade_id == 1).name("qty_imports"),
+                df.qty.sum(where=df.trade_id == 2).name("qty_exports"),
+            ]
         )
-        df = imports.join(exports, predicates=filters, how="outer")
         df = df.mutate(
             imports=df.imports.fill_null(0),
             exports=df.exports.fill_null(0),
@@ -725,62 +1679,21 @@ class DataTrade(DataPull):
     def conversion(
         self,
         df: ibis.expr.types.relations.Table,
-        units: ibis.expr.types.relations.Table,
     ) -> ibis.expr.types.relations.Table:
         """
-        Convert the data to the correct units (kg).
+        Adds the quantity in kg to the data. The quantity is converted at insert time
+            with the conv_factor of the unittable, and the year, month, qrt and
+            fiscal_year columns are also stored at insert time.
 
         Parameters
         ----------
-        df: pl.LazyFrame
+        df: ibis.expr.types.relations.Table
             Data to convert.
 
         Returns
         -------
-        pl.LazyFrame
+        ibis.expr.types.relations.Table
             Converted data.
         """
 
-        df = df.join(units, df.unit1_id == units.id).rename(unit_1="unit_code")
-        df = df.mutate(unit2_id=df.unit2_id.fill_null(df.unit1_id))
-        df = df.join(units, df.unit2_id == units.id).rename(unit_2="unit_code")
-        df = df.mutate(
-            conv_1=ibis.cases(
-                (df.unit_1 == "kg", df.qty_1 * 1),
-                (df.unit_1 == "l", df.qty_1 * 1),
-                (df.unit_1 == "doz", df.qty_1 / 0.756),
-                (df.unit_1 == "m3", df.qty_1 * 907.1847),
-                (df.unit_1 == "t", df.qty_1 * 907.1847),
-                (df.unit_1 == "kts", df.qty_1 * 1),
-                (df.unit_1 == "pfl", df.qty_1 * 0.789),
-                (df.unit_1 == "gm", df.qty_1 * 0.001),
-                else_=(df.qty_1),
-            ),
-            conv_2=ibis.cases(
-                (df.unit_2 == "kg", df.qty_2 * 1),
-                (df.unit_2 == "l", df.qty_2 * 1),
-                (df.unit_2 == "doz", df.qty_2 / 0.756),
-                (df.unit_2 == "m3", df.qty_2 * 1000),
-                (df.unit_2 == "t", df.qty_2 * 1000),
-                (df.unit_2 == "kts", df.qty_2 * 1),
-                (df.unit_2 == "pfl", df.qty_2 * 0.789),
-                (df.unit_2 == "gm", df.qty_2 * 0.001),
-                else_=(df.qty_2),
-            ),
-            qrt=ibis.cases(
-                ((df.date.month() >= 1) & (df.date.month() <= 3), 1),
-                ((df.date.month() >= 4) & (df.date.month() <= 8), 2),
-                ((df.date.month() >= 7) & (df.date.month() <= 9), 3),
-                ((df.date.month() >= 10) & (df.date.month() <= 12), 4),
-                else_=(0),
-            ),
-            fiscal_year=ibis.cases(
-                (df.date.month() > 6, df.date.year() + 1), else_=(df.date.year())
-            ),
-        )
-        df = df.mutate(
-            qty=df.conv_1,
-            year=df.date.year(),
-            month=df.date.month(),
-        )
-        return df
+        return df.mutate(qty=df.qty_kg)
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from collections import deque
+import polars as pl
+import threading
+import time
+
+
+class QueryProfiler:
+    """
+    Collects the records of the queries and inserts of a DataTrade instance. Every
+        query records the time spent in each phase (building the ibis expression,
+        compiling it to SQL, executing it in DuckDB and converting the result),
+        the SQL, the rows returned and, if explain is set, the EXPLAIN ANALYZE
+        plan and the rows of the tables scanned. The records are also logged as
+        JSON lines.
+    """
+
+    phases = ["build", "compile", "execute", "convert"]
+
+    def __init__(self, callback=None, explain: bool = False, max_records: int = 10_000):
+        """
+        Initialize the QueryProfiler class.
+
+        Parameters
+        ----------
+        callback: function
+            Called with every record (a dict) as it is made.
+        explain: bool
+            Run EXPLAIN ANALYZE on every executed query to record its plan and the
+            rows of the tables scanned (not the rows read, the row groups skipped
+            by the zonemaps are counted). The query runs twice, so it is slower.
+        max_records: int
+            Number of records kept for the report, the oldest are dropped.
+
+        Returns
+        -------
+        None
+        """
+        self.callback = callback
+        self.explain = explain
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+
+    def record(self, record: dict) -> None:
+        with self.lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def report(self, top: int = 10) -> pl.DataFrame:
+        """
+        Returns the query shapes (the method and its arguments other than the dates
+            and the level_filter) with the highest mean time.
+
+        Parameters
+        ----------
+        top: int
+            Number of shapes returned.
+
+        Returns
+        -------
+        pl.DataFrame
+            The calls, cache hits, mean and max seconds, mean seconds of each
+            phase and rows returned of every shape.
+        """
+        with self.lock:
+            records = [r for r in self.records if r["event"] == "query"]
+        if not records:
+            return pl.DataFrame()
+        df = pl.DataFrame(
+            [
+                {
+                    "method": r["method"],
+                    "shape": r["shape"],
+                    "seconds": r["seconds"],
+                    "cache_hit": r["cache"] == "hit",
+                    "rows": r["rows_returned"],
+                    **{p: r["phases"].get(p, 0.0) for p in self.phases},
+                }
+                for r in records
+            ]
+        )
+        return (
+            df.group_by(["method", "shape"])
+            .agg(
+                calls=pl.len(),
+                cache_hits=pl.col("cache_hit").sum(),
+                mean_seconds=pl.col("seconds").mean(),
+                max_seconds=pl.col("seconds").max(),
+                **{p: pl.col(p).mean() for p in self.phases},
+                rows=pl.col("rows").mean(),
+            )
+            .sort("mean_seconds", descending=True)
+            .head(top)
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.records.clear()
+
+
+@contextmanager
+def timed(phases: dict, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
@@ -1,4 +1,6 @@
 from ..models import (
+    get_database,
+    init_calendar_table,
     init_district_table,
     init_country_table,
     init_hts_table,
@@ -9,11 +11,22 @@ from ..models import (
     init_int_trade_data_table,
     init_jp_trade_data_table,
 )
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from tqdm import tqdm
+import pyarrow.parquet as pq
+import pyarrow.csv as pa_csv
+import pyarrow as pa
 import polars as pl
+import threading
 import requests
+import re
 import logging
+import json
 import zipfile
+import time
+import shutil
 import urllib3
 import ibis
 import os
@@ -25,15 +38,99 @@ class DataPull:
 
     """
 
+    # Column types of the raw CSV files, so they are not inferred from a sample
+    jp_schema = {
+        "Trade": pl.String,
+        "Year": pl.Int64,
+        "Month": pl.Int64,
+        "Commodity_Code": pl.Int64,
+        "Commodity_Short_Name": pl.String,
+        "Commodity_description": pl.String,
+        "cty_code": pl.Int64,
+        "Country": pl.String,
+        "SubCountry_Code": pl.String,
+        "district": pl.String,
+        "DistrictDesc": pl.String,
+        "district_posh": pl.String,
+        "DistrictPoshDesc": pl.String,
+        "data": pl.Int64,
+        "sitc": pl.Int64,
+        "SITC_Short_Desc": pl.String,
+        "SITC_Long_Desc": pl.String,
+        "naics": pl.String,
+        "NAICS_description": pl.String,
+        "end_use_i": pl.Int64,
+        "end_use_e": pl.Int64,
+        "hts_desc": pl.String,
+        "unit_1": pl.String,
+        "qty_1": pl.Int64,
+        "unit_2": pl.String,
+        "qty_2": pl.Int64,
+    }
+    org_schema = {
+        "import_export": pl.String,
+        "country": pl.String,
+        "year": pl.Int64,
+        "month": pl.Int64,
+        "value": pl.Int64,
+        "unit_1": pl.String,
+        "qty_1": pl.Int64,
+        "unit_2": pl.String,
+        "qty_2": pl.Int64,
+        "HTS": pl.String,
+        "HTS_desc": pl.String,
+    }
+    # Digits of the code prefixes stored as integer columns (e.g. hts4) on the
+    # htstable and naicstable
+    code_prefixes = {"hts": [2, 4, 6, 8], "naics": [2, 3, 4, 5, 6]}
+    # Reference table of every id column of the fact tables
+    fact_references = {
+        "trade_id": "tradetable",
+        "hts_id": "htstable",
+        "country_id": "countrytable",
+        "district_id": "districttable",
+        "sitc_id": "sitctable",
+        "naics_id": "naicstable",
+        "unit1_id": "unittable",
+        "unit2_id": "unittable",
+    }
+    # Physical order of the fact rows, so the min/max of each row group are narrow
+    # and DuckDB skips the row groups outside the dates or codes of a query
+    cluster_columns = ["date", "hts_id"]
+    # Code columns of the reference tables that create_indexes indexes
+    code_columns = {
+        "htstable": "hts_code",
+        "naicstable": "naics_code",
+        "countrytable": "cty_code",
+    }
+    parquet_compression = "zstd"
+    row_group_size = 100_000
+    census_url = "https://api.census.gov/data/timeseries/"
+    census_timeout = 60
+    http_retries = 5
+    http_backoff = 1.0
+    range_size = 32 * 1024 * 1024
+
     def __init__(
         self,
         saving_dir: str = "data/",
         database_file: str = "data.ddb",
         log_file: str = "data_process.log",
+        storage: str = "duckdb",
+        read_only: bool = False,
+        compact: bool = False,
     ):
+        if storage not in ["duckdb", "parquet"]:
+            raise ValueError('Invalid storage. Use "duckdb" or "parquet"')
         self.saving_dir = saving_dir
         self.data_file = database_file
-        self.conn = ibis.duckdb.connect(f"{self.data_file}")
+        self.storage = storage
+        self.read_only = read_only
+        self.compact = compact
+        self.session = None
+        self.profiler = None
+        self.database = get_database(self.data_file, read_only=read_only)
+        self.local = threading.local()
 
         logging.basicConfig(
             level=logging.INFO,
@@ -49,6 +146,39 @@ class DataPull:
         if not os.path.exists(self.saving_dir + "external"):
             os.makedirs(self.saving_dir + "external")
 
+    @property
+    def conn(self) -> ibis.BaseBackend:
+        """
+        The ibis connection of the current thread. Every thread gets its own cursor
+            of the shared database handle, so one instance can answer queries from
+            several threads at the same time.
+        """
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = ibis.duckdb.from_connection(self.database.cursor())
+        return self.local.conn
+
+    def log_event(self, event: str, **fields) -> None:
+        """
+        Logs an event of the database as a JSON line and passes it to the profiler.
+            Events with an error field are logged at the ERROR level.
+
+        Parameters
+        ----------
+        event: str
+            The kind of event (e.g. "insert" or "query").
+        fields: dict
+            The data of the event.
+
+        Returns
+        -------
+        None
+        """
+        record = {"event": event, **fields}
+        if self.profiler is not None:
+            self.profiler.record(record)
+        level = logging.ERROR if "error" in fields else logging.INFO
+        logging.log(level, json.dumps(record, default=str))
+
     def pull_int_org(self) -> None:
         """
         Pulls data from the Puerto Rico Institute of Statistics. Saves them in the
@@ -66,36 +196,22 @@ class DataPull:
             url="http://www.estadisticas.gobierno.pr/iepr/LinkClick.aspx?fileticket=JVyYmIHqbqc%3d&tabid=284&mid=244930",
             filename=(self.saving_dir + "raw/tmp.zip"),
         )
-        # Extract the zip file
-        with zipfile.ZipFile(self.saving_dir + "raw/tmp.zip", "r") as zip_ref:
-            zip_ref.extractall(f"{self.saving_dir}raw/")
-
-        # Extract additional zip files
-        additional_files = ["EXPORT_HTS10_ALL.zip", "IMPORT_HTS10_ALL.zip"]
-        for additional_file in additional_files:
-            additional_file_path = os.path.join(
-                f"{self.saving_dir}raw/{additional_file}"
-            )
-            with zipfile.ZipFile(additional_file_path, "r") as zip_ref:
-                zip_ref.extractall(os.path.join(f"{self.saving_dir}raw/"))
-
-        # Concatenate the files
-        imports = pl.scan_csv(
-            self.saving_dir + "raw/IMPORT_HTS10_ALL.csv", ignore_errors=True
-        )
-        exports = pl.scan_csv(
-            self.saving_dir + "raw/EXPORT_HTS10_ALL.csv", ignore_errors=True
-        )
-        pl.concat([imports, exports], how="vertical").collect().write_parquet(
-            self.saving_dir + "raw/org_data.parquet"
+        # Read the csv files inside the nested zip files without extracting them
+        self.zip_to_parquet(
+            self.saving_dir + "raw/tmp.zip",
+            ["IMPORT_HTS10_ALL.zip", "EXPORT_HTS10_ALL.zip"],
+            self.saving_dir + "raw/org_data.parquet",
+            self.org_schema,
         )
 
-        logging.info(
-            "finished extracting data from the Puerto Rico Institute of Statistics"
+        self.log_event(
+            "pull", source="org", file=self.saving_dir + "raw/org_data.parquet"
         )
 
-    def insert_int_org(self, file: str, update: bool = False) -> None:
+    def insert_int_org(self, file: str, update: bool = False) -> list:
+        start = time.perf_counter()
         if "jptradedata" in self.conn.list_tables() and not update:
+            self.update_conv_factors(self.conv_factors())
             hts = self.conn.table("htstable").to_polars().lazy()
             unit = self.conn.table("unittable").to_polars().lazy()
             country = self.conn.table("countrytable").to_polars().lazy()
@@ -129,6 +245,7 @@ class DataPull:
         ).rename({"value": "data"})
 
         int_df = int_df.with_columns(pl.col("date").cast(pl.Date))
+        int_df = self.calendar_columns(int_df)
 
         int_df = int_df.join(
             country, left_on="country", right_on="country_name", how="left"
@@ -137,11 +254,20 @@ class DataPull:
             hts, left_on="commodity_code", right_on="hts_code", how="left"
         ).rename({"id": "hts_id"})
         int_df = int_df.join(
-            unit, left_on="unit_1", right_on="unit_code", how="left"
+            unit.select("unit_code", "id", "conv_factor"),
+            left_on="unit_1",
+            right_on="unit_code",
+            how="left",
         ).rename({"id": "unit1_id"})
         int_df = int_df.join(
-            unit, left_on="unit_2", right_on="unit_code", how="left"
+            unit.select("unit_code", "id"),
+            left_on="unit_2",
+            right_on="unit_code",
+            how="left",
         ).rename({"id": "unit2_id"})
+        int_df = int_df.with_columns(
+            qty_kg=pl.col("qty_1") * pl.col("conv_factor").fill_null(1)
+        )
 
         int_df = int_df.select(
             pl.col(
@@ -154,15 +280,43 @@ class DataPull:
                 "data",
                 "qty_1",
                 "qty_2",
+                "qty_kg",
+                "year",
+                "month",
+                "qrt",
+                "fiscal_year",
             )
         )  # .with_columns(pl.all().exclude("date").cast(pl.Int64))
 
-        if "inttradedata" not in self.conn.list_tables():
-            init_int_trade_data_table(self.data_file)
-        self.conn.insert("inttradedata", int_df.collect())
+        calendar, totals = pl.collect_all(
+            [
+                int_df.select("date", "year", "month", "qrt", "fiscal_year").unique(),
+                self.month_totals(
+                    int_df, ["country_id", "hts_id", "unit1_id", "unit2_id"]
+                ),
+            ]
+        )
+        if "calendartable" not in self.conn.list_tables():
+            init_calendar_table(self.data_file)
+        self.upsert_dim("calendartable", calendar.lazy(), "date")
 
-        logging.info("finished inserting data into the database")
-        # return int_df.collect()
+        # Write only the months that are new or were revised
+        if "inttradedata" not in self.conn.list_tables() and self.storage == "duckdb":
+            init_int_trade_data_table(self.data_file, self.compact)
+        self.add_fact_columns("inttradedata")
+        months = self.changed_months("inttradedata", totals)
+        if months:
+            self.insert_fact(
+                "inttradedata", int_df.filter(pl.col("date").is_in(months)), months
+            )
+
+        self.log_event(
+            "insert",
+            table="inttradedata",
+            months=len(months),
+            seconds=time.perf_counter() - start,
+        )
+        return months
 
     def pull_int_jp(self, update: bool = False) -> None:
         """
@@ -194,6 +348,14 @@ class DataPull:
                 url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_agr.json",
                 filename=(self.saving_dir + "external/code_agr.json"),
             )
+        if not os.path.exists(self.saving_dir + "external/code_units.json"):
+            logging.debug(
+                "https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_units.json"
+            )
+            self.pull_file(
+                url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_units.json",
+                filename=(self.saving_dir + "external/code_units.json"),
+            )
         if not os.path.exists(self.saving_dir + "raw/jp_data.parquet") or update:
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
             logging.debug(
@@ -203,13 +365,109 @@ class DataPull:
             self.pull_file(
                 url=url, filename=(self.saving_dir + "raw/jp_data.csv"), verify=False
             )
-            pl.read_csv(
-                f"{self.saving_dir}/raw/jp_data.csv", ignore_errors=True
-            ).write_parquet(f"{self.saving_dir}/raw/jp_data.parquet")
+            self.csv_to_parquet(
+                [f"{self.saving_dir}/raw/jp_data.csv"],
+                f"{self.saving_dir}/raw/jp_data.parquet",
+                self.jp_schema,
+            )
+
+        self.log_event(
+            "pull", source="jp", file=self.saving_dir + "raw/jp_data.parquet"
+        )
+
+    def csv_to_parquet(self, files: list, parquet_file: str, schema: dict) -> None:
+        """
+        Converts CSV files into a single parquet file without loading them in memory.
+            The files are streamed in batches and written one row group at a time.
+
+        Parameters
+        ----------
+        files: list
+            The CSV files to convert. They are concatenated in order.
+        parquet_file: str
+            The parquet file to save the data to.
+        schema: dict
+            Types of the known columns. Other columns are inferred.
+
+        Returns
+        -------
+        None
+        """
+        frames = [
+            pl.scan_csv(file, schema_overrides=schema, ignore_errors=True)
+            for file in files
+        ]
+        pl.concat(frames, how="vertical").sink_parquet(
+            parquet_file,
+            compression=self.parquet_compression,
+            row_group_size=self.row_group_size,
+        )
+
+    def zip_to_parquet(
+        self, zip_file: str, members: list, parquet_file: str, schema: dict
+    ) -> None:
+        """
+        Converts the CSV files inside zip files nested in zip_file into a single
+            parquet file. The members are read as streams, so nothing is extracted
+            to disk, and they are decoded at the same time in batches that are
+            written as they are read.
+
+        Parameters
+        ----------
+        zip_file: str
+            The zip file that contains the nested zip files.
+        members: list
+            The names of the nested zip files to convert.
+        parquet_file: str
+            The parquet file to save the data to.
+        schema: dict
+            Types of the columns. Values that can not be cast are set to null.
+
+        Returns
+        -------
+        None
+        """
+        arrow_schema = pl.DataFrame(schema=schema).to_arrow().schema
+        lock = threading.Lock()
+
+        def convert(member: str) -> None:
+            # Each thread opens the archive so they do not share a file position
+            with zipfile.ZipFile(zip_file) as outer:
+                name = next(file for file in outer.namelist() if file.endswith(member))
+                with zipfile.ZipFile(outer.open(name)) as inner:
+                    csv_name = next(
+                        file
+                        for file in inner.namelist()
+                        if file.lower().endswith(".csv")
+                    )
+                    reader = pa_csv.open_csv(
+                        inner.open(csv_name),
+                        read_options=pa_csv.ReadOptions(block_size=16 * 1024 * 1024),
+                        convert_options=pa_csv.ConvertOptions(
+                            column_types={col: pa.string() for col in schema},
+                            include_columns=list(schema),
+                            strings_can_be_null=True,
+                        ),
+                    )
+                    for batch in reader:
+                        df = pl.from_arrow(batch).with_columns(
+                            pl.col(col).cast(dtype, strict=False)
+                            for col, dtype in schema.items()
+                        )
+                        with lock:
+                            writer.write_table(
+                                df.to_arrow().cast(arrow_schema),
+                                row_group_size=self.row_group_size,
+                            )
 
-        logging.info("Pulling data from the Puerto Rico Institute of Statistics")
+        with pq.ParquetWriter(
+            parquet_file, arrow_schema, compression=self.parquet_compression
+        ) as writer:
+            with ThreadPoolExecutor(max_workers=len(members)) as executor:
+                list(executor.map(convert, members))
 
-    def insert_int_jp(self, file: str, agr_file: str) -> None:
+    def insert_int_jp(self, file: str, agr_file: str) -> list:
+        start = time.perf_counter()
         # Prepare to insert to database
         if not os.path.exists(self.saving_dir + "raw/jp_data.parquet"):
             self.pull_int_jp()
@@ -219,6 +477,7 @@ class DataPull:
             .to_series()
             .to_list()
         )
+        conv_factor = self.conv_factors().lazy()
         jp_df = pl.scan_parquet(file)
 
         # Normalize column names
@@ -237,6 +496,10 @@ class DataPull:
         ).rename({"trade": "trade_id"})
 
         jp_df = jp_df.with_columns(pl.col("date").cast(pl.Date))
+        jp_df = self.calendar_columns(jp_df)
+        jp_df = jp_df.join(
+            conv_factor, left_on="unit_1", right_on="unit_code", how="left"
+        ).with_columns(qty_kg=pl.col("qty_1") * pl.col("conv_factor").fill_null(1))
 
         jp_df = jp_df.with_columns(
             sitc=pl.when(pl.col("sitc_short_desc").str.starts_with("Civilian"))
@@ -254,9 +517,7 @@ class DataPull:
             .unique()
             .rename({"country": "country_name"})
         )
-        country = country.filter(pl.col("cty_code").is_not_null()).with_columns(
-            id=pl.col("cty_code").rank(method="ordinal").cast(pl.Int64)
-        )
+        country = country.filter(pl.col("cty_code").is_not_null())
 
         hts = jp_df.select(
             pl.col("commodity_code", "commodity_short_name", "commodity_description")
@@ -267,10 +528,11 @@ class DataPull:
                 "commodity_short_name": "hts_short_desc",
                 "commodity_description": "hts_long_desc",
             }
-        ).with_columns(id=pl.col("hts_code").rank(method="ordinal").cast(pl.Int64))
+        )
         hts = hts.with_columns(
             agri_prod=pl.col("hts_code").str.slice(0, 4).is_in(agri_prod)
         )
+        hts = self.prefix_columns(hts, "hts")
 
         # Create the Reference DataFrames
         sitc = (
@@ -278,9 +540,7 @@ class DataPull:
             .unique()
             .rename({"sitc": "sitc_code"})
         )
-        sitc = sitc.filter(pl.col("sitc_code").is_not_null()).with_columns(
-            id=pl.col("sitc_code").rank(method="ordinal").cast(pl.Int64)
-        )
+        sitc = sitc.filter(pl.col("sitc_code").is_not_null())
 
         naics = (
             jp_df.select(pl.col("naics", "naics_description"))
@@ -288,9 +548,8 @@ class DataPull:
             .rename({"naics": "naics_code"})
             .cast(pl.String)
         )
-        naics = naics.filter(pl.col("naics_code").is_not_null()).with_columns(
-            id=pl.col("naics_code").rank(method="ordinal").cast(pl.Int64)
-        )
+        naics = naics.filter(pl.col("naics_code").is_not_null())
+        naics = self.prefix_columns(naics, "naics")
 
         distric = (
             jp_df.select(pl.col("district_posh", "districtposhdesc"))
@@ -299,36 +558,100 @@ class DataPull:
                 {"district_posh": "district_code", "districtposhdesc": "district_desc"}
             )
         )
-        distric = distric.filter(pl.col("district_code").is_not_null()).with_columns(
-            id=pl.col("district_code").rank().cast(pl.Int64)
-        )
+        distric = distric.filter(pl.col("district_code").is_not_null())
 
         unit = jp_df.select(pl.col("unit_1")).unique().rename({"unit_1": "unit_code"})
-        unit = unit.filter(pl.col("unit_code").is_not_null()).with_columns(
-            id=pl.col("unit_code").rank(method="ordinal").cast(pl.Int64)
+        unit = unit.filter(pl.col("unit_code").is_not_null())
+        unit = unit.join(conv_factor, on="unit_code", how="left")
+
+        calendar = jp_df.select("date", "year", "month", "qrt", "fiscal_year").unique()
+
+        # Extract every reference table and the monthly totals in one scan
+        country, sitc, hts, naics, distric, unit, calendar, totals = pl.collect_all(
+            [
+                country,
+                sitc,
+                hts,
+                naics,
+                distric,
+                unit,
+                calendar,
+                self.month_totals(jp_df),
+            ]
         )
 
+        # The org rows are matched to these reference tables by code
+        org_references = ["countrytable", "htstable", "unittable"]
+        org_ids = self.reference_sizes(org_references)
+
+        # Add the new codes to the Reference tables
+        if "tradetable" not in self.conn.list_tables():
+            init_trade_table(self.data_file)
+            self.log_event("init", table="tradetable")
+        if "countrytable" not in self.conn.list_tables():
+            init_country_table(self.data_file)
+        country = self.upsert_dim("countrytable", country.lazy(), "cty_code")
+        if "sitctable" not in self.conn.list_tables():
+            init_sitc_table(self.data_file)
+        sitc = self.upsert_dim("sitctable", sitc.lazy(), "sitc_code")
+        if "htstable" not in self.conn.list_tables():
+            init_hts_table(self.data_file)
+        self.add_prefix_columns("htstable", "hts")
+        hts = self.upsert_dim("htstable", hts.lazy(), "hts_code")
+        if "naicstable" not in self.conn.list_tables():
+            init_naics_table(self.data_file)
+        self.add_prefix_columns("naicstable", "naics")
+        naics = self.upsert_dim("naicstable", naics.lazy(), "naics_code")
+        if "districttable" not in self.conn.list_tables():
+            init_district_table(self.data_file)
+        distric = self.upsert_dim("districttable", distric.lazy(), "district_code")
+        if "unittable" not in self.conn.list_tables():
+            init_unit_table(self.data_file)
+        self.update_conv_factors(conv_factor.collect())
+        unit = self.upsert_dim("unittable", unit.lazy(), "unit_code")
+        if "calendartable" not in self.conn.list_tables():
+            init_calendar_table(self.data_file)
+        self.upsert_dim("calendartable", calendar.lazy(), "date")
+
         # Join jp_df with the Reference DataFrames
-        jp_df = jp_df.join(country, on="cty_code", how="left").rename(
-            {"id": "country_id"}
-        )
         jp_df = jp_df.join(
-            sitc, left_on="sitc", right_on="sitc_code", how="left"
+            country.select("cty_code", "id"), on="cty_code", how="left"
+        ).rename({"id": "country_id"})
+        jp_df = jp_df.join(
+            sitc.select("sitc_code", "id"),
+            left_on="sitc",
+            right_on="sitc_code",
+            how="left",
         ).rename({"id": "sitc_id"})
         jp_df = jp_df.join(
-            hts, left_on="commodity_code", right_on="hts_code", how="left"
+            hts.select("hts_code", "id"),
+            left_on="commodity_code",
+            right_on="hts_code",
+            how="left",
         ).rename({"id": "hts_id"})
         jp_df = jp_df.join(
-            naics, left_on="naics", right_on="naics_code", how="left"
+            naics.select("naics_code", "id"),
+            left_on="naics",
+            right_on="naics_code",
+            how="left",
         ).rename({"id": "naics_id"})
         jp_df = jp_df.join(
-            distric, left_on="district_posh", right_on="district_code", how="left"
+            distric.select("district_code", "id"),
+            left_on="district_posh",
+            right_on="district_code",
+            how="left",
         ).rename({"id": "district_id"})
         jp_df = jp_df.join(
-            unit, left_on="unit_1", right_on="unit_code", how="left"
+            unit.select("unit_code", "id"),
+            left_on="unit_1",
+            right_on="unit_code",
+            how="left",
         ).rename({"id": "unit1_id"})
         jp_df = jp_df.join(
-            unit, left_on="unit_2", right_on="unit_code", how="left"
+            unit.select("unit_code", "id"),
+            left_on="unit_2",
+            right_on="unit_code",
+            how="left",
         ).rename({"id": "unit2_id"})
 
         jp_df = jp_df.select(
@@ -347,45 +670,593 @@ class DataPull:
                 "end_use_e",
                 "qty_1",
                 "qty_2",
+                "qty_kg",
+                "year",
+                "month",
+                "qrt",
+                "fiscal_year",
             )
         )
 
-        # Write to database
-        if "tradetable" not in self.conn.list_tables():
-            init_trade_table(self.data_file)
-            logging.info("Initialize the tradetable")
-        if "countrytable" not in self.conn.list_tables():
-            init_country_table(self.data_file)
-            self.conn.insert("countrytable", country.collect())
-            logging.info("Inserted Country Table")
-        if "sitctable" not in self.conn.list_tables():
-            init_sitc_table(self.data_file)
-            self.conn.insert("sitctable", sitc.collect())
-            logging.info("Inserted SITC Table")
-        if "htstable" not in self.conn.list_tables():
-            init_hts_table(self.data_file)
-            self.conn.insert("htstable", hts.collect())
-            logging.info("Inserted HTS Table")
-        if "naicstable" not in self.conn.list_tables():
-            init_naics_table(self.data_file)
-            self.conn.insert("naicstable", naics.collect())
-            logging.info("Inserted NAICS Table")
-        if "districttable" not in self.conn.list_tables():
-            init_district_table(self.data_file)
-            self.conn.insert("districttable", distric.collect())
-            logging.info("Inserted District Table")
-        if "unittable" not in self.conn.list_tables():
-            init_unit_table(self.data_file)
-            self.conn.insert("unittable", unit.collect())
-            logging.info("Inserted Unit Table")
-        if "jptradedata" not in self.conn.list_tables():
-            init_jp_trade_data_table(self.data_file)
-            self.conn.insert("jptradedata", jp_df.collect())
-            logging.info("Inserted JP Trade Data")
-        # os.remove(self.saving_dir + "raw/jp_instance.csv")
+        # Write only the months that are new or were revised
+        if "jptradedata" not in self.conn.list_tables() and self.storage == "duckdb":
+            init_jp_trade_data_table(self.data_file, self.compact)
+        self.add_fact_columns("jptradedata")
+        months = self.changed_months("jptradedata", totals)
+        if months:
+            self.insert_fact(
+                "jptradedata", jp_df.filter(pl.col("date").is_in(months)), months
+            )
+        self.log_event(
+            "insert",
+            table="jptradedata",
+            months=len(months),
+            seconds=time.perf_counter() - start,
+        )
+
+        # Org rows whose code was not in a reference table have a null id, their
+        # months are loaded again now that the code may be there
+        org_file = os.path.join(self.saving_dir, "raw/org_data.parquet")
+        if (
+            "inttradedata" in self.conn.list_tables()
+            and os.path.exists(org_file)
+            and self.reference_sizes(org_references) != org_ids
+        ):
+            self.insert_int_org(org_file)
+        return months
+
+    def reference_sizes(self, tables: list) -> dict:
+        # Number of rows of each existing reference table
+        existing = self.conn.list_tables()
+        return {
+            table: self.conn.table(table).count().execute()
+            for table in tables
+            if table in existing
+        }
+
+    def calendar_columns(self, df: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        Adds the year, month, quarter and fiscal year (July to June) of the date
+            column as small integers so queries can group on them directly.
+
+        Parameters
+        ----------
+        df: pl.LazyFrame
+            Data with a date column.
+
+        Returns
+        -------
+        pl.LazyFrame
+            Data with the year, month, qrt and fiscal_year columns.
+        """
+        return df.with_columns(
+            year=pl.col("date").dt.year().cast(pl.Int16),
+            month=pl.col("date").dt.month().cast(pl.Int8),
+            qrt=pl.col("date").dt.quarter().cast(pl.Int8),
+            fiscal_year=(
+                pl.col("date").dt.year() + (pl.col("date").dt.month() > 6)
+            ).cast(pl.Int16),
+        )
+
+    def prefix_columns(
+        self, df: pl.LazyFrame | pl.DataFrame, name: str
+    ) -> pl.LazyFrame | pl.DataFrame:
+        """
+        Adds the integer prefixes of the codes (e.g. hts2, hts4) so the data can be
+            aggregated by chapter without string operations. A prefix is null when
+            the code is shorter than the prefix or it is not numeric.
+
+        Parameters
+        ----------
+        df: pl.LazyFrame | pl.DataFrame
+            Reference table with a {name}_code column.
+        name: str
+            The classification. The options are "hts" and "naics".
+
+        Returns
+        -------
+        pl.LazyFrame | pl.DataFrame
+            The reference table with the prefix columns.
+        """
+        code = pl.col(f"{name}_code")
+        return df.with_columns(
+            pl.when(code.str.len_chars() >= digits)
+            .then(code.str.slice(0, digits).cast(pl.Int32, strict=False))
+            .alias(f"{name}{digits}")
+            for digits in self.code_prefixes[name]
+        )
+
+    def add_prefix_columns(self, table: str, name: str) -> None:
+        """
+        Adds the prefix columns to a reference table created before they existed
+            and fills them for the rows already in it.
+
+        Parameters
+        ----------
+        table: str
+            The reference table (e.g. "htstable").
+        name: str
+            The classification. The options are "hts" and "naics".
+
+        Returns
+        -------
+        None
+        """
+        columns = [f"{name}{digits}" for digits in self.code_prefixes[name]]
+        missing = [col for col in columns if col not in self.conn.table(table).columns]
+        if not missing:
+            return
+        for col in missing:
+            self.conn.raw_sql(f'ALTER TABLE "{table}" ADD COLUMN {col} INTEGER')
+        # Same rule as prefix_columns. The rows are updated in place because the
+        # fact tables reference them
+        values = ", ".join(
+            f"{name}{digits} = CASE WHEN length({name}_code) >= {digits} "
+            f"THEN TRY_CAST(left({name}_code, {digits}) AS INTEGER) END"
+            for digits in self.code_prefixes[name]
+        )
+        self.conn.raw_sql(f'UPDATE "{table}" SET {values}')
+        self.log_event("add_columns", table=table, columns=missing)
+
+    def add_fact_columns(self, table: str) -> None:
+        """
+        Adds the qty_kg and calendar columns to a fact table created before they
+            existed and fills them for the rows already in it, with the same rules
+            as insert_int_jp and calendar_columns.
+
+        Parameters
+        ----------
+        table: str
+            The fact table. The options are "jptradedata" and "inttradedata".
+
+        Returns
+        -------
+        None
+        """
+        if self.storage == "parquet" or table not in self.conn.list_tables():
+            return
+        columns = {
+            "qty_kg": "DOUBLE",
+            "year": "SMALLINT",
+            "month": "TINYINT",
+            "qrt": "TINYINT",
+            "fiscal_year": "SMALLINT",
+        }
+        current = self.conn.table(table).columns
+        missing = [col for col in columns if col not in current]
+        if not missing:
+            return
+        self.update_conv_factors(self.conv_factors())
+        for col in missing:
+            self.conn.raw_sql(f'ALTER TABLE "{table}" ADD COLUMN {col} {columns[col]}')
+        self.conn.raw_sql(
+            f"""
+            UPDATE "{table}" SET
+                qty_kg = qty_1 * COALESCE(
+                    (SELECT conv_factor FROM unittable WHERE id = "{table}".unit1_id), 1
+                ),
+                year = year(date),
+                month = month(date),
+                qrt = quarter(date),
+                fiscal_year = year(date) + CAST(month(date) > 6 AS INTEGER)
+            """
+        )
+        self.log_event("add_columns", table=table, columns=missing)
+
+    def conv_factors(self) -> pl.DataFrame:
+        """
+        Returns the factors that convert the quantity of each unit to kg, from the
+            code_units.json file of the external directory.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        pl.DataFrame
+            The unit_code and conv_factor of every unit with a factor.
+        """
+        if not os.path.exists(self.saving_dir + "external/code_units.json"):
+            self.pull_file(
+                url="https://raw.githubusercontent.com/ouslan/jp-imports/main/data/external/code_units.json",
+                filename=(self.saving_dir + "external/code_units.json"),
+            )
+        return (
+            pl.read_json(self.saving_dir + "external/code_units.json")
+            .unpivot(variable_name="unit_code", value_name="conv_factor")
+            .with_columns(pl.col("conv_factor").cast(pl.Float64))
+        )
+
+    def update_conv_factors(self, factors: pl.DataFrame) -> None:
+        """
+        Sets the conv_factor of the units already in the unittable from the factors
+            of code_units.json, adding the column to a unittable created before it
+            existed. A changed factor changes the qty_kg totals of the months with
+            the unit, so changed_months loads them again.
+
+        Parameters
+        ----------
+        factors: pl.DataFrame
+            The unit_code and conv_factor of every unit with a factor.
+
+        Returns
+        -------
+        None
+        """
+        if "conv_factor" not in self.conn.table("unittable").columns:
+            self.conn.raw_sql('ALTER TABLE "unittable" ADD COLUMN conv_factor DOUBLE')
+            self.log_event("add_columns", table="unittable", columns=["conv_factor"])
+        con = self.conn.con
+        con.register("conv_factors", factors.to_arrow())
+        try:
+            # The rows are updated in place because the fact tables reference them
+            rows = con.execute(
+                """
+                UPDATE "unittable" SET conv_factor = f.conv_factor
+                FROM conv_factors f
+                WHERE unittable.unit_code = f.unit_code
+                AND unittable.conv_factor IS DISTINCT FROM f.conv_factor
+                """
+            ).fetchone()[0]
+        finally:
+            con.unregister("conv_factors")
+        if rows:
+            self.log_event("update", table="unittable", rows=rows)
+
+    def upsert_dim(self, table: str, df: pl.LazyFrame, code: str) -> pl.LazyFrame:
+        """
+        Adds the rows of df whose code is not yet in the reference table. New rows are
+            numbered after the current maximum id so existing ids are never changed.
+
+        Parameters
+        ----------
+        table: str
+            The reference table to update (e.g. "htstable").
+        df: pl.LazyFrame
+            The reference rows found in the source data, without the id column.
+        code: str
+            The column that identifies a row of the reference table.
+
+        Returns
+        -------
+        pl.LazyFrame
+            The complete reference table after the insert.
+        """
+        current = self.conn.table(table).to_polars()
+        current = current.with_columns(
+            pl.col(code).cast(df.collect_schema()[code], strict=False)
+        )
+        new = df.join(current.lazy().select(code), on=code, how="anti").collect()
+        if not new.is_empty():
+            start = current["id"].max() or 0
+            new = new.with_columns(
+                id=(pl.col(code).rank(method="ordinal") + start).cast(pl.Int64)
+            )
+            self.conn.insert(table, new)
+            self.log_event("upsert", table=table, rows=len(new))
+            current = pl.concat(
+                [current, new.select(current.columns)], how="vertical_relaxed"
+            )
+        return current.lazy()
+
+    def month_totals(self, df: pl.LazyFrame, keys: list | None = None) -> pl.LazyFrame:
+        """
+        Returns the row count, value and quantity in kg of each month, used to find
+            the months that changed since the last load. With keys, the null ids in
+            them (their code was not in the reference table) are counted as
+            missing.
+
+        Parameters
+        ----------
+        df: pl.LazyFrame
+            The data to insert with the same columns as the fact table.
+        keys: list
+            The id columns whose nulls are counted.
+
+        Returns
+        -------
+        pl.LazyFrame
+            The date, rows, data, qty_kg and missing (with keys) of every month.
+        """
+        totals = dict(
+            rows=pl.len().cast(pl.Int64),
+            data=pl.col("data").sum().cast(pl.Int64),
+            qty_kg=pl.col("qty_kg").sum().cast(pl.Float64),
+        )
+        if keys:
+            missing = pl.sum_horizontal(pl.col(keys).is_null().cast(pl.Int64))
+            totals["missing"] = missing.sum()
+        return df.group_by("date").agg(**totals)
+
+    def table_totals(self, table: str) -> pl.DataFrame:
+        """
+        Returns the month_totals of the rows already in a fact table.
+
+        Parameters
+        ----------
+        table: str
+            The fact table (e.g. "jptradedata").
+
+        Returns
+        -------
+        pl.DataFrame
+            The date, rows, data, qty_kg and missing of every month.
+        """
+        current = self.conn.table(table)
+        keys = [column for column in self.fact_references if column in current.columns]
+        missing = sum(current[column].isnull().cast("int64") for column in keys)
+        return (
+            current.group_by("date")
+            .aggregate(
+                rows=current.count(),
+                data=current.data.sum(),
+                qty_kg=current.qty_kg.sum(),
+                missing=missing.sum(),
+            )
+            .to_polars()
+            .with_columns(
+                pl.col("date").cast(pl.Date),
+                pl.col("rows", "data", "missing").cast(pl.Int64),
+                pl.col("qty_kg").cast(pl.Float64).fill_null(0),
+            )
+        )
+
+    def changed_months(self, table: str, totals: pl.DataFrame) -> list:
+        """
+        Compares the monthly totals of the new data with the ones already in the
+            table and returns the months that are missing or were revised, or
+            whose rows with null ids now match a reference code. The qty_kg totals are compared with a relative tolerance because the sums
+            of floats depend on the order of the rows.
+
+        Parameters
+        ----------
+        table: str
+            The fact table to compare against (e.g. "jptradedata").
+        totals: pl.DataFrame
+            The monthly totals of the new data returned by month_totals.
+
+        Returns
+        -------
+        list
+            The months (as dates) that need to be loaded.
+        """
+        if table not in self.conn.list_tables():
+            return totals["date"].sort().to_list()
+        current = self.table_totals(table)
+        months = totals.join(current, on="date", how="left", suffix="_current")
+        changed = (
+            pl.col("rows_current").is_null()
+            | (pl.col("rows") != pl.col("rows_current"))
+            | (pl.col("data") != pl.col("data_current"))
+            | (
+                (pl.col("qty_kg") - pl.col("qty_kg_current")).abs()
+                > 1e-9 * pl.col("qty_kg").abs() + 1e-6
+            )
+        )
+        if "missing" in totals.columns:
+            changed = changed | (pl.col("missing") != pl.col("missing_current"))
+        months = months.filter(changed)
+        return months["date"].sort().to_list()
+
+    def delete_months(self, table: str, months: list) -> None:
+        """
+        Deletes the rows of the given months from a table. For the fact tables stored
+            as parquet the partitions of the months are removed.
+
+        Parameters
+        ----------
+        table: str
+            The table to delete from.
+        months: list
+            The months (as dates) to delete.
+
+        Returns
+        -------
+        None
+        """
+        if self.storage == "parquet" and table in ["jptradedata", "inttradedata"]:
+            for month in months:
+                shutil.rmtree(
+                    os.path.join(
+                        self.fact_dir(table), f"year={month.year}/month={month.month}"
+                    ),
+                    ignore_errors=True,
+                )
+            return
+        dates = ", ".join(f"'{month}'" for month in months)
+        self.conn.raw_sql(f"DELETE FROM {table} WHERE date IN ({dates})")
+
+    def fact_dir(self, table: str) -> str:
+        return os.path.abspath(os.path.join(self.saving_dir, "processed", table))
+
+    def insert_fact(self, table: str, df: pl.LazyFrame, months: list) -> None:
+        """
+        Replaces the rows of the given months of a fact table. The rows are streamed
+            to a staging parquet file and loaded by DuckDB from there, so they are
+            never held in memory at once, and are written in the order of
+            cluster_columns. The old rows are deleted and the new ones inserted in
+            a single transaction, so a failed insert leaves the table as it was.
+            With the parquet storage the rows are written as hive partitioned
+            parquet (year/month/trade_id) under the processed directory and the
+            table is a view over the files, so date and trade filters only read
+            the matching partitions.
+
+        Parameters
+        ----------
+        table: str
+            The fact table to insert into. The options are "jptradedata" and "inttradedata".
+        df: pl.LazyFrame
+            The rows to insert.
+        months: list
+            The months (as dates) in df. Their current rows are deleted.
+
+        Returns
+        -------
+        None
+        """
+        staging = self.fact_dir(table) + "_staging.parquet"
+        try:
+            df.sink_parquet(staging, row_group_size=self.row_group_size)
+            if self.storage == "duckdb":
+                # Compact tables have no foreign keys, the ids are checked before
+                # any row is deleted
+                if "id" not in self.conn.table(table).columns:
+                    self.check_references(staging)
+                con = self.conn.con
+                con.begin()
+                try:
+                    self.delete_months(table, months)
+                    self.conn.raw_sql(
+                        f"""
+                        INSERT INTO "{table}" BY NAME
+                        SELECT * FROM read_parquet('{staging}')
+                        ORDER BY {", ".join(self.cluster_columns)}
+                        """
+                    )
+                except Exception:
+                    con.rollback()
+                    raise
+                con.commit()
+            else:
+                self.delete_months(table, months)
+                # One month at a time so only a single month is in memory
+                for month in months:
+                    pl.scan_parquet(staging).filter(pl.col("date") == month).sort(
+                        self.cluster_columns, nulls_last=True
+                    ).collect(streaming=True).write_parquet(
+                        self.fact_dir(table), partition_by=["year", "month", "trade_id"]
+                    )
+                files = os.path.join(self.fact_dir(table), "**", "*.parquet")
+                self.conn.raw_sql(
+                    f"""
+                    CREATE OR REPLACE VIEW "{table}" AS
+                    SELECT * FROM read_parquet('{files}', hive_partitioning = true)
+                    """
+                )
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+
+    def check_references(self, staging: str) -> None:
+        """
+        Raises a ValueError if an id of the staged fact rows is not in its reference
+            table. It replaces the foreign keys that the compact fact tables do not
+            have.
+
+        Parameters
+        ----------
+        staging: str
+            The staging parquet file of insert_fact.
+
+        Returns
+        -------
+        None
+        """
+        columns = pq.read_schema(staging).names
+        for column, reference in self.fact_references.items():
+            if column not in columns:
+                continue
+            missing = self.conn.raw_sql(
+                f"""
+                SELECT COUNT(*) FROM read_parquet('{staging}')
+                WHERE {column} IS NOT NULL
+                AND {column} NOT IN (SELECT id FROM "{reference}")
+                """
+            ).fetchone()[0]
+            if missing:
+                raise ValueError(f"{missing} rows have a {column} not in {reference}")
+
+    def create_indexes(self) -> None:
+        """
+        Creates ART indexes on the code columns of the reference tables (e.g.
+            hts_code), so lookups of a single code do not scan the table. DuckDB
+            keeps the indexes up to date on later inserts. Only equality filters
+            use them, the code prefixes are resolved with the code index of
+            DataTrade.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        tables = self.conn.list_tables()
+        for table, column in self.code_columns.items():
+            if table not in tables:
+                continue
+            self.conn.raw_sql(
+                f'CREATE INDEX IF NOT EXISTS "{table}_{column}" ON "{table}" ({column})'
+            )
+            self.log_event("index", table=table, column=column)
+
+    def recluster(self, table: str | None = None, columns: list | None = None) -> None:
+        """
+        Rewrites a table in the order of its cluster columns. Incremental inserts
+            append the new and revised months at the end of the table and leave the
+            deleted rows behind, so after many of them the row groups are no
+            longer in date order. The sorted rows are copied to a new table with
+            the same definition, which replaces the table in a single
+            transaction, so the ids and the foreign keys are kept.
+            The fact tables of the parquet storage are sorted when written and
+            are skipped.
+
+        Parameters
+        ----------
+        table: str
+            The table to rewrite. Both fact tables if None.
+        columns: list
+            The columns to sort by. Defaults to cluster_columns.
+
+        Returns
+        -------
+        None
+        """
+        tables = [table] if table is not None else ["jptradedata", "inttradedata"]
+        order = ", ".join(columns if columns is not None else self.cluster_columns)
+        existing = self.conn.list_tables()
+        for name in tables:
+            if name not in existing or (
+                self.storage == "parquet" and name in ["jptradedata", "inttradedata"]
+            ):
+                continue
+            start = time.perf_counter()
+            con = self.conn.con
+            # A copy with the same columns, keys and defaults as the table
+            ddl = con.execute(
+                "SELECT sql FROM duckdb_tables() WHERE table_name = ?", [name]
+            ).fetchone()[0]
+            ddl = re.sub(
+                rf'^CREATE TABLE "?{re.escape(name)}"?\(',
+                f'CREATE TABLE "{name}_recluster"(',
+                ddl,
+            )
+            con.begin()
+            try:
+                con.execute(ddl)
+                con.execute(
+                    f'INSERT INTO "{name}_recluster" '
+                    f'SELECT * FROM "{name}" ORDER BY {order}'
+                )
+                con.execute(f'DROP TABLE "{name}"')
+                con.execute(f'ALTER TABLE "{name}_recluster" RENAME TO "{name}"')
+            except Exception:
+                con.rollback()
+                raise
+            con.commit()
+            self.log_event("recluster", table=name, seconds=time.perf_counter() - start)
+        # Frees the blocks of the replaced tables
+        self.conn.raw_sql("CHECKPOINT")
 
     def pull_census_hts(
-        self, end_year: int, start_year: int, exports: bool, state: str
+        self,
+        end_year: int,
+        start_year: int,
+        exports: bool,
+        state: str | list,
+        workers: int = 8,
     ) -> None:
         """
         Pulls HTS data from the Census and saves them in a parquet file.
@@ -398,26 +1269,15 @@ class DataPull:
             The first year to pull data from.
         exports: bool
             If True, pulls exports data. If False, pulls imports data.
-        state: str
-            The state to pull data from (e.g. "PR" for Puerto Rico).
+        state: str | list
+            The state or states to pull data from (e.g. "PR" for Puerto Rico).
+        workers: int
+            Number of requests made at the same time.
 
         Returns
         -------
         None
         """
-
-        empty_df = [
-            pl.Series("date", dtype=pl.Datetime),
-            pl.Series("census_value", dtype=pl.Int64),
-            pl.Series("comm_level", dtype=pl.String),
-            pl.Series("commodity", dtype=pl.String),
-            pl.Series("country_name", dtype=pl.String),
-            pl.Series("contry_code", dtype=pl.String),
-        ]
-        census_df = pl.DataFrame(empty_df)
-        base_url = "https://api.census.gov/data/timeseries/"
-        key = os.getenv("CENSUS_API_KEY")
-
         if exports:
             param = "CTY_CODE,CTY_NAME,ALL_VAL_MO,COMM_LVL,E_COMMODITY"
             flow = "intltrade/exports/statehs"
@@ -441,33 +1301,17 @@ class DataPull:
             }
             saving_path = f"{self.saving_dir}/raw/census_hts_imports.parquet"
 
-        for year in range(start_year, end_year + 1):
-            url = f"{base_url}{flow}?get={param}&STATE={state}&key={key}&time={year}"
-            r = requests.get(url).json()
-            df = pl.DataFrame(r)
-            names = df.select(pl.col("column_0")).transpose()
-            df = df.drop("column_0").transpose()
-            df = df.rename(names.to_dicts().pop()).rename(naming)
-            df = df.with_columns(
-                date=(pl.col("time") + "-01").str.to_datetime("%Y-%m-%d")
-            )
-            df = df.select(
-                pl.col(
-                    "date",
-                    "census_value",
-                    "comm_level",
-                    "commodity",
-                    "country_name",
-                    "contry_code",
-                )
-            )
-            df = df.with_columns(pl.col("census_value").cast(pl.Int64))
-            census_df = pl.concat([census_df, df], how="vertical")
-
-        census_df.write_parquet(saving_path)
+        self.pull_census(
+            flow, param, naming, start_year, end_year, state, saving_path, workers
+        )
 
     def pull_census_naics(
-        self, end_year: int, start_year: int, exports: bool, state: str
+        self,
+        end_year: int,
+        start_year: int,
+        exports: bool,
+        state: str | list,
+        workers: int = 8,
     ) -> None:
         """
         Pulls NAICS data from the Census and saves them in a parquet file.
@@ -480,25 +1324,15 @@ class DataPull:
             The first year to pull data from.
         exports: bool
             If True, pulls exports data. If False, pulls imports data.
-        state: str
-            The state to pull data from (e.g. "PR" for Puerto Rico).
+        state: str | list
+            The state or states to pull data from (e.g. "PR" for Puerto Rico).
+        workers: int
+            Number of requests made at the same time.
 
         Returns
         -------
         None
         """
-        empty_df = [
-            pl.Series("date", dtype=pl.Datetime),
-            pl.Series("census_value", dtype=pl.Int64),
-            pl.Series("comm_level", dtype=pl.String),
-            pl.Series("naics_code", dtype=pl.String),
-            pl.Series("country_name", dtype=pl.String),
-            pl.Series("contry_code", dtype=pl.String),
-        ]
-        census_df = pl.DataFrame(empty_df)
-        base_url = "https://api.census.gov/data/timeseries/"
-        key = os.getenv("CENSUS_API_KEY")
-
         if exports:
             param = "CTY_CODE,CTY_NAME,ALL_VAL_MO,COMM_LVL,NAICS"
             flow = "intltrade/exports/statenaics"
@@ -522,34 +1356,172 @@ class DataPull:
             }
             saving_path = f"{self.saving_dir}/raw/census_naics_imports.parquet"
 
-        for year in range(start_year, end_year + 1):
-            url = f"{base_url}{flow}?get={param}&STATE={state}&key={key}&time={year}"
-            r = requests.get(url).json()
-            df = pl.DataFrame(r)
-            names = df.select(pl.col("column_0")).transpose()
-            df = df.drop("column_0").transpose()
-            df = df.rename(names.to_dicts().pop()).rename(naming)
-            df = df.with_columns(
-                date=(pl.col("time") + "-01").str.to_datetime("%Y-%m-%d")
-            )
-            df = df.select(
-                pl.col(
-                    "date",
-                    "census_value",
-                    "comm_level",
-                    "naics_code",
-                    "country_name",
-                    "contry_code",
+        self.pull_census(
+            flow, param, naming, start_year, end_year, state, saving_path, workers
+        )
+
+    def pull_census(
+        self,
+        flow: str,
+        param: str,
+        naming: dict,
+        start_year: int,
+        end_year: int,
+        state: str | list,
+        saving_path: str,
+        workers: int = 8,
+    ) -> None:
+        """
+        Pulls every year and state of a Census flow in parallel. Each slice is saved
+            as its own part file under raw/census_parts, so a failed run can be
+            started again and only the missing slices (and the last year) are
+            requested. The parts are concatenated into saving_path once all of them
+            are downloaded, and then deleted so the next pull gets fresh data.
+
+        Parameters
+        ----------
+        flow: str
+            The Census timeseries endpoint (e.g. "intltrade/exports/statehs").
+        param: str
+            The variables to request.
+        naming: dict
+            New names of the variables.
+        start_year: int
+            The first year to pull data from.
+        end_year: int
+            The last year to pull data from.
+        state: str | list
+            The state or states to pull data from.
+        saving_path: str
+            The parquet file to save the data to.
+        workers: int
+            Number of requests made at the same time.
+
+        Returns
+        -------
+        None
+        """
+        states = [state] if isinstance(state, str) else state
+        parts_dir = os.path.join(self.saving_dir, "raw", "census_parts")
+        os.makedirs(parts_dir, exist_ok=True)
+        key = os.getenv("CENSUS_API_KEY")
+
+        parts = []
+        pending = []
+        for st in states:
+            for year in range(start_year, end_year + 1):
+                part = os.path.join(
+                    parts_dir, f"{flow.replace('/', '_')}_{st}_{year}.parquet"
                 )
+                parts.append(part)
+                # The last year may have been partly published when its part
+                # was saved, so it is always requested again
+                if not os.path.exists(part) or year == end_year:
+                    url = f"{self.census_url}{flow}?get={param}&STATE={st}&key={key}&time={year}"
+                    pending.append((url, part))
+
+        self.log_event("census_pull", flow=flow, pending=len(pending), total=len(parts))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.pull_census_part, url, part, naming): part
+                for url, part in pending
+            }
+            failed = []
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    self.log_event(
+                        "census_pull",
+                        flow=flow,
+                        part=futures[future],
+                        error=str(future.exception()),
+                    )
+                    failed.append(future.exception())
+        if failed:
+            raise failed[0]
+
+        pl.concat(
+            [pl.scan_parquet(part) for part in parts], how="vertical"
+        ).sink_parquet(saving_path)
+        # The parts only resume a failed run, a later pull requests every slice
+        for part in parts:
+            os.remove(part)
+
+    def pull_census_part(self, url: str, part: str, naming: dict) -> None:
+        """
+        Requests one slice of a Census flow and saves it as a parquet part file.
+
+        Parameters
+        ----------
+        url: str
+            The Census API URL of the slice.
+        part: str
+            The parquet file to save the slice to.
+        naming: dict
+            New names of the variables.
+
+        Returns
+        -------
+        None
+        """
+        response = self.get_session().get(url, timeout=self.census_timeout)
+        response.raise_for_status()
+        # The Census API answers 204 with no body when a slice has no data
+        rows = response.json() if response.content else [list(naming) + ["time"]]
+        df = pl.DataFrame(
+            rows[1:], schema={col: pl.String for col in rows[0]}, orient="row"
+        )
+        df = df.rename(naming).with_columns(
+            date=(pl.col("time") + "-01").str.to_datetime("%Y-%m-%d")
+        )
+        df = df.select(
+            pl.col(
+                "date",
+                "census_value",
+                "comm_level",
+                list(naming.values())[-1],
+                "country_name",
+                "contry_code",
             )
-            df = df.with_columns(pl.col("census_value").cast(pl.Int64))
-            census_df = pl.concat([census_df, df], how="vertical")
+        )
+        df = df.with_columns(pl.col("census_value").cast(pl.Int64))
+        # Write to a temporary file first so an interrupted write is not a part
+        df.write_parquet(part + ".tmp")
+        os.replace(part + ".tmp", part)
 
-        census_df.write_parquet(saving_path)
+    def get_session(self) -> requests.Session:
+        """
+        Returns the HTTP session shared by the requests of this class. The session
+            keeps a connection pool and retries failed requests with backoff.
 
-    def pull_file(self, url: str, filename: str, verify: bool = True) -> None:
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        requests.Session
+        """
+        if self.session is None:
+            retry = Retry(
+                total=self.http_retries,
+                backoff_factor=self.http_backoff,
+                status_forcelist=[429, 500, 502, 503, 504],
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_maxsize=32)
+            self.session = requests.Session()
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def pull_file(
+        self, url: str, filename: str, verify: bool = True, workers: int = 4
+    ) -> None:
         """
         Pulls a file from a URL and saves it in the filename. Used by the class to pull external files.
+            When the server accepts byte ranges the file is downloaded in ranges at
+            the same time and the finished ranges are saved in a state file next to
+            it, so an interrupted download continues where it stopped. The file is
+            not downloaded again if the remote ETag and Last-Modified did not change.
 
         Parameters
         ----------
@@ -559,14 +1531,99 @@ class DataPull:
             The filename to save the file to.
         verify: bool
             If True, verifies the SSL certificate. If False, does not verify the SSL certificate.
+        workers: int
+            Number of ranges downloaded at the same time.
 
         Returns
         -------
         None
         """
+        session = self.get_session()
+        head = session.head(url, allow_redirects=True, verify=verify)
+        remote = {
+            "url": url,
+            "etag": head.headers.get("ETag"),
+            "last_modified": head.headers.get("Last-Modified"),
+            "size": int(head.headers.get("Content-Length", 0)),
+        }
+        state_file = filename + ".state"
+        state = {}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+        same = (
+            bool(remote["etag"] or remote["last_modified"])
+            and {key: state.get(key) for key in remote} == remote
+        )
+
+        if same and state.get("complete") and os.path.exists(filename):
+            if os.path.getsize(filename) == remote["size"]:
+                self.log_event("download", file=filename, skipped=True)
+                return
+
+        part_file = filename + ".part"
+        if head.headers.get("Accept-Ranges") != "bytes" or not remote["size"]:
+            self.pull_file_stream(session, url, part_file, verify)
+            os.replace(part_file, filename)
+            self.save_state(state_file, {**remote, "complete": True})
+            return
+
+        ranges = [
+            (start, min(start + self.range_size, remote["size"]) - 1)
+            for start in range(0, remote["size"], self.range_size)
+        ]
+        if not (same and os.path.exists(part_file)):
+            state = {**remote, "done": []}
+            with open(part_file, "wb") as f:
+                f.truncate(remote["size"])
+            self.save_state(state_file, state)
+        done = set(state["done"])
+        pending = [byte_range for byte_range in ranges if byte_range[0] not in done]
+        lock = threading.Lock()
+
+        def pull_range(byte_range: tuple) -> None:
+            start, end = byte_range
+            headers = {"Range": f"bytes={start}-{end}"}
+            if remote["etag"]:
+                headers["If-Range"] = remote["etag"]
+            with session.get(url, headers=headers, stream=True, verify=verify) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError(f"{url} changed or ignored the range {start}-{end}")
+                with open(part_file, "r+b") as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+                        bar.update(len(chunk))
+                    if f.tell() != end + 1:
+                        raise IOError(f"Incomplete range {start}-{end} of {url}")
+            with lock:
+                state["done"].append(start)
+                self.save_state(state_file, state)
+
+        with tqdm(
+            total=remote["size"],
+            initial=remote["size"] - sum(end - start + 1 for start, end in pending),
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            desc="Downloading",
+        ) as bar:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(pull_range, pending))
+
+        if os.path.getsize(part_file) != remote["size"]:
+            raise IOError(f"Downloaded size of {url} does not match Content-Length")
+        os.replace(part_file, filename)
+        self.save_state(state_file, {**remote, "complete": True})
+
+    def pull_file_stream(
+        self, session: requests.Session, url: str, filename: str, verify: bool
+    ) -> None:
         chunk_size = 10 * 1024 * 1024
 
-        with requests.get(url, stream=True, verify=verify) as response:
+        with session.get(url, stream=True, verify=verify) as response:
+            response.raise_for_status()
             total_size = int(response.headers.get("content-length", 0))
 
             with tqdm(
@@ -583,3 +1640,8 @@ class DataPull:
                             bar.update(
                                 len(chunk)
                             )  # Update the progress bar with the size of the chunk
+
+    def save_state(self, state_file: str, state: dict) -> None:
+        with open(state_file + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(state_file + ".tmp", state_file)
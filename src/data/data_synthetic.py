@@ -0,0 +1,220 @@
+from .data_pull import DataPull
+import pyarrow.parquet as pq
+import numpy as np
+import polars as pl
+
+
+class DataSynthetic:
+    """
+    Generates raw jp_data and org_data files with the columns of the IEPR files so
+        insert_int_jp and insert_int_org can be tested at scale. The HTS codes and
+        the countries are drawn from a Zipf distribution, so a few codes have most
+        of the rows as in the real data, and the files are written in chunks so
+        the memory used does not grow with the number of rows.
+    """
+
+    units = ["Kg", "No", "X", "Doz", "L", "M2", "T", "Prs", "Bbl", "M3"]
+    unit_weights = [0.4, 0.33, 0.09, 0.06, 0.03, 0.03, 0.02, 0.02, 0.01, 0.01]
+
+    def __init__(
+        self,
+        hts_codes: int = 20_000,
+        countries: int = 240,
+        naics_codes: int = 400,
+        start_year: int = 1995,
+        end_year: int = 2024,
+        skew: float = 1.1,
+        seed: int = 0,
+    ):
+        """
+        Initialize the DataSynthetic class and draw the codes of the files.
+
+        Parameters
+        ----------
+        hts_codes: int
+            Number of distinct 10 digit HTS codes.
+        countries: int
+            Number of distinct countries.
+        naics_codes: int
+            Number of distinct 6 digit NAICS codes. Every HTS code has one.
+        start_year: int
+            First year of the data.
+        end_year: int
+            Last year of the data, every month of every year is generated.
+        skew: float
+            Exponent of the Zipf distribution of the HTS codes and countries.
+        seed: int
+            Seed of the random generator, the same seed gives the same files.
+
+        Returns
+        -------
+        None
+        """
+        self.rng = np.random.default_rng(seed)
+        self.skew = skew
+        self.years = np.arange(start_year, end_year + 1)
+        self.hts = self.make_hts(hts_codes, naics_codes)
+        self.countries = self.make_countries(countries)
+        self.hts_weights = self.zipf_weights(len(self.hts))
+        self.country_weights = self.zipf_weights(len(self.countries))
+
+    def zipf_weights(self, n: int) -> np.ndarray:
+        # The most frequent codes are spread over the codes, not the lowest ones
+        weights = 1 / np.arange(1, n + 1) ** self.skew
+        return self.rng.permutation(weights / weights.sum())
+
+    def unique_codes(self, low: int, high: int, n: int) -> np.ndarray:
+        return np.sort(self.rng.choice(np.arange(low, high), n, replace=False))
+
+    def make_hts(self, hts_codes: int, naics_codes: int) -> pl.DataFrame:
+        # Chapters 01 to 97 without 77, which is reserved
+        chapters = np.array([c for c in range(1, 98) if c != 77])
+        headings = np.unique(
+            self.rng.choice(chapters, 1_500) * 100 + self.rng.integers(1, 100, 1_500)
+        )
+        codes = np.unique(
+            self.rng.choice(headings, hts_codes * 2) * 1_000_000
+            + self.rng.integers(0, 1_000_000, hts_codes * 2)
+        )
+        codes = self.rng.choice(codes, min(hts_codes, len(codes)), replace=False)
+        naics = self.unique_codes(111_110, 339_999, naics_codes)
+        unit_1 = self.rng.choice(self.units, len(codes), p=self.unit_weights)
+        unit_2 = np.where(self.rng.random(len(codes)) < 0.2, "Kg", "")
+        return pl.DataFrame(
+            {
+                "Commodity_Code": codes,
+                "Commodity_Short_Name": [f"Commodity {c}" for c in codes],
+                "Commodity_description": [f"Synthetic commodity {c}" for c in codes],
+                "hts_desc": [f"Synthetic commodity {c}" for c in codes],
+                "sitc": self.rng.integers(10_000, 99_999, len(codes)),
+                "naics": self.rng.choice(naics, len(codes)).astype(str),
+                "end_use_i": self.rng.integers(10_000, 99_999, len(codes)),
+                "unit_1": unit_1,
+                "unit_2": unit_2,
+            }
+        ).with_columns(
+            SITC_Short_Desc="Sitc " + pl.col("sitc").cast(pl.String),
+            SITC_Long_Desc="Synthetic sitc " + pl.col("sitc").cast(pl.String),
+            NAICS_description="Synthetic naics " + pl.col("naics"),
+            end_use_e=pl.col("end_use_i"),
+        )
+
+    def make_countries(self, countries: int) -> pl.DataFrame:
+        codes = self.unique_codes(1_000, 9_999, countries)
+        return pl.DataFrame(
+            {"cty_code": codes, "Country": [f"Country {c}" for c in codes]}
+        )
+
+    def draw(self, rows: int) -> pl.DataFrame:
+        """
+        Draws the codes, dates and values of a chunk of rows.
+
+        Parameters
+        ----------
+        rows: int
+            Number of rows to draw.
+
+        Returns
+        -------
+        pl.DataFrame
+            The columns of the HTS codes and countries drawn, with Trade, Year,
+            Month, data, qty_1 and qty_2.
+        """
+        hts = self.rng.choice(len(self.hts), rows, p=self.hts_weights)
+        country = self.rng.choice(len(self.countries), rows, p=self.country_weights)
+        df = pl.concat(
+            [self.hts[hts], self.countries[country]], how="horizontal"
+        ).with_columns(
+            Trade=pl.Series(self.rng.choice(["i", "e"], rows)),
+            Year=pl.Series(self.rng.choice(self.years, rows)),
+            Month=pl.Series(self.rng.integers(1, 13, rows)),
+            data=pl.Series(self.rng.lognormal(9, 2.5, rows).astype(np.int64)),
+            qty_1=pl.Series(self.rng.lognormal(6, 2.5, rows).astype(np.int64)),
+        )
+        return df.with_columns(
+            qty_2=pl.when(pl.col("unit_2") == "")
+            .then(0)
+            .otherwise(pl.col("qty_1") // 2)
+        )
+
+    def write_jp(self, path: str, rows: int, chunk_size: int = 1_000_000) -> None:
+        """
+        Writes a raw jp_data file (the columns of DataPull.jp_schema).
+
+        Parameters
+        ----------
+        path: str
+            Path of the parquet file.
+        rows: int
+            Number of rows of the file.
+        chunk_size: int
+            Number of rows generated and written at a time.
+
+        Returns
+        -------
+        None
+        """
+        self.write(path, rows, chunk_size, self.jp_chunk)
+
+    def write_org(self, path: str, rows: int, chunk_size: int = 1_000_000) -> None:
+        """
+        Writes a raw org_data file (the columns of DataPull.org_schema). It uses
+            the same HTS codes and countries as write_jp, so insert_int_org finds
+            them in the tables loaded from the jp_data file.
+
+        Parameters
+        ----------
+        path: str
+            Path of the parquet file.
+        rows: int
+            Number of rows of the file.
+        chunk_size: int
+            Number of rows generated and written at a time.
+
+        Returns
+        -------
+        None
+        """
+        self.write(path, rows, chunk_size, self.org_chunk)
+
+    def jp_chunk(self, rows: int) -> pl.DataFrame:
+        df = self.draw(rows).with_columns(
+            SubCountry_Code=pl.lit("-"),
+            district=pl.lit("49"),
+            DistrictDesc=pl.lit("San Juan, PR"),
+            district_posh=pl.lit("4909"),
+            DistrictPoshDesc=pl.lit("San Juan International Airport, PR"),
+        )
+        return df.select(
+            [pl.col(col).cast(dtype) for col, dtype in DataPull.jp_schema.items()]
+        )
+
+    def org_chunk(self, rows: int) -> pl.DataFrame:
+        df = self.draw(rows).select(
+            import_export="Trade",
+            country="Country",
+            year="Year",
+            month="Month",
+            value="data",
+            unit_1=pl.col("unit_1").str.to_uppercase(),
+            qty_1="qty_1",
+            unit_2=pl.when(pl.col("unit_2") != "").then(pl.col("unit_2")),
+            qty_2="qty_2",
+            HTS="'" + pl.col("Commodity_Code").cast(pl.String).str.zfill(10),
+            HTS_desc="hts_desc",
+        )
+        return df.select(
+            [pl.col(col).cast(dtype) for col, dtype in DataPull.org_schema.items()]
+        )
+
+    def write(self, path: str, rows: int, chunk_size: int, chunk) -> None:
+        writer = None
+        for start in range(0, rows, chunk_size):
+            table = chunk(min(chunk_size, rows - start)).to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    path, table.schema, compression=DataPull.parquet_compression
+                )
+            writer.write_table(table, row_group_size=DataPull.row_group_size)
+        if writer is not None:
+            writer.close()
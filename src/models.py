@@ -1,13 +1,76 @@
+import threading
 import duckdb
+import os
 
+# One database handle per file shared by the whole process, and a cursor of it for
+# each thread. DuckDB connections are not thread safe, but cursors of the same
+# handle can be used concurrently. A handle opened for writing is also used for
+# read only requests, a handle opened read only must be closed with
+# close_database before the file can be written.
+databases = {}
+databases_lock = threading.Lock()
+cursors = threading.local()
 
-def get_conn(db_path: str) -> duckdb.DuckDBPyConnection:
-    return duckdb.connect(db_path)
 
+def get_database(db_path: str, read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    key = db_path if db_path == ":memory:" else os.path.abspath(db_path)
+    with databases_lock:
+        if key in databases:
+            database, opened_read_only = databases[key]
+            if opened_read_only and not read_only:
+                raise ValueError(f"{db_path} is open in read only mode")
+            return database
+        database = duckdb.connect(db_path, read_only=read_only)
+        databases[key] = (database, read_only)
+        return database
 
-def init_int_trade_data_table(db_path: str) -> None:
+
+def close_database(db_path: str) -> None:
+    key = db_path if db_path == ":memory:" else os.path.abspath(db_path)
+    with databases_lock:
+        if key in databases:
+            databases.pop(key)[0].close()
+
+
+def get_conn(db_path: str, read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    database = get_database(db_path, read_only)
+    if not hasattr(cursors, "conns"):
+        cursors.conns = {}
+    parent, cursor = cursors.conns.get(db_path, (None, None))
+    if parent is not database:
+        cursor = database.cursor()
+        cursors.conns[db_path] = (database, cursor)
+    return cursor
+
+
+def init_int_trade_data_table(db_path: str, compact: bool = False) -> None:
     conn = get_conn(db_path=db_path)
 
+    if compact:
+        # Narrow types, no surrogate key and no foreign keys, which are checked
+        # by DataPull.insert_fact instead
+        conn.sql(
+            """
+            CREATE TABLE IF NOT EXISTS "inttradedata" (
+                trade_id TINYINT,
+                hts_id INTEGER,
+                country_id SMALLINT,
+                data BIGINT DEFAULT 0,
+                unit1_id SMALLINT,
+                qty_1 BIGINT DEFAULT 0,
+                unit2_id SMALLINT,
+                qty_2 BIGINT DEFAULT 0,
+                qty_kg DOUBLE DEFAULT 0,
+                date DATE,
+                year SMALLINT,
+                month TINYINT,
+                qrt TINYINT,
+                fiscal_year SMALLINT
+            );
+            """
+        )
+        return
+
     # Create sequence for primary keys
     conn.sql("DROP SEQUENCE IF EXISTS int_trade_data_sequence;")
     conn.sql("CREATE SEQUENCE int_trade_data_sequence START 1;")
@@ -25,15 +88,50 @@ def init_int_trade_data_table(db_path: str) -> None:
             qty_1 BIGINT DEFAULT 0,
             unit2_id INTEGER REFERENCES unittable(id),
             qty_2 BIGINT DEFAULT 0,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            qty_kg DOUBLE DEFAULT 0,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            year SMALLINT,
+            month TINYINT,
+            qrt TINYINT,
+            fiscal_year SMALLINT
         );
         """
     )
 
 
-def init_jp_trade_data_table(db_path: str) -> None:
+def init_jp_trade_data_table(db_path: str, compact: bool = False) -> None:
     conn = get_conn(db_path=db_path)
 
+    if compact:
+        # Narrow types, no surrogate key and no foreign keys, which are checked
+        # by DataPull.insert_fact instead
+        conn.sql(
+            """
+            CREATE TABLE IF NOT EXISTS "jptradedata" (
+                trade_id TINYINT,
+                hts_id INTEGER,
+                country_id SMALLINT,
+                district_id SMALLINT,
+                sitc_id SMALLINT,
+                naics_id SMALLINT,
+                data INTEGER DEFAULT 0,
+                end_use_i INTEGER,
+                end_use_e INTEGER,
+                unit1_id SMALLINT,
+                qty_1 BIGINT DEFAULT 0,
+                unit2_id SMALLINT,
+                qty_2 BIGINT DEFAULT 0,
+                qty_kg DOUBLE DEFAULT 0,
+                date DATE,
+                year SMALLINT,
+                month TINYINT,
+                qrt TINYINT,
+                fiscal_year SMALLINT
+            );
+            """
+        )
+        return
+
     # Create sequence for primary key
     conn.sql("DROP SEQUENCE IF EXISTS jp_trade_data_sequence;")
     conn.sql("CREATE SEQUENCE jp_trade_data_sequence START 1;")
@@ -56,7 +154,12 @@ def init_jp_trade_data_table(db_path: str) -> None:
             qty_1 BIGINT DEFAULT 0,
             unit2_id INTEGER REFERENCES unittable(id),
             qty_2 BIGINT DEFAULT 0,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            qty_kg DOUBLE DEFAULT 0,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            year SMALLINT,
+            month TINYINT,
+            qrt TINYINT,
+            fiscal_year SMALLINT
         );
         """
     )
@@ -88,7 +191,11 @@ def init_hts_table(db_path: str) -> None:
             hts_code TEXT,
             hts_short_desc TEXT,
             hts_long_desc TEXT,
-            agri_prod BOOLEAN
+            agri_prod BOOLEAN,
+            hts2 INTEGER,
+            hts4 INTEGER,
+            hts6 INTEGER,
+            hts8 INTEGER
         );
         """
     )
@@ -120,7 +227,12 @@ def init_naics_table(db_path: str) -> None:
         CREATE TABLE IF NOT EXISTS "naicstable" (
             id INTEGER PRIMARY KEY DEFAULT nextval('naics_sequence'),
             naics_code TEXT,
-            naics_description TEXT
+            naics_description TEXT,
+            naics2 INTEGER,
+            naics3 INTEGER,
+            naics4 INTEGER,
+            naics5 INTEGER,
+            naics6 INTEGER
         );
         """
     )
@@ -165,7 +277,39 @@ def init_unit_table(db_path: str) -> None:
         """
         CREATE TABLE IF NOT EXISTS "unittable" (
             id INTEGER PRIMARY KEY DEFAULT nextval('unit_sequence'),
-            unit_code TEXT
+            unit_code TEXT,
+            conv_factor DOUBLE
+        );
+        """
+    )
+
+
+def init_calendar_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+    conn.sql("DROP SEQUENCE IF EXISTS calendar_sequence;")
+    conn.sql("CREATE SEQUENCE calendar_sequence START 1;")
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "calendartable" (
+            id INTEGER PRIMARY KEY DEFAULT nextval('calendar_sequence'),
+            date DATE,
+            year SMALLINT,
+            month TINYINT,
+            qrt TINYINT,
+            fiscal_year SMALLINT
+        );
+        """
+    )
+
+
+def init_version_table(db_path: str) -> None:
+    conn = get_conn(db_path=db_path)
+    conn.sql(
+        """
+        CREATE TABLE IF NOT EXISTS "versiontable" (
+            id INTEGER PRIMARY KEY,
+            version TEXT,
+            database_id TEXT
         );
         """
     )
@@ -179,6 +323,8 @@ if __name__ == "__main__":
     init_naics_table(db_path)
     init_district_table(db_path)
     init_unit_table(db_path)
+    init_calendar_table(db_path)
+    init_version_table(db_path)
     init_int_trade_data_table(db_path)
     init_trade_table(db_path)
 
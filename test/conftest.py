@@ -0,0 +1,28 @@
+import pytest
+from src.data.data_process import DataTrade
+import shutil
+
+
+@pytest.fixture(scope="session")
+def new_database(tmp_path_factory):
+    """
+    Returns a function that makes a DataTrade in a new directory, with the raw
+        samples and code_units.json copied to it, and inserts the given sources.
+        Extra keyword arguments are passed to DataTrade (e.g. storage or cache).
+    """
+
+    def make(insert: tuple = ("jp", "org"), name: str = "data", **kwargs) -> DataTrade:
+        saving_dir = str(tmp_path_factory.mktemp(name)) + "/"
+        d = DataTrade(
+            saving_dir, saving_dir + "test.ddb", saving_dir + "test.log", **kwargs
+        )
+        shutil.copy("test/test_inserts/jp_data_sample.parquet", d.jp_data)
+        shutil.copy("test/test_inserts/org_data_sample.parquet", d.org_data)
+        shutil.copy("data/external/code_units.json", saving_dir + "external/")
+        if "jp" in insert:
+            d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+        if "org" in insert:
+            d.insert_int_org(d.org_data)
+        return d
+
+    return make
@@ -0,0 +1,79 @@
+import pytest
+from polars.testing import assert_frame_equal
+import asyncio
+import time
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    yield new_database()
+
+
+def test_async_results(setup_database):
+    d = setup_database
+
+    async def main():
+        return await asyncio.gather(
+            d.aprocess_int_jp("hts", "monthly", level_filter="0"),
+            d.aprocess_int_org("country", "yearly"),
+            d.aprocess_price(agriculture_filter=True),
+        )
+
+    jp, org, price = asyncio.run(main())
+    expected = [
+        d.process_int_jp("hts", "monthly", level_filter="0").to_polars(),
+        d.process_int_org("country", "yearly").to_polars(),
+        d.process_price(agriculture_filter=True).to_polars(),
+    ]
+
+    for df1, df2 in zip([jp, org, price], expected):
+        assert_frame_equal(df1.sort(df1.columns), df2.sort(df2.columns))
+
+
+def test_coalesce(setup_database, monkeypatch):
+    d = setup_database
+    calls = []
+    process_int_jp = d.process_int_jp
+
+    def counted(**params):
+        calls.append(params)
+        time.sleep(0.2)
+        return process_int_jp(**params)
+
+    monkeypatch.setattr(d, "process_int_jp", counted)
+
+    async def main():
+        return await asyncio.gather(
+            *[d.aprocess_int_jp("naics", "yearly") for i in range(10)],
+            d.aprocess_int_jp("naics", "qrt"),
+        )
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 2
+    assert all(df.equals(results[0]) for df in results[:10])
+    assert d.inflight == {}
+
+
+def test_timeout(setup_database, monkeypatch):
+    d = setup_database
+
+    def slow(**params):
+        return d.conn.sql(
+            "SELECT SUM(a.range * b.range) AS x FROM range(100000) a, range(100000) b"
+        )
+
+    monkeypatch.setattr(d, "process_price", slow)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await d.aprocess_price(timeout=0.2)
+        # The interrupted query leaves the worker free
+        start = time.perf_counter()
+        levels = ["total", "naics", "hts", "country"]
+        await asyncio.gather(
+            *[d.aprocess_int_jp(level, "yearly", timeout=10) for level in levels]
+        )
+        return time.perf_counter() - start
+
+    assert asyncio.run(main()) < 5
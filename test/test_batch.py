@@ -0,0 +1,64 @@
+import pytest
+from src.data.data_cache import PlanCache, ResultCache
+from polars.testing import assert_frame_equal
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    yield new_database()
+
+
+@pytest.mark.parametrize(
+    "table,level,level_filters",
+    [
+        ("jptradedata", "hts", ["02", "0201", "87", "8703"]),
+        ("jptradedata", "naics", ["3", "31", "3254"]),
+        ("jptradedata", "country", ["1", "5"]),
+        ("inttradedata", "hts", ["02", "3004"]),
+        ("jptradedata", "total", None),
+    ],
+)
+def test_batch_matches_single(setup_database, table, level, level_filters):
+    d = setup_database
+    datetimes = ["2019-01-01+2019-12-01", "2020-03-01", "2020-01-01+2021-12-01"]
+    single = d.process_int_jp if table == "jptradedata" else d.process_int_org
+    batch = d.process_batch(
+        table, level, "monthly", level_filters=level_filters, datetimes=datetimes
+    ).to_polars()
+
+    for datetime in datetimes:
+        for level_filter in level_filters or [""]:
+            df1 = single(
+                level=level,
+                time_frame="monthly",
+                datetime=datetime,
+                level_filter=level_filter,
+            ).to_polars()
+            df2 = batch.filter(datetime=datetime)
+            if level_filters:
+                df2 = df2.filter(level_filter=level_filter)
+            df2 = df2.select(df1.columns)
+
+            assert_frame_equal(df1.sort(df1.columns), df2.sort(df1.columns))
+
+
+def test_batch_invalid_prefix(setup_database):
+    d = setup_database
+    with pytest.raises(ValueError):
+        d.process_batch("jptradedata", "hts", "yearly", level_filters=["02", "zz"])
+
+
+def test_batch_built_once(setup_database, monkeypatch, tmp_path):
+    d = setup_database
+    calls = []
+    monkeypatch.setattr(d, "cache", ResultCache(str(tmp_path)))
+    monkeypatch.setattr(d, "plans", PlanCache())
+
+    def lookup_codes(level, prefix):
+        calls.append(prefix)
+        return type(d).lookup_codes(d, level, prefix)
+
+    monkeypatch.setattr(d, "lookup_codes", lookup_codes)
+    d.process_batch("jptradedata", "hts", "yearly", level_filters=["02", "87"])
+
+    assert calls == ["02", "87"]
@@ -0,0 +1,163 @@
+import pytest
+from src.data.data_process import DataTrade
+from src.data.data_cache import PlanCache, ResultCache
+from src.models import close_database
+from polars.testing import assert_frame_equal
+import polars as pl
+import pyarrow as pa
+import sqlglot
+import os
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database(insert=())
+    raw = pl.read_parquet("test/test_inserts/jp_data_sample.parquet")
+    raw.filter(pl.col("Year") < 2020).write_parquet(d.jp_data)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    d.conn.disconnect()
+    d = DataTrade(d.saving_dir, d.data_file, d.saving_dir + "test.log", cache=True)
+    yield d, raw
+
+
+def test_cache_hit(setup_database):
+    d, raw = setup_database
+    df1 = d.process_int_jp(level="hts", time_frame="yearly").to_polars()
+    files = os.listdir(d.cache.cache_dir)
+    df2 = d.process_int_jp("hts", "yearly").to_polars()
+
+    assert len(files) == 1
+    assert os.listdir(d.cache.cache_dir) == files
+    assert_frame_equal(df1, df2)
+
+
+def test_disk_tier(setup_database):
+    d, raw = setup_database
+    df1 = d.process_int_jp(level="total", time_frame="fiscal").to_polars()
+    d.cache.memory.clear()
+    df2 = d.process_int_jp(level="total", time_frame="fiscal").to_polars()
+
+    assert len(d.cache.memory) == 1
+    assert_frame_equal(df1, df2)
+
+
+def test_insert_invalidates(setup_database):
+    d, raw = setup_database
+    df1 = d.process_int_jp(level="total", time_frame="yearly").to_polars()
+    version = d.data_version
+    raw.write_parquet(d.jp_data)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    df2 = d.process_int_jp(level="total", time_frame="yearly").to_polars()
+
+    assert d.data_version != version
+    assert df1["year"].max() < df2["year"].max()
+
+
+def test_rebuilt_database(new_database):
+    d = new_database(insert=("jp",), name="rebuilt", cache=True)
+    df1 = d.process_int_jp(level="total", time_frame="yearly").to_polars()
+    d.conn.disconnect()
+    close_database(d.data_file)
+    os.remove(d.data_file)
+
+    raw = pl.read_parquet("test/test_inserts/jp_data_sample.parquet")
+    raw.with_columns(pl.col("data") + 1).write_parquet(d.jp_data)
+    d = DataTrade(d.saving_dir, d.data_file, d.saving_dir + "test.log", cache=True)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    df2 = d.process_int_jp(level="total", time_frame="yearly").to_polars()
+    d.cache = None
+    df3 = d.process_int_jp(level="total", time_frame="yearly").to_polars()
+
+    assert not df1.equals(df2)
+    assert_frame_equal(df2, df3)
+
+
+def test_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_items=2, max_bytes=3000)
+    for i in range(5):
+        cache.put(str(i), pa.table({"value": list(range(100))}))
+
+    assert list(cache.memory) == ["3", "4"]
+    assert (
+        sum(os.path.getsize(tmp_path / file) for file in os.listdir(tmp_path)) <= 3000
+    )
+    assert cache.get("4") is not None
+
+
+@pytest.mark.parametrize(
+    "datetime,level_filter",
+    [
+        ("2018-01-01+2019-06-01", "0"),
+        ("2019-03-01+2019-12-01", "87"),
+        ("2019-05-01", "1"),
+        ("2018-11-01", ""),
+    ],
+)
+def test_plan_results(setup_database, datetime, level_filter):
+    d, raw = setup_database
+    params = dict(level="hts", time_frame="monthly", datetime=datetime)
+    df1 = d.process_int_jp(**params, level_filter=level_filter).to_polars()
+    plans, cache = d.plans, d.cache
+    d.plans, d.cache = None, None
+    df2 = d.process_int_jp(**params, level_filter=level_filter).to_polars()
+    d.plans, d.cache = plans, cache
+    keys = ["year", "month", "hts_id"]
+
+    assert_frame_equal(df1.sort(keys), df2.sort(keys))
+
+
+def test_plan_reused(setup_database):
+    d, raw = setup_database
+    d.plans.clear()
+    for prefix in ["0", "1", "2"]:
+        d.process_int_jp(
+            "hts", "yearly", datetime="2018-01-01+2019-12-01", level_filter=prefix
+        )
+    with pytest.raises(ValueError):
+        d.process_int_jp(
+            "hts", "yearly", datetime="2018-01-01+2019-12-01", level_filter="zz"
+        )
+
+    assert len(d.plans.plans) == 1
+    sql, used, schema = list(d.plans.plans.values())[0]
+    assert used == ["start", "end", "prefix"]
+
+
+def test_plan_placeholders(setup_database):
+    d, raw = setup_database
+    d.plans.clear()
+    for level in ["hts", "naics", "country"]:
+        for datetime in ["2019-02-01+2019-07-01", "2019-04-01"]:
+            d.process_int_jp(level, "monthly", datetime=datetime, level_filter="1")
+
+    assert len(d.plans.plans) == 6
+    for sql, used, schema in d.plans.plans.values():
+        assert "$prefix" in sql
+        for placeholder in PlanCache.placeholders.values():
+            assert placeholder not in sql
+
+
+def test_plan_placeholder_left():
+    plans = PlanCache()
+    cast = sqlglot.parse_one(
+        "SELECT * FROM t WHERE date >= CAST('1000-01-01' AS TIMESTAMP)"
+    )
+    like = sqlglot.parse_one("SELECT * FROM t WHERE code LIKE 'plan_prefix%'")
+    sql, used, schema = plans.put("cast", cast, ["start"], None)
+
+    assert used == ["start"] and "CAST($start AS TIMESTAMP)" in sql
+    with pytest.raises(ValueError, match="plan_prefix"):
+        plans.put("like", like, ["prefix"], None)
+    assert list(plans.plans) == ["cast"]
+
+
+def test_plan_prepared(setup_database):
+    d, raw = setup_database
+    d.plans.clear()
+    d.bootstrap()
+    for prefix in ["0", "1", "2"]:
+        d.process_int_jp(
+            "hts", "yearly", datetime="2018-03-01+2019-10-01", level_filter=prefix
+        )
+
+    assert len(d.local.prepared["names"]) == 1
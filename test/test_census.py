@@ -0,0 +1,144 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from src.data.data_pull import DataPull
+from src.data.data_profile import QueryProfiler
+import polars as pl
+import threading
+import pytest
+import json
+import os
+
+
+class CensusHandler(BaseHTTPRequestHandler):
+    """Mimics the JSON array answers of the Census timeseries API."""
+
+    requests = []
+    failing = set()
+    offset = 0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        year = int(query["time"][0])
+        state = query["STATE"][0]
+        self.requests.append((state, year))
+        if (state, year) in self.failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        if year == 2015:
+            self.send_response(204)
+            self.end_headers()
+            return
+        header = query["get"][0].split(",") + ["STATE", "time"]
+        rows = [header] + [
+            ["1220", "CANADA", str(year * 10 + month + self.offset), "HS2", "01", state]
+            + [f"{year}-{month:02d}"]
+            for month in range(1, 13)
+        ]
+        body = json.dumps(rows).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def census_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CensusHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+
+@pytest.fixture
+def data_pull(tmp_path, census_server):
+    saving_dir = str(tmp_path) + "/"
+    d = DataPull(saving_dir, saving_dir + "test.ddb", saving_dir + "test.log")
+    d.census_url = census_server
+    d.http_retries = 1
+    d.http_backoff = 0
+    CensusHandler.requests = []
+    CensusHandler.failing = set()
+    CensusHandler.offset = 0
+    return d
+
+
+def test_pull_census(data_pull):
+    data_pull.pull_census_hts(2019, 2016, exports=True, state=["PR", "VI"])
+    df = pl.read_parquet(data_pull.saving_dir + "raw/census_hts_exports.parquet")
+
+    assert len(CensusHandler.requests) == 8
+    assert len(df) == 8 * 12
+    assert df.columns == [
+        "date",
+        "census_value",
+        "comm_level",
+        "commodity",
+        "country_name",
+        "contry_code",
+    ]
+    assert (
+        df["census_value"].sum()
+        == sum(
+            year * 10 + month for year in range(2016, 2020) for month in range(1, 13)
+        )
+        * 2
+    )
+
+
+def test_empty_slice(data_pull):
+    data_pull.pull_census_naics(2016, 2015, exports=False, state="PR")
+    df = pl.read_parquet(data_pull.saving_dir + "raw/census_naics_imports.parquet")
+
+    assert df["date"].dt.year().unique().to_list() == [2016]
+    assert "naics_code" in df.columns
+
+
+def test_resume(data_pull):
+    CensusHandler.failing = {("PR", 2018)}
+    with pytest.raises(Exception):
+        data_pull.pull_census_hts(2019, 2016, exports=False, state="PR")
+    parts = os.listdir(data_pull.saving_dir + "raw/census_parts")
+    # The failed slice is requested again by the retry
+    assert CensusHandler.requests.count(("PR", 2018)) == 2
+    assert len(parts) == 3
+
+    CensusHandler.requests = []
+    CensusHandler.failing = set()
+    data_pull.pull_census_hts(2019, 2016, exports=False, state="PR")
+    df = pl.read_parquet(data_pull.saving_dir + "raw/census_hts_imports.parquet")
+
+    # The last year is requested again, it may have been revised
+    assert sorted(CensusHandler.requests) == [("PR", 2018), ("PR", 2019)]
+    assert len(df) == 4 * 12
+    assert os.listdir(data_pull.saving_dir + "raw/census_parts") == []
+
+
+def test_refresh(data_pull):
+    data_pull.pull_census_hts(2019, 2016, exports=False, state="PR")
+    CensusHandler.requests = []
+    CensusHandler.offset = 1
+    data_pull.pull_census_hts(2019, 2016, exports=False, state="PR")
+    df = pl.read_parquet(data_pull.saving_dir + "raw/census_hts_imports.parquet")
+
+    assert len(CensusHandler.requests) == 4
+    assert df["census_value"].sum() == sum(
+        year * 10 + month + 1 for year in range(2016, 2020) for month in range(1, 13)
+    )
+
+
+def test_events(data_pull):
+    events = []
+    data_pull.profiler = QueryProfiler(callback=events.append)
+    CensusHandler.failing = {("PR", 2018)}
+    with pytest.raises(Exception):
+        data_pull.pull_census_hts(2019, 2016, exports=False, state="PR")
+    flow = "intltrade/imports/statehs"
+
+    assert events[0] == {"event": "census_pull", "flow": flow, "pending": 4, "total": 4}
+    assert events[1]["event"] == "census_pull" and "error" in events[1]
@@ -0,0 +1,61 @@
+import pytest
+from polars.testing import assert_frame_equal
+
+
+def is_sorted(d, table, columns):
+    df = d.conn.sql(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+    df = df.to_polars()
+    return df.equals(df.sort(columns, nulls_last=True, maintain_order=True))
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    yield new_database(name="cluster")
+
+
+def test_sorted_on_insert(setup_database):
+    d = setup_database
+    assert is_sorted(d, "jptradedata", ["date", "hts_id"])
+    assert is_sorted(d, "inttradedata", ["date", "hts_id"])
+    assert is_sorted(d, "jptradedata_country", ["date", "country_id"])
+
+
+def test_recluster(setup_database):
+    d = setup_database
+    df1 = d.process_int_jp(level="hts", time_frame="monthly").to_polars()
+    count = d.conn.table("jptradedata").count().execute()
+    # Move the first month to the end, as a revised month of an incremental insert
+    d.conn.raw_sql(
+        """
+        CREATE TEMP TABLE first_month AS
+        SELECT * FROM jptradedata WHERE date = (SELECT MIN(date) FROM jptradedata);
+        DELETE FROM jptradedata WHERE date = (SELECT MIN(date) FROM first_month);
+        INSERT INTO jptradedata SELECT * FROM first_month;
+        """
+    )
+    assert not is_sorted(d, "jptradedata", ["date", "hts_id"])
+
+    d.recluster()
+    df2 = d.process_int_jp(level="hts", time_frame="monthly").to_polars()
+
+    assert is_sorted(d, "jptradedata", ["date", "hts_id"])
+    assert is_sorted(d, "jptradedata_hts", ["date", "hts_id"])
+    assert d.conn.table("jptradedata").count().execute() == count
+    assert_frame_equal(df1.sort(df1.columns), df2.sort(df2.columns))
+
+
+def test_indexes(setup_database):
+    d = setup_database
+    d.create_indexes()
+    d.create_indexes()
+    indexes = d.conn.sql(
+        "SELECT table_name FROM duckdb_indexes() ORDER BY table_name"
+    ).to_polars()
+
+    assert indexes["table_name"].to_list() == ["countrytable", "htstable", "naicstable"]
+    assert (
+        d.process_int_jp(level="hts", time_frame="yearly", level_filter="01")
+        .count()
+        .execute()
+        > 0
+    )
@@ -0,0 +1,71 @@
+import pytest
+from polars.testing import assert_frame_equal
+import polars as pl
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    default = new_database(name="default")
+    compact = new_database(name="compact", compact=True)
+    yield default, compact
+
+
+def test_schema(setup_database):
+    default, compact = setup_database
+    schema = compact.conn.table("jptradedata").schema()
+    constraints = compact.conn.raw_sql(
+        """
+        SELECT COUNT(*) FROM duckdb_constraints()
+        WHERE table_name IN ('jptradedata', 'inttradedata')
+        """
+    ).fetchone()[0]
+
+    assert "id" not in schema
+    assert schema["date"].is_date() and schema["trade_id"].is_int8()
+    assert constraints == 0
+
+
+def test_sorted(setup_database):
+    default, compact = setup_database
+    df = compact.conn.sql(
+        "SELECT date, hts_id FROM jptradedata ORDER BY rowid"
+    ).to_polars()
+
+    assert df.equals(df.sort(["date", "hts_id"], nulls_last=True, maintain_order=True))
+
+
+@pytest.mark.parametrize("level", ["total", "naics", "hts", "country"])
+def test_results(setup_database, level):
+    default, compact = setup_database
+    df1 = default.process_int_jp(level=level, time_frame="monthly").to_polars()
+    df2 = compact.process_int_jp(level=level, time_frame="monthly").to_polars()
+
+    # The ids keep the narrow types of the compact fact tables
+    assert_frame_equal(df1.sort(df1.columns), df2.sort(df2.columns), check_dtypes=False)
+
+
+def test_references(setup_database, tmp_path):
+    default, compact = setup_database
+    staging = str(tmp_path / "staging.parquet")
+    pl.DataFrame({"hts_id": [1, 10**6], "country_id": [1, None]}).write_parquet(staging)
+
+    with pytest.raises(ValueError, match="hts_id not in htstable"):
+        compact.check_references(staging)
+
+
+def test_references_before_delete(setup_database, monkeypatch):
+    default, compact = setup_database
+    df = compact.conn.table("jptradedata").to_polars()
+    month = df["date"].max()
+    rows = df.filter(date=month)
+    deleted = []
+    monkeypatch.setattr(compact, "delete_months", lambda *args: deleted.append(args))
+
+    with pytest.raises(ValueError, match="hts_id not in htstable"):
+        compact.insert_fact(
+            "jptradedata", rows.with_columns(hts_id=10**6).lazy(), [month]
+        )
+    df = compact.conn.table("jptradedata").to_polars()
+
+    assert deleted == []
+    assert_frame_equal(df.filter(date=month), rows)
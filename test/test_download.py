@@ -0,0 +1,125 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.data.data_pull import DataPull
+import threading
+import hashlib
+import pytest
+import os
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves a file with ETag, Last-Modified and byte range support."""
+
+    content = b""
+    ranges = True
+    requests = []
+    failing = set()
+
+    def send_headers(self, status, length):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", hashlib.md5(self.content).hexdigest())
+        self.send_header("Last-Modified", "Mon, 06 Jan 2025 00:00:00 GMT")
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", None))
+        self.send_headers(200, len(self.content))
+
+    def do_GET(self):
+        byte_range = self.headers.get("Range")
+        self.requests.append(("GET", byte_range))
+        if byte_range in self.failing:
+            self.send_headers(500, 0)
+            return
+        if byte_range is None or not self.ranges:
+            self.send_headers(200, len(self.content))
+            self.wfile.write(self.content)
+            return
+        start, end = map(int, byte_range.split("=")[1].split("-"))
+        body = self.content[start : end + 1]
+        self.send_headers(206, len(body))
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/jp_data.csv"
+    server.shutdown()
+
+
+@pytest.fixture
+def data_pull(tmp_path):
+    saving_dir = str(tmp_path) + "/"
+    d = DataPull(saving_dir, saving_dir + "test.ddb", saving_dir + "test.log")
+    d.range_size = 1000
+    d.http_retries = 0
+    RangeHandler.content = os.urandom(10_500)
+    RangeHandler.ranges = True
+    RangeHandler.requests = []
+    RangeHandler.failing = set()
+    return d
+
+
+def test_ranges(data_pull, server):
+    filename = data_pull.saving_dir + "raw/jp_data.csv"
+    data_pull.pull_file(server, filename)
+
+    with open(filename, "rb") as f:
+        assert f.read() == RangeHandler.content
+    assert len([r for r in RangeHandler.requests if r[0] == "GET"]) == 11
+    assert not os.path.exists(filename + ".part")
+
+
+def test_skip_unchanged(data_pull, server):
+    filename = data_pull.saving_dir + "raw/jp_data.csv"
+    data_pull.pull_file(server, filename)
+    RangeHandler.requests = []
+    data_pull.pull_file(server, filename)
+
+    assert RangeHandler.requests == [("HEAD", None)]
+
+
+def test_download_changed(data_pull, server):
+    filename = data_pull.saving_dir + "raw/jp_data.csv"
+    data_pull.pull_file(server, filename)
+    RangeHandler.content = os.urandom(2_500)
+    data_pull.pull_file(server, filename)
+
+    with open(filename, "rb") as f:
+        assert f.read() == RangeHandler.content
+
+
+def test_resume(data_pull, server):
+    filename = data_pull.saving_dir + "raw/jp_data.csv"
+    RangeHandler.failing = {"bytes=3000-3999"}
+    with pytest.raises(Exception):
+        data_pull.pull_file(server, filename, workers=1)
+    assert not os.path.exists(filename)
+
+    RangeHandler.failing = set()
+    RangeHandler.requests = []
+    data_pull.pull_file(server, filename, workers=1)
+
+    with open(filename, "rb") as f:
+        assert f.read() == RangeHandler.content
+    # Only the ranges that were not finished are requested again
+    assert ("GET", "bytes=0-999") not in RangeHandler.requests
+    assert ("GET", "bytes=3000-3999") in RangeHandler.requests
+
+
+def test_no_ranges(data_pull, server):
+    filename = data_pull.saving_dir + "raw/jp_data.csv"
+    RangeHandler.ranges = False
+    data_pull.pull_file(server, filename)
+
+    with open(filename, "rb") as f:
+        assert f.read() == RangeHandler.content
+    assert RangeHandler.requests == [("HEAD", None), ("GET", None)]
@@ -0,0 +1,66 @@
+import pytest
+from polars.testing import assert_frame_equal
+import polars as pl
+import shutil
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database(insert=())
+    shutil.copy("data/external/code_classification.json", d.saving_dir + "external/")
+    # Some rows have no NAICS code, they are kept with a null category
+    raw = pl.read_parquet(d.jp_data).with_row_index()
+    raw = raw.with_columns(
+        naics=pl.when(pl.col("index") % 10 == 0).then(None).otherwise(pl.col("naics"))
+    )
+    raw.drop("index").write_parquet(d.jp_data)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    yield d
+
+
+@pytest.mark.parametrize("time_frame", ["yearly", "fiscal", "qrt", "monthly"])
+def test_group_totals(setup_database, time_frame):
+    d = setup_database
+    keys = d.time_columns[time_frame]
+    df1 = d.process_int_jp(level="total", time_frame=time_frame, group=True)
+    df1 = (
+        df1.to_polars()
+        .group_by(keys)
+        .agg(pl.col("imports", "exports").sum())
+        .sort(keys)
+    )
+    df2 = d.process_int_jp(level="total", time_frame=time_frame).to_polars()
+    df2 = df2.select(keys + ["imports", "exports"]).sort(keys)
+
+    assert_frame_equal(df1, df2, check_dtypes=False)
+
+
+def test_longest_prefix(setup_database):
+    d = setup_database
+    df = (
+        d.process_int_jp(level="naics", time_frame="yearly", group=True)
+        .to_polars()
+        .group_by("category")
+        .agg(pl.col("imports").sum())
+    )
+    naics = d.process_int_jp(level="naics", time_frame="yearly").to_polars()
+    pharma = naics.filter(pl.col("naics_code").str.starts_with("3254"))
+    chemicals = naics.filter(
+        pl.col("naics_code").str.starts_with("325")
+        & ~pl.col("naics_code").str.starts_with("3254")
+    )
+
+    assert df.filter(category="Farmacéuticos y medicinas")["imports"].item() == (
+        pharma["imports"].sum()
+    )
+    assert df.filter(category="Químicos")["imports"].item() == (
+        chemicals["imports"].sum()
+    )
+
+
+def test_group_invalid(setup_database):
+    d = setup_database
+    with pytest.raises(ValueError):
+        d.process_int_jp(level="hts", time_frame="yearly", group=True)
+    with pytest.raises(ValueError):
+        d.process_int_org(level="total", time_frame="yearly", group=True)
@@ -0,0 +1,99 @@
+import pytest
+from polars.testing import assert_frame_equal
+import polars as pl
+import duckdb
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    full = new_database(insert=("jp",), name="full")
+
+    incremental = new_database(insert=(), name="incremental")
+    raw = pl.read_parquet("test/test_inserts/jp_data_sample.parquet")
+    raw.filter(pl.col("Year") < 2020).write_parquet(incremental.jp_data)
+    incremental.insert_int_jp(incremental.jp_data, "data/external/code_agr.json")
+    hts = incremental.conn.table("htstable").to_polars()
+    raw.write_parquet(incremental.jp_data)
+    months = incremental.insert_int_jp(
+        incremental.jp_data, "data/external/code_agr.json"
+    )
+    yield full, incremental, hts, months
+
+
+def test_only_new_months(setup_database):
+    full, incremental, hts, months = setup_database
+    assert min(months).year == 2020
+    assert (
+        incremental.insert_int_jp(incremental.jp_data, "data/external/code_agr.json")
+        == []
+    )
+
+
+def test_ids_not_renumbered(setup_database):
+    full, incremental, hts, months = setup_database
+    df1 = (
+        incremental.conn.table("htstable")
+        .to_polars()
+        .filter(pl.col("id").is_in(hts["id"]))
+    )
+    assert_frame_equal(df1.sort("id"), hts.sort("id"))
+
+
+@pytest.mark.parametrize("level", ["total", "naics", "hts", "country"])
+def test_incremental_results(setup_database, level):
+    full, incremental, hts, months = setup_database
+    code = {
+        "total": [],
+        "naics": ["naics_code"],
+        "hts": ["hts_code"],
+        "country": ["cty_code"],
+    }
+    df1 = incremental.process_int_jp(level=level, time_frame="monthly").to_polars()
+    df2 = full.process_int_jp(level=level, time_frame="monthly").to_polars()
+    keys = ["year", "month"] + code[level]
+    df1 = df1.select(keys + ["imports", "exports"]).sort(keys)
+    df2 = df2.select(keys + ["imports", "exports"]).sort(keys)
+
+    assert_frame_equal(df1, df2, check_dtypes=False)
+
+
+def test_failed_insert_keeps_months(new_database):
+    d = new_database(insert=("jp",), name="failed")
+    count = "SELECT COUNT(*) FROM jptradedata WHERE date = '2020-01-01'"
+    rows = d.conn.raw_sql(count).fetchone()[0]
+    raw = pl.read_parquet("test/test_inserts/jp_data_sample.parquet")
+    # A revised month with a value that does not fit in the data column
+    revised = (pl.col("Year") == 2020) & (pl.col("Month") == 1)
+    raw.with_columns(
+        data=pl.when(revised).then(2**40).otherwise(pl.col("data"))
+    ).write_parquet(d.jp_data)
+
+    with pytest.raises(duckdb.Error):
+        d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+
+    assert rows > 0
+    assert d.conn.raw_sql(count).fetchone()[0] == rows
+
+
+def test_new_codes_reload_org(new_database):
+    full = new_database(name="full_org")
+    d = new_database(insert=(), name="codes")
+    raw = pl.read_parquet("test/test_inserts/jp_data_sample.parquet")
+    raw.filter(pl.col("Year") < 2020).write_parquet(d.jp_data)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    d.insert_int_org(d.org_data)
+    query = "SELECT COUNT(*) FROM inttradedata WHERE hts_id IS NULL"
+    before = d.conn.raw_sql(query).fetchone()[0]
+    raw.write_parquet(d.jp_data)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    df1 = d.process_int_org(level="hts", time_frame="monthly").to_polars()
+    df2 = full.process_int_org(level="hts", time_frame="monthly").to_polars()
+    # The ids of the two databases differ, the rows are compared by code
+    keys = ["year", "month", "hts_code"]
+    df1 = df1.select(keys + ["imports", "exports"]).sort(keys)
+    df2 = df2.select(keys + ["imports", "exports"]).sort(keys)
+    nulls = [db.conn.raw_sql(query).fetchone()[0] for db in [d, full]]
+
+    assert before > nulls[1]
+    assert nulls[0] == nulls[1]
+    assert_frame_equal(df1, df2, check_dtypes=False)
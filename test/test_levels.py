@@ -0,0 +1,68 @@
+import pytest
+from src.data.data_process import DataTrade
+from polars.testing import assert_frame_equal
+import polars as pl
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    yield new_database()
+
+
+@pytest.mark.parametrize(
+    "source,level",
+    [
+        ("jp", "hts2"),
+        ("jp", "hts4"),
+        ("jp", "hts8"),
+        ("jp", "naics2"),
+        ("jp", "naics4"),
+        ("org", "hts2"),
+        ("org", "hts6"),
+    ],
+)
+def test_prefix_levels(setup_database, source, level):
+    d = setup_database
+    process = d.process_int_jp if source == "jp" else d.process_int_org
+    base = level.rstrip("0123456789")
+    digits = int(level[len(base) :])
+    code = f"{base}_code"
+
+    df1 = process(level=level, time_frame="qrt").to_polars()
+    df2 = process(level=base, time_frame="qrt").to_polars()
+    df2 = (
+        df2.with_columns(pl.col(code).str.slice(0, digits))
+        .filter(pl.col(code).str.contains(f"^[0-9]{{{digits}}}$"))
+        .group_by(["year", "qrt", code])
+        .agg(pl.col("imports", "exports").sum())
+    )
+    keys = ["year", "qrt", code]
+    df1 = df1.filter(pl.col(level).is_not_null()).select(keys + ["imports", "exports"])
+
+    assert_frame_equal(df1.sort(keys), df2.sort(keys), check_dtypes=False)
+
+
+def test_prefix_filter(setup_database):
+    d = setup_database
+    df = d.process_int_jp(level="hts4", time_frame="yearly", level_filter="02")
+    df = df.to_polars()
+
+    assert df["hts_code"].str.starts_with("02").all()
+    with pytest.raises(ValueError):
+        d.process_int_org(level="naics3", time_frame="yearly")
+
+
+def test_add_prefix_columns(tmp_path):
+    saving_dir = str(tmp_path) + "/"
+    d = DataTrade(saving_dir, saving_dir + "test.ddb", saving_dir + "test.log")
+    d.conn.raw_sql(
+        """
+        CREATE TABLE naicstable (id INTEGER, naics_code TEXT, naics_description TEXT);
+        INSERT INTO naicstable VALUES (1, '311111', 'a'), (2, '33641X', 'b');
+        """
+    )
+    d.add_prefix_columns("naicstable", "naics")
+    df = d.conn.table("naicstable").to_polars().sort("id")
+
+    assert df["naics3"].to_list() == [311, 336]
+    assert df["naics6"].to_list() == [311111, None]
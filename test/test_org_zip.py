@@ -0,0 +1,48 @@
+from src.data.data_pull import DataPull
+from polars.testing import assert_frame_equal
+import polars as pl
+import zipfile
+import pytest
+import io
+import os
+
+
+@pytest.fixture(scope="module")
+def setup_zip(tmp_path_factory):
+    saving_dir = str(tmp_path_factory.mktemp("data")) + "/"
+    d = DataPull(saving_dir, saving_dir + "test.ddb", saving_dir + "test.log")
+    raw = pl.read_parquet("test/test_inserts/org_data_sample.parquet")
+
+    # Same layout as the IEPR file, a zip with one zip per flow
+    with zipfile.ZipFile(saving_dir + "raw/tmp.zip", "w") as outer:
+        for flow, name in [("i", "IMPORT"), ("e", "EXPORT")]:
+            csv = raw.filter(pl.col("import_export") == flow).write_csv()
+            if flow == "e":
+                csv += "e,CANADA,2020,1,not a number,kg,1,,0,0101000000,x\n"
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as inner:
+                inner.writestr(f"{name}_HTS10_ALL.csv", csv)
+            outer.writestr(f"{name}_HTS10_ALL.zip", buffer.getvalue())
+
+    d.zip_to_parquet(
+        saving_dir + "raw/tmp.zip",
+        ["IMPORT_HTS10_ALL.zip", "EXPORT_HTS10_ALL.zip"],
+        saving_dir + "raw/org_data.parquet",
+        d.org_schema,
+    )
+    yield d, raw
+
+
+def test_no_extraction(setup_zip):
+    d, raw = setup_zip
+    assert sorted(os.listdir(d.saving_dir + "raw")) == ["org_data.parquet", "tmp.zip"]
+
+
+def test_zip_to_parquet(setup_zip):
+    d, raw = setup_zip
+    df = pl.read_parquet(d.saving_dir + "raw/org_data.parquet")
+    bad = df.filter(pl.col("value").is_null())
+    df = df.filter(pl.col("value").is_not_null())
+
+    assert len(bad) == 1
+    assert_frame_equal(df.sort(df.columns), raw.sort(raw.columns))
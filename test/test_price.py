@@ -0,0 +1,57 @@
+import pytest
+from polars.testing import assert_frame_equal
+import polars as pl
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database(insert=("jp",))
+    raw = pl.read_parquet("test/test_inserts/org_data_sample.parquet")
+    raw.filter(pl.col("year") < 2023).write_parquet(d.org_data)
+    d.insert_int_org(d.org_data)
+    raw.write_parquet(d.org_data)
+    months = d.insert_int_org(d.org_data)
+    yield d, months
+
+
+def test_incremental_panel(setup_database):
+    d, months = setup_database
+    name = d.rollup_name("inttradedata", "price")
+    df1 = d.conn.table(name).to_polars().sort("date", "hs4")
+    d.build_price()
+    df2 = d.conn.table(name).to_polars().sort("date", "hs4")
+
+    assert min(months).year == 2023
+    assert_frame_equal(df1, df2)
+
+
+@pytest.mark.parametrize("lookback", [0, 6, 13, 24])
+def test_lookback(setup_database, lookback):
+    d, months = setup_database
+    df = d.process_price(lookback=lookback).to_polars()
+
+    assert df["date"].n_unique() <= lookback + 1
+    assert df["date"].max() == max(months)
+
+
+def test_agriculture_ranks(setup_database):
+    d, months = setup_database
+    df1 = d.process_price().to_polars()
+    df2 = d.process_price(agriculture_filter=True).to_polars()
+    last = df2.filter(pl.col("date") == pl.col("date").max())
+
+    assert len(df2) < len(df1)
+    assert set(df2["hs4"]) <= set(df1["hs4"])
+    # Ranks are computed after filtering
+    assert last["moving_import_rank"].drop_nulls().min() == 0
+
+
+def test_price_date(setup_database, monkeypatch):
+    d, months = setup_database
+    assert d.price_date.date() == max(months)
+
+    # The window starts from the last month loaded at bootstrap, not a query
+    monkeypatch.setattr(d, "price_date", min(months))
+    df = d.process_price(lookback=0).to_polars()
+
+    assert df["date"].min() == min(months)
@@ -0,0 +1,50 @@
+import pytest
+from src.data.data_profile import QueryProfiler
+from polars.testing import assert_frame_equal
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    records = []
+    profiler = QueryProfiler(callback=records.append, explain=True)
+    d = new_database(insert=("jp",), profiler=profiler)
+    yield d, records
+
+
+def test_insert_events(setup_database):
+    d, records = setup_database
+    inserts = [r for r in records if r["event"] == "insert"]
+    builds = [r["table"] for r in records if r["event"] == "build"]
+
+    assert inserts[0]["table"] == "jptradedata" and inserts[0]["months"] > 0
+    assert "jptradedata_hts" in builds
+
+
+def test_query_record(setup_database):
+    d, records = setup_database
+    records.clear()
+    df1 = d.process_int_jp("hts", "yearly", level_filter="0").to_polars()
+    d.profiler, profiler = None, d.profiler
+    df2 = d.process_int_jp("hts", "yearly", level_filter="0").to_polars()
+    d.profiler = profiler
+    record = records[0]
+
+    assert_frame_equal(df1, df2)
+    assert record["event"] == "query" and record["method"] == "process_int_jp"
+    assert set(record["phases"]) == {"build", "compile", "execute", "convert"}
+    assert record["rows_returned"] == len(df1)
+    assert record["sql"].startswith("SELECT")
+    assert record["table_rows"] > 0
+
+
+def test_report(setup_database):
+    d, records = setup_database
+    d.profiler.clear()
+    for prefix in ["0", "1", "2"]:
+        d.process_int_jp("hts", "monthly", level_filter=prefix)
+    d.process_int_jp("total", "yearly")
+    report = d.profiler.report()
+
+    assert len(report) == 2
+    assert report["calls"].sort().to_list() == [1, 3]
+    assert report["mean_seconds"].is_sorted(descending=True)
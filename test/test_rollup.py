@@ -0,0 +1,54 @@
+import pytest
+from polars.testing import assert_frame_equal
+import polars as pl
+import os
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database()
+    yield d
+    os.remove(d.data_file)
+
+
+@pytest.mark.parametrize("table", ["jptradedata", "inttradedata"])
+@pytest.mark.parametrize("time", ["yearly", "fiscal", "qrt", "monthly"])
+def test_rollup_matches_fact(setup_database, table, time):
+    d = setup_database
+    fact = d.conversion(d.conn.table(table))
+    for level in d.rollup_levels[table]:
+        df1 = d.process_data([time, level], d.conn.table(d.rollup_name(table, level)))
+        df2 = d.process_data([time, level], fact)
+        keys = [
+            col
+            for col in df1.columns
+            if col not in ("imports", "exports", "qty_imports", "qty_exports")
+        ]
+        df1 = df1.to_polars().sort(keys)
+        df2 = df2.to_polars().sort(keys)
+
+        assert_frame_equal(df1, df2, check_dtypes=False)
+
+
+def test_calendar_table(setup_database):
+    d = setup_database
+    df = d.conn.table("calendartable").to_polars()
+    df = df.filter(pl.col("month").is_in([6, 7, 9, 10]))
+
+    assert (df["qrt"] == (df["month"] - 1) // 3 + 1).all()
+    assert (df["fiscal_year"] == df["year"] + (df["month"] > 6)).all()
+
+
+@pytest.mark.parametrize("prefix", ["", "0", "87", "8703", "9999999999"])
+def test_code_index(setup_database, prefix):
+    d = setup_database
+    hts = d.conn.table("htstable")
+    ids = hts.filter(hts.hts_code.startswith(prefix)).id.to_pyarrow().to_pylist()
+
+    assert sorted(d.lookup_codes("hts", prefix)) == sorted(ids)
+
+
+def test_invalid_code(setup_database):
+    d = setup_database
+    with pytest.raises(ValueError):
+        d.process_int_jp(level="naics", time_frame="yearly", level_filter="ABC")
@@ -0,0 +1,82 @@
+import pytest
+from src.data.data_process import DataTrade
+from src.models import close_database
+from polars.testing import assert_frame_equal
+import polars as pl
+import subprocess
+import sys
+import os
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    duckdb = new_database(name="duckdb", storage="duckdb")
+    parquet = new_database(name="parquet", storage="parquet")
+    yield duckdb, parquet
+
+
+def test_partitions(setup_database):
+    duckdb, parquet = setup_database
+    path = os.path.join(parquet.fact_dir("jptradedata"), "year=2020", "month=1")
+    assert sorted(os.listdir(path)) == ["trade_id=1", "trade_id=2"]
+
+
+@pytest.mark.parametrize("table", ["jptradedata", "inttradedata"])
+def test_parquet_facts(setup_database, table):
+    duckdb, parquet = setup_database
+    columns = ["date", "trade_id", "hts_id", "country_id", "data", "qty_kg"]
+    df1 = parquet.conn.table(table).select(columns).to_polars()
+    df2 = duckdb.conn.table(table).select(columns).to_polars()
+    df1 = df1.with_columns(pl.col("date").cast(pl.Date)).sort(columns)
+    df2 = df2.with_columns(pl.col("date").cast(pl.Date)).sort(columns)
+
+    assert_frame_equal(df1, df2, check_dtypes=False)
+
+
+def test_partition_pruning(setup_database):
+    duckdb, parquet = setup_database
+    plan = parquet.conn.raw_sql(
+        """
+        EXPLAIN ANALYZE SELECT SUM(data) FROM jptradedata
+        WHERE year = 2020 AND month BETWEEN 1 AND 3 AND trade_id = 1
+        """
+    ).fetchall()[0][1]
+    scanned = plan.split("Scanning Files: ")[1].split(" ")[0]
+
+    assert scanned.split("/")[0] == "3"
+
+
+def test_read_only(setup_database, tmp_path):
+    duckdb, parquet = setup_database
+    df1 = parquet.process_int_jp(level="total", time_frame="yearly").to_polars()
+    # The writable handle is closed so the file is really opened read only,
+    # while a second process holds it read only too
+    close_database(parquet.data_file)
+    reader = DataTrade(
+        parquet.saving_dir,
+        parquet.data_file,
+        parquet.saving_dir + "test.log",
+        storage="parquet",
+        read_only=True,
+    )
+    output = str(tmp_path / "worker.parquet")
+    script = f"""
+from src.data.data_process import DataTrade
+d = DataTrade(
+    {parquet.saving_dir!r},
+    {parquet.data_file!r},
+    {parquet.saving_dir + "worker.log"!r},
+    storage="parquet",
+    read_only=True,
+)
+df = d.process_int_jp(level="total", time_frame="yearly").to_polars()
+df.write_parquet({output!r})
+"""
+    subprocess.run([sys.executable, "-c", script], check=True)
+    df2 = reader.process_int_jp(level="total", time_frame="yearly").to_polars()
+    df3 = pl.read_parquet(output)
+
+    assert_frame_equal(df1.sort("year"), df2.sort("year"))
+    assert_frame_equal(df1.sort("year"), df3.sort("year"))
+    with pytest.raises(Exception, match="read-only"):
+        reader.conn.raw_sql("CREATE TABLE written (id INTEGER)")
@@ -0,0 +1,58 @@
+import pytest
+from src.data.data_synthetic import DataSynthetic
+from src.data.data_pull import DataPull
+import polars as pl
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database(insert=())
+    data = DataSynthetic(hts_codes=2_000, countries=50, start_year=2015, seed=1)
+    data.write_jp(d.jp_data, 60_000, chunk_size=25_000)
+    data.write_org(d.org_data, 20_000, chunk_size=25_000)
+    d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    d.insert_int_org(d.org_data)
+    yield d
+
+
+def test_schemas(setup_database):
+    d = setup_database
+    jp = pl.read_parquet(d.jp_data)
+    org = pl.read_parquet(d.org_data)
+
+    assert len(jp) == 60_000 and len(org) == 20_000
+    assert jp.schema == pl.Schema(DataPull.jp_schema)
+    assert org.schema == pl.Schema(DataPull.org_schema)
+    assert jp["Year"].min() == 2015 and jp["Year"].max() == 2024
+
+
+def test_skew(setup_database):
+    d = setup_database
+    jp = pl.read_parquet(d.jp_data)
+    counts = jp["Commodity_Code"].value_counts(sort=True)["count"]
+
+    assert jp["Commodity_Code"].n_unique() <= 2_000
+    assert jp["cty_code"].n_unique() == 50
+    # The 1% most frequent codes have a large share of the rows
+    assert counts[:20].sum() > 0.25 * len(jp)
+
+
+def test_seed():
+    df1 = DataSynthetic(hts_codes=500, seed=3).jp_chunk(1_000)
+    df2 = DataSynthetic(hts_codes=500, seed=3).jp_chunk(1_000)
+    df3 = DataSynthetic(hts_codes=500, seed=4).jp_chunk(1_000)
+
+    assert df1.equals(df2)
+    assert not df1.equals(df3)
+
+
+def test_loaded(setup_database):
+    d = setup_database
+    jp = d.conn.table("jptradedata").to_polars()
+    org = d.conn.table("inttradedata").to_polars()
+
+    assert len(jp) == 60_000
+    assert jp["naics_id"].null_count() == 0
+    # The org countries and units are the ones of the jp data
+    assert org["country_id"].null_count() == 0
+    assert org["unit1_id"].null_count() == 0
@@ -0,0 +1,61 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from src.data.data_process import DataTrade
+from src.models import get_conn
+from polars.testing import assert_frame_equal
+import threading
+
+requests = [
+    ("hts", "monthly", "2020-01-01+2021-06-01", "0"),
+    ("naics", "yearly", "", "3"),
+    ("country", "qrt", "2019-01-01+2020-12-01", ""),
+    ("total", "fiscal", "", ""),
+    ("hts4", "monthly", "2020-01-01+2020-12-01", "1"),
+]
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database(insert=("jp",))
+    expected = [query(d, request) for request in requests]
+    yield d, expected
+
+
+def query(d, request):
+    level, time_frame, datetime, level_filter = request
+    df = d.process_int_jp(
+        level=level,
+        time_frame=time_frame,
+        datetime=datetime,
+        level_filter=level_filter,
+    ).to_polars()
+    return df.sort(df.columns)
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_concurrent_queries(setup_database, cache):
+    d, expected = setup_database
+    reader = DataTrade(
+        d.saving_dir,
+        d.data_file,
+        d.saving_dir + "test.log",
+        read_only=True,
+        cache=cache,
+    )
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda i: query(reader, requests[i % 5]), range(40)))
+
+    for i, df in enumerate(results):
+        assert_frame_equal(df, expected[i % 5])
+
+
+def test_shared_handle(setup_database):
+    d, expected = setup_database
+    conns = []
+    thread = threading.Thread(target=lambda: conns.append(get_conn(d.data_file)))
+    thread.start()
+    thread.join()
+
+    assert get_conn(d.data_file) is get_conn(d.data_file)
+    assert conns[0] is not get_conn(d.data_file)
+    assert conns[0].sql("SELECT COUNT(*) FROM jptradedata").fetchone()[0] > 0
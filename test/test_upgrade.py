@@ -0,0 +1,124 @@
+import pytest
+from polars.testing import assert_frame_equal
+import polars as pl
+import json
+
+
+def downgrade(d):
+    # Turns the database back into one made before the conversion factors, the
+    # calendar columns and the rollups
+    tables = d.conn.list_tables()
+    for table in tables:
+        if table.startswith("jptradedata_") or table in [
+            "calendartable",
+            "versiontable",
+        ]:
+            d.conn.drop_table(table)
+    d.conn.raw_sql(
+        """
+        CREATE TEMP TABLE facts AS SELECT * FROM jptradedata;
+        CREATE TEMP TABLE units AS SELECT id, unit_code FROM unittable;
+        DROP TABLE jptradedata;
+        DROP TABLE unittable;
+        CREATE TABLE unittable (
+            id INTEGER PRIMARY KEY DEFAULT nextval('unit_sequence'),
+            unit_code TEXT
+        );
+        INSERT INTO unittable SELECT * FROM units;
+        """
+    )
+    start = d.conn.raw_sql("SELECT MAX(id) + 1 FROM facts").fetchone()[0]
+    d.conn.raw_sql(
+        f"""
+        CREATE OR REPLACE SEQUENCE jp_trade_data_sequence START {start};
+        CREATE TABLE jptradedata (
+            id INTEGER PRIMARY KEY DEFAULT nextval('jp_trade_data_sequence'),
+            trade_id INTEGER REFERENCES tradetable(id),
+            hts_id INTEGER DEFAULT 1 REFERENCES htstable(id),
+            country_id INTEGER REFERENCES countrytable(id),
+            district_id INTEGER REFERENCES districttable(id),
+            sitc_id INTEGER REFERENCES sitctable(id),
+            naics_id INTEGER REFERENCES naicstable(id),
+            data INTEGER DEFAULT 0,
+            end_use_i INTEGER,
+            end_use_e INTEGER,
+            unit1_id INTEGER REFERENCES unittable(id),
+            qty_1 BIGINT DEFAULT 0,
+            unit2_id INTEGER REFERENCES unittable(id),
+            qty_2 BIGINT DEFAULT 0,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO jptradedata BY NAME
+        SELECT * EXCLUDE (qty_kg, year, month, qrt, fiscal_year) FROM facts;
+        """
+    )
+
+
+@pytest.fixture(scope="module")
+def setup_database(new_database):
+    d = new_database(insert=("jp",), name="old")
+    downgrade(d)
+    months = d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+    new = new_database(insert=("jp",), name="new")
+    yield d, new, months
+
+
+def test_conv_factor_added(setup_database):
+    d, new, months = setup_database
+    with open("data/external/code_units.json") as file:
+        factors = json.load(file)
+    units = d.conn.table("unittable").to_polars()
+    units = dict(zip(units["unit_code"], units["conv_factor"]))
+
+    assert all(
+        units[code] == factor for code, factor in factors.items() if code in units
+    )
+
+
+def test_fact_columns_added(setup_database):
+    d, new, months = setup_database
+    df = d.conn.table("jptradedata").to_polars()
+    expected = d.calendar_columns(df.lazy().select("date")).collect()
+
+    assert months == []
+    assert df["qty_kg"].null_count() == 0
+    assert_frame_equal(
+        df.select("year", "month", "qrt", "fiscal_year"),
+        expected.select("year", "month", "qrt", "fiscal_year"),
+        check_dtypes=False,
+    )
+
+
+@pytest.mark.parametrize("level", ["total", "naics", "hts", "country"])
+def test_results(setup_database, level):
+    d, new, months = setup_database
+    df1 = d.process_int_jp(level=level, time_frame="fiscal").to_polars()
+    df2 = new.process_int_jp(level=level, time_frame="fiscal").to_polars()
+
+    assert_frame_equal(df1.sort(df1.columns), df2.sort(df2.columns))
+
+
+def test_changed_factor_reloads_months(new_database):
+    d = new_database(insert=("jp",), name="factor")
+    with open("data/external/code_units.json") as file:
+        factors = json.load(file)
+    factors["t"] = 907.18
+    with open(d.saving_dir + "external/code_units.json", "w") as file:
+        json.dump(factors, file)
+    months = d.insert_int_jp(d.jp_data, "data/external/code_agr.json")
+
+    raw = pl.read_parquet("test/test_inserts/jp_data_sample.parquet")
+    raw = raw.filter(pl.col("Commodity_Code").is_not_null()).with_columns(
+        pl.col("unit_1").str.to_lowercase(),
+        date=pl.date(pl.col("Year"), pl.col("Month"), 1),
+    )
+    tons = raw.filter((pl.col("unit_1") == "t") & (pl.col("qty_1") != 0))
+    factors = {code: float(factor) for code, factor in factors.items()}
+    factor = pl.col("unit_1").replace_strict(factors, default=1.0)
+    expected = raw.select((pl.col("qty_1") * factor).sum()).item()
+    qty_kg = d.conn.raw_sql("SELECT SUM(qty_kg) FROM jptradedata").fetchone()[0]
+    unit = d.conn.raw_sql("SELECT conv_factor FROM unittable WHERE unit_code = 't'")
+
+    assert unit.fetchone()[0] == 907.18
+    assert months == tons["date"].unique().sort().to_list()
+    assert qty_kg == pytest.approx(expected)